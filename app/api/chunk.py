@@ -1,18 +1,31 @@
-
 from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import Optional
-from openai import OpenAI
+from typing import List, Optional
 from app.core.db import get_db
-from app.core.config import settings
 from app.models.note import Note
-from app.services.chunking import chunk_and_store
+from app.services.chunking import embed_chunks, store_chunks
+from app.services.llm_scheduler import BACKFILL, INTERACTIVE
+from app.services.llm_telemetry import bind_user
+from app.services.note_context import build_note_context
 from app.core.security import get_current_user 
 from app.models.user import User        
 router = APIRouter(prefix="/chunk", tags=["chunking"])
 
+def _notes_to_backfill(db: Session, user_id: str, only_missing: bool) -> List[Note]:
+    base = db.query(Note).filter(Note.og_text != None, Note.user_id == user_id)  # ⟵ scope to owner
+    if only_missing:
+        return base.outerjoin(Note.chunks).filter(Note.chunks == None).all()
+    return base.all()
+
+def _store_and_commit(db: Session, note: Note, chunks: List[str], embeddings: list) -> int:
+    written = store_chunks(db, note, chunks, embeddings)
+    db.commit()
+    return written
+
+# Embedding calls go out at BACKFILL priority so a bulk job never delays interactive traffic.
 @router.post("/backfill")
-def backfill_chunks(
+async def backfill_chunks(
     only_missing: bool = Query(True),
     max_chars: int = Query(800, ge=200, le=2000),
     overlap: int = Query(80, ge=0, le=400),
@@ -21,24 +34,17 @@ def backfill_chunks(
     user: User = Depends(get_current_user),  
 
 ):
-    client: Optional[OpenAI] = None
-    if settings.OPENAI_API_KEY:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-    base = db.query(Note).filter(Note.og_text != None, Note.user_id == user.id)  # ⟵ scope to owner
-    if only_missing:
-        notes = base.outerjoin(Note.chunks).filter(Note.chunks == None).all()
-    else:
-        notes = base.all()
+    bind_user(user.id)
+    notes = await run_in_threadpool(_notes_to_backfill, db, user.id, only_missing)
 
     total = 0
     for n in notes:
-        total += chunk_and_store(db, n, client, embed_model, max_chars, overlap)
-    db.commit()
+        chunks, embeddings = await embed_chunks(n.og_text or "", embed_model, max_chars, overlap, priority=BACKFILL)
+        total += await run_in_threadpool(_store_and_commit, db, n, chunks, embeddings)
     return {"notes_processed": len(notes), "chunks_written": total}
 
 @router.post("/{note_id}")
-def chunk_one(
+async def chunk_one(
     note_id: str,
     max_chars: int = Query(800, ge=200, le=2000),
     overlap: int = Query(80, ge=0, le=400),
@@ -46,12 +52,32 @@ def chunk_one(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    client: Optional[OpenAI] = None
-    if settings.OPENAI_API_KEY:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    note = db.query(Note).filter(Note.note_id == note_id, Note.user_id == user.id).first()  # ⟵ owner check
+    bind_user(user.id)
+    note = await run_in_threadpool(
+        lambda: db.query(Note).filter(Note.note_id == note_id, Note.user_id == user.id).first()  # ⟵ owner check
+    )
     if not note:
         raise HTTPException(status_code=404, detail="note not found")
-    written = chunk_and_store(db, note, client, embed_model, max_chars, overlap)
-    db.commit()
+    chunks, embeddings = await embed_chunks(note.og_text or "", embed_model, max_chars, overlap, priority=INTERACTIVE)
+    written = await run_in_threadpool(_store_and_commit, db, note, chunks, embeddings)
     return {"note_id": str(note.note_id), "chunks_written": written}
+
+# Diagnostic: what note-grounded generation would send for this note, and how many
+# prompt tokens the chunk selection saves compared to the whole note.
+@router.get("/{note_id}/context")
+async def preview_note_context(
+    note_id: str,
+    subject: Optional[str] = Query(None),
+    topic: Optional[str] = Query(None),
+    budget_tokens: Optional[int] = Query(None, ge=200, le=32000),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    bind_user(user.id)
+    note = await run_in_threadpool(
+        lambda: db.query(Note).filter(Note.note_id == note_id, Note.user_id == user.id).first()
+    )
+    if not note:
+        raise HTTPException(status_code=404, detail="note not found")
+    ctx = await build_note_context(db, note, subject, topic, budget_tokens=budget_tokens, feature="preview")
+    return {"note_id": str(note.note_id), **ctx.report(), "text": ctx.text}
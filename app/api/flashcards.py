@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 from uuid import UUID
 import json
 import os
 
-from openai import OpenAI  # ✅ OpenAI SDK
 from pydantic import BaseModel
 
 from app.core.config import settings
@@ -21,9 +21,13 @@ from app.schemas.flashcard_gen import (
     FlashcardOut,
     FlashcardItems,
 )
+from app.services import llm_gateway
+from app.services.llm_telemetry import bind_user
+from app.services import single_flight
+from app.services.note_context import build_note_context
 
 # Reuse helpers from quizzes (no circular import)
-from app.api.quizzes import _assert_openai, _build_system
+from app.api.quizzes import _assert_openai, _build_system, _get_owned_note
 
 router = APIRouter(prefix="/flashcards", tags=["flashcards"])
 
@@ -152,20 +156,21 @@ def _strictify_schema(schema: dict) -> dict:
 
 
 # --- replace your _oai_json_call with this version ---
-def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str) -> dict:
+async def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str, use_cache: bool = True) -> dict:
     model_name = (
         getattr(settings, "OPENAI_MODEL", None)
         or os.getenv("OPENAI_MODEL")
         or "gpt-4o-mini"
     )
-    client = OpenAI(api_key=getattr(settings, "OPENAI_API_KEY", None) or os.getenv("OPENAI_API_KEY"))
 
     raw_schema = schema_model.model_json_schema()
     schema_name = raw_schema.get("title") or schema_model.__name__
     schema = _strictify_schema(raw_schema)
     try:
-        resp = client.chat.completions.create(
+        resp = await llm_gateway.chat_completion(
             model=model_name,
+            use_cache=use_cache,
+            feature="flashcards",
             messages=[
                 {"role": "system", "content": _build_system()},
                 {"role": "user", "content": user_prompt},
@@ -184,12 +189,7 @@ def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str) -> dict:
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"OpenAI error: {e}")
 
-    text = None
-    try:
-        text = resp.choices[0].message.content
-    except Exception:
-        pass
-
+    text = llm_gateway.message_text(resp)
     if not text:
         raise HTTPException(status_code=502, detail="OpenAI returned an empty response")
 
@@ -203,7 +203,7 @@ def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str) -> dict:
         except Exception:
             raise HTTPException(status_code=502, detail="OpenAI returned non-JSON content")
 
-def _openai_generate_flashcards(subject: str, topic: str, n: int, note_text: str | None = None) -> List[dict]:
+async def _openai_generate_flashcards(subject: str, topic: str, n: int, note_text: str | None = None, use_cache: bool = True) -> List[dict]:
     _assert_openai()
 
     if note_text:
@@ -211,7 +211,7 @@ def _openai_generate_flashcards(subject: str, topic: str, n: int, note_text: str
     else:
         user_prompt = _build_flashcard_prompt_general(subject=subject, topic=topic, n=n)
 
-    data = _oai_json_call(FlashcardItems, user_prompt)
+    data = await _oai_json_call(FlashcardItems, user_prompt, use_cache=use_cache)
 
     items = (data or {}).get("items") or []
     out: List[dict] = []
@@ -228,33 +228,9 @@ def _openai_generate_flashcards(subject: str, topic: str, n: int, note_text: str
 
     return out
 
-# ---------- Endpoints ----------
-
-@router.post("/generate-ai", response_model=FlashcardOut)
-def generate_ai_flashcards(
-    payload: GenerateWithoutNoteFC,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
-) -> Dict[str, Any]:
-    items = _openai_generate_flashcards(subject=payload.subject, topic=payload.topic, n=payload.num_items)
-
-    fc = Flashcard(
-        user_id=user.id,
-        note_id=None,
-        title=payload.title or (f"{payload.subject} · {payload.topic}".strip(" ·")),
-        subject=payload.subject,
-        topic=payload.topic or None,
-        source="ai_general",
-    )
-    db.add(fc)
-    db.flush()
-
-    for it in items:
-        db.add(FlashcardItem(flashcard_id=fc.id, front=it["front"], back=it["back"], hint=it.get("hint")))
-
-    db.commit()
-    db.refresh(fc)
+# ---------- Persistence ----------
 
+def _fc_to_dict(fc: Flashcard) -> Dict[str, Any]:
     return {
         "id": fc.id,
         "title": fc.title,
@@ -264,32 +240,24 @@ def generate_ai_flashcards(
         "items": [{"id": i.id, "front": i.front, "back": i.back, "hint": i.hint} for i in fc.items],
     }
 
-@router.post("/generate-ai-from-note", response_model=FlashcardOut)
-def generate_ai_flashcards_from_note(
-    payload: GenerateWithNoteFC,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+def _persist_flashcards(
+    db: Session,
+    *,
+    user_id: str,
+    note_id: Optional[UUID],
+    title: str,
+    subject: str,
+    topic: Optional[str],
+    source: str,
+    items: List[dict],
 ) -> Dict[str, Any]:
-    note: Optional[Note] = (
-        db.query(Note)
-        .filter(Note.note_id == payload.note_id, Note.user_id == user.id)
-        .first()
-    )
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
-    note_text = (note.og_text or "").strip()
-
-    items = _openai_generate_flashcards(
-        subject=payload.subject, topic=payload.topic, n=payload.num_items, note_text=note_text or None
-    )
-
     fc = Flashcard(
-        user_id=user.id,
-        note_id=payload.note_id,
-        title=payload.title or f"Flashcards from note {payload.note_id} · {payload.subject} · {payload.topic}".strip(),
-        subject=payload.subject,
-        topic=payload.topic or None,
-        source="ai_note",
+        user_id=user_id,
+        note_id=note_id,
+        title=title,
+        subject=subject,
+        topic=topic or None,
+        source=source,
     )
     db.add(fc)
     db.flush()
@@ -299,15 +267,72 @@ def generate_ai_flashcards_from_note(
 
     db.commit()
     db.refresh(fc)
+    return _fc_to_dict(fc)
 
-    return {
-        "id": fc.id,
-        "title": fc.title,
-        "subject": fc.subject,
-        "topic": fc.topic,
-        "source": fc.source,
-        "items": [{"id": i.id, "front": i.front, "back": i.back, "hint": i.hint} for i in fc.items],
-    }
+# ---------- Endpoints ----------
+
+@router.post("/generate-ai", response_model=FlashcardOut)
+async def generate_ai_flashcards(
+    payload: GenerateWithoutNoteFC,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    bind_user(user.id)
+
+    async def generate() -> Dict[str, Any]:
+        items = await _openai_generate_flashcards(
+            subject=payload.subject, topic=payload.topic, n=payload.num_items, use_cache=not payload.no_cache
+        )
+
+        return await run_in_threadpool(
+            _persist_flashcards,
+            db,
+            user_id=user.id,
+            note_id=None,
+            title=payload.title or (f"{payload.subject} · {payload.topic}".strip(" ·")),
+            subject=payload.subject,
+            topic=payload.topic,
+            source="ai_general",
+            items=items,
+        )
+
+    key = single_flight.request_key(user.id, "flashcards.generate-ai", payload)
+    return await single_flight.run(key, generate, endpoint="flashcards.generate-ai")
+
+@router.post("/generate-ai-from-note", response_model=FlashcardOut)
+async def generate_ai_flashcards_from_note(
+    payload: GenerateWithNoteFC,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    bind_user(user.id)
+
+    async def generate() -> Dict[str, Any]:
+        note: Optional[Note] = await run_in_threadpool(_get_owned_note, db, payload.note_id, user.id)
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        ctx = await build_note_context(db, note, payload.subject, payload.topic, feature="flashcards")
+        note_text = ctx.text
+
+        items = await _openai_generate_flashcards(
+            subject=payload.subject, topic=payload.topic, n=payload.num_items, note_text=note_text or None,
+            use_cache=not payload.no_cache,
+        )
+
+        return await run_in_threadpool(
+            _persist_flashcards,
+            db,
+            user_id=user.id,
+            note_id=payload.note_id,
+            title=payload.title or f"Flashcards from note {payload.note_id} · {payload.subject} · {payload.topic}".strip(),
+            subject=payload.subject,
+            topic=payload.topic,
+            source="ai_note",
+            items=items,
+        )
+
+    key = single_flight.request_key(user.id, "flashcards.generate-ai-from-note", payload)
+    return await single_flight.run(key, generate, endpoint="flashcards.generate-ai-from-note")
 
 @router.get("/mine")
 def list_my_flashcards(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
@@ -329,11 +354,4 @@ def get_flashcard(fc_id: int, db: Session = Depends(get_db), user: User = Depend
     fc = db.query(Flashcard).filter(Flashcard.id == fc_id, Flashcard.user_id == user.id).first()
     if not fc:
         raise HTTPException(status_code=404, detail="Flashcard set not found")
-    return {
-        "id": fc.id,
-        "title": fc.title,
-        "subject": fc.subject,
-        "topic": fc.topic,
-        "source": fc.source,
-        "items": [{"id": i.id, "front": i.front, "back": i.back, "hint": i.hint} for i in fc.items],
-    }
+    return _fc_to_dict(fc)
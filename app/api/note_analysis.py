@@ -1,36 +1,57 @@
 
 from __future__ import annotations
+import asyncio
 from uuid import UUID
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.core.db import get_db
+from sqlalchemy import desc, text
+from app.core.db import get_db, SessionLocal
 from app.core.security import get_current_user
 from app.models.user import User
 from app.models.note import Note
 from app.models.note_analysis import NoteAnalysis
 from app.services.analyzer import analyze_note_text, DEFAULT_SUBJECT
+from app.services.llm_telemetry import bind_user
+from app.services import analysis_jobs
+from app.api.sse import sse_event, sse_response
 
 router = APIRouter(prefix="/analysis", tags=["note-analysis"])
 
-@router.post("/{note_id}", summary="Run analysis on a note and save a snapshot")
-def analyze_one(
-    note_id: UUID,
-    subject: Optional[str] = Query(None, description="Override subject (e.g., physics)"),
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
-) -> dict:
-    note = db.query(Note).filter(Note.note_id == note_id, Note.user_id == user.id).first()
+def _analysis_out(rec: NoteAnalysis) -> dict:
+    return {
+        "analysis_id": str(rec.analysis_id),
+        "note_id": str(rec.note_id),
+        "subject": rec.subject,
+        "summary": rec.summary,
+        "blocks": rec.blocks,
+        "flags": rec.flags,
+        "meta": rec.meta,
+        "created_at": rec.created_at.isoformat(),
+    }
+
+def _load_note_text(db: Session, note_id: UUID, user_id: str) -> str:
+    note = db.query(Note).filter(Note.note_id == note_id, Note.user_id == user_id).first()
     if not note:
         raise HTTPException(status_code=404, detail="note not found")
     if not (note.og_text or "").strip():
         raise HTTPException(status_code=400, detail="note has no text to analyze")
+    return note.og_text
 
-    result = analyze_note_text(note.og_text, subject or DEFAULT_SUBJECT)
+def _latest_analysis(db: Session, note_id: UUID) -> Optional[dict]:
+    rec = (
+        db.query(NoteAnalysis)
+        .filter(NoteAnalysis.note_id == note_id)
+        .order_by(desc(NoteAnalysis.created_at))
+        .first()
+    )
+    return _analysis_out(rec) if rec else None
 
+def _save_analysis(db: Session, note_id: UUID, result: dict) -> dict:
     rec = NoteAnalysis(
-        note_id=note.note_id,
+        note_id=note_id,
         subject=result.get("subject"),
         summary=result.get("summary"),
         blocks=result.get("blocks"),
@@ -38,39 +59,178 @@ def analyze_one(
         meta=result.get("meta"),
     )
     db.add(rec); db.commit(); db.refresh(rec)
+    return _analysis_out(rec)
 
-    return {
-        "analysis_id": str(rec.analysis_id),
-        "note_id": str(rec.note_id),
-        "subject": rec.subject,
-        "summary": rec.summary,
-        "blocks": rec.blocks,
-        "flags": rec.flags,
-        "meta": rec.meta,
-        "created_at": rec.created_at.isoformat(),
-    }
+async def _run_analysis(
+    db: Session, note_id: UUID, text: str, subject: Optional[str], full: bool,
+    progress: Optional[analysis_jobs.AnalysisJob] = None,
+) -> dict:
+    # unchanged blocks / flag windows are reused from the latest snapshot
+    previous = None if full else await run_in_threadpool(_latest_analysis, db, note_id)
+
+    result = await analyze_note_text(
+        text, subject or DEFAULT_SUBJECT, previous=previous,
+        progress=progress.update if progress else None,
+    )
+    if progress:
+        progress.update("saving")
+    return await run_in_threadpool(_save_analysis, db, note_id, result)
+
+async def _analysis_job(job: analysis_jobs.AnalysisJob, note_id: UUID, text: str, subject: Optional[str], full: bool) -> str:
+    # own session: the request that started the job is long gone
+    db = SessionLocal()
+    try:
+        out = await _run_analysis(db, note_id, text, subject, full, progress=job)
+        return out["analysis_id"]
+    finally:
+        db.close()
+
+@router.post("/{note_id}", summary="Run analysis on a note and save a snapshot")
+async def analyze_one(
+    note_id: UUID,
+    subject: Optional[str] = Query(None, description="Override subject (e.g., physics)"),
+    full: bool = Query(False, description="Recompute every block instead of reusing unchanged ones"),
+    background: bool = Query(False, description="Return a job id right away and analyze in the background"),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+) -> dict:
+    bind_user(user.id)
+    text = await run_in_threadpool(_load_note_text, db, note_id, user.id)
+
+    if background:
+        job = analysis_jobs.start_job(
+            user.id, note_id, lambda job: _analysis_job(job, note_id, text, subject, full)
+        )
+        return JSONResponse(status_code=202, content={
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/analysis/jobs/{job.job_id}",
+            "events_url": f"/analysis/jobs/{job.job_id}/events",
+        })
+
+    return await _run_analysis(db, note_id, text, subject, full)
+
+async def _owned_job(job_id: str, user: User) -> dict:
+    snap = await analysis_jobs.get_snapshot(job_id)
+    if not snap or snap.get("user_id") != str(user.id):
+        raise HTTPException(status_code=404, detail="job not found")
+    return snap
+
+@router.get("/jobs/{job_id}", summary="Status and progress of a background analysis")
+async def job_status(job_id: str, user: User = Depends(get_current_user)) -> dict:
+    return await _owned_job(job_id, user)
+
+async def _job_events(job_id: str, first: dict) -> AsyncIterator[str]:
+    """Events: progress* -> done | error. A comment line keeps idle proxies from closing the stream."""
+    snap = first
+    last_seen = None
+    while True:
+        if snap is None:
+            yield sse_event("error", {"detail": "job expired"})
+            return
+        if snap["updated_at"] != last_seen:
+            last_seen = snap["updated_at"]
+            if analysis_jobs.is_finished(snap):
+                yield sse_event(snap["status"], snap)
+                return
+            yield sse_event("progress", snap)
+        else:
+            yield ": keep-alive\n\n"
+
+        job = analysis_jobs.local_job(job_id)
+        if job is not None:
+            if job.updated_at == last_seen:
+                await job.wait_changed(timeout=15)
+        else:
+            await asyncio.sleep(0.5)  # job runs on another worker: follow its Redis mirror
+        snap = await analysis_jobs.get_snapshot(job_id)
+
+@router.get("/jobs/{job_id}/events", summary="Server-Sent Events stream of analysis progress")
+async def job_events(job_id: str, user: User = Depends(get_current_user)):
+    first = await _owned_job(job_id, user)
+    return sse_response(_job_events(job_id, first))
+
+_ANALYSIS_FIELDS = ("subject", "summary", "blocks", "flags", "meta")
+
+def _parse_fields(fields: Optional[str]) -> tuple[List[str], Optional[List[str]]]:
+    """'summary,flags,blocks.type,blocks.summary' -> (["summary", "flags", "blocks"], ["type", "summary"])"""
+    if not fields:
+        return list(_ANALYSIS_FIELDS), None
+    cols: List[str] = []
+    block_keys: List[str] = []
+    for f in (p.strip() for p in fields.split(",")):
+        if not f:
+            continue
+        col, _, key = f.partition(".")
+        if col not in _ANALYSIS_FIELDS or (key and col != "blocks"):
+            raise HTTPException(status_code=400, detail=f"unknown field '{f}'")
+        if col not in cols:
+            cols.append(col)
+        if key:
+            block_keys.append(key)
+    return cols, (block_keys or None)
+
+def _latest_analysis_json(
+    db: Session, note_id: UUID, cols: List[str], block_keys: Optional[List[str]],
+    blocks_offset: int, blocks_limit: Optional[int],
+) -> Optional[str]:
+    # The response object is assembled by Postgres and returned as JSON text, so only
+    # the requested columns / block page / block keys ever leave the database and
+    # nothing is parsed and re-serialized here.
+    params: dict = {"note_id": note_id, "blocks_offset": blocks_offset}
+    parts = ["'analysis_id', na.analysis_id", "'note_id', na.note_id", "'created_at', na.created_at"]
+    for col in cols:
+        if col != "blocks":
+            parts.append(f"'{col}', na.{col}")
+        elif block_keys is None and not blocks_offset and blocks_limit is None:
+            parts.append("'blocks', na.blocks")
+        else:
+            elem = "t.elem"
+            if block_keys is not None:
+                params["block_keys"] = block_keys
+                elem = """COALESCE((
+                    SELECT jsonb_object_agg(kv.key, kv.value)
+                    FROM jsonb_each(t.elem) AS kv
+                    WHERE kv.key = ANY(:block_keys)
+                ), '{}'::jsonb)"""
+            page = "t.ord > :blocks_offset"
+            if blocks_limit is not None:
+                params["blocks_limit"] = blocks_limit
+                page += " AND t.ord <= :blocks_offset + :blocks_limit"
+            parts.append(f"""'blocks', (
+                SELECT COALESCE(jsonb_agg({elem} ORDER BY t.ord), '[]'::jsonb)
+                FROM jsonb_array_elements(COALESCE(na.blocks, '[]'::jsonb)) WITH ORDINALITY AS t(elem, ord)
+                WHERE {page}
+            )""")
+            parts.append("'blocks_total', jsonb_array_length(COALESCE(na.blocks, '[]'::jsonb))")
+
+    sql = f"""
+        SELECT jsonb_build_object({", ".join(parts)})::text
+        FROM note_analysis na
+        WHERE na.note_id = :note_id
+        ORDER BY na.created_at DESC
+        LIMIT 1;
+    """
+    return db.execute(text(sql), params).scalar()
 
 @router.get("/{note_id}/latest", summary="Fetch latest analysis for a note")
-def get_latest(note_id: UUID, db: Session = Depends(get_db), user: User = Depends(get_current_user)) -> dict:
+def get_latest(
+    note_id: UUID,
+    fields: Optional[str] = Query(
+        None, description="Comma-separated subset of subject,summary,blocks,flags,meta; "
+                          "blocks.<key> keeps only those keys of each block (e.g. blocks.type,blocks.summary)",
+    ),
+    blocks_offset: int = Query(0, ge=0),
+    blocks_limit: Optional[int] = Query(None, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    cols, block_keys = _parse_fields(fields)
     note = db.query(Note).filter(Note.note_id == note_id, Note.user_id == user.id).first()
     if not note:
         raise HTTPException(status_code=404, detail="note not found")
 
-    rec = (
-        db.query(NoteAnalysis)
-        .filter(NoteAnalysis.note_id == note.note_id)
-        .order_by(desc(NoteAnalysis.created_at))
-        .first()
-    )
-    if not rec:
+    latest = _latest_analysis_json(db, note.note_id, cols, block_keys, blocks_offset, blocks_limit)
+    if not latest:
         raise HTTPException(status_code=404, detail="no analysis for note")
-    return {
-        "analysis_id": str(rec.analysis_id),
-        "note_id": str(rec.note_id),
-        "subject": rec.subject,
-        "summary": rec.summary,
-        "blocks": rec.blocks,
-        "flags": rec.flags,
-        "meta": rec.meta,
-        "created_at": rec.created_at.isoformat(),
-    }
+    return Response(content=latest, media_type="application/json")
@@ -0,0 +1,116 @@
+import asyncio, hashlib, tempfile
+from contextlib import aclosing
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.security import get_current_user
+from app.api.sse import sse_event, sse_response
+from app.services.llm_telemetry import bind_user
+from app.services.ocr_ingest import done_pages, save_page
+from app.services.ocr_pipeline import ocr_pages
+from app.services import pdf_pages
+
+router = APIRouter(prefix="/ocr", tags=["ocr"])
+
+def _save_and_commit(db, owner_id, upload_sha, page, name) -> dict:
+    try:
+        out = save_page(db, owner_id, upload_sha, page, name)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.expunge_all()
+    return out
+
+def _own_copy(src) -> tuple:
+    # the UploadFile is closed once the handler returns, but pages are read while the
+    # response streams: copy it (disk to disk, in blocks) to a temp file the stream owns
+    h = hashlib.sha256()
+    dst = tempfile.TemporaryFile()
+    src.seek(0)
+    for block in iter(lambda: src.read(1 << 20), b""):
+        h.update(block)
+        dst.write(block)
+    dst.seek(0)
+    return dst, h.hexdigest()
+
+def _close(doc, f) -> None:
+    pdf_pages.close_pdf(doc)
+    f.close()
+
+def _page_name(index: int) -> str:
+    return f"page-{index + 1:04d}"
+
+async def _stream_pdf(doc, f, pages: int, upload_sha: str, owner_id, stem: str) -> AsyncIterator[str]:
+    """
+    OCR the pages through the pipeline and emit each note as soon as it is committed.
+    Events: pdf -> page* / page_error* (in page order) -> done
+    """
+    # own session: the request-scoped one is closed before the body is streamed
+    db = SessionLocal()
+    try:
+        done = await run_in_threadpool(done_pages, db, owner_id, upload_sha)
+        yield sse_event("pdf", {"pages": pages, "upload_sha256": upload_sha, "resumed_pages": len(done)})
+        for i in range(pages):
+            d = done.get(_page_name(i))
+            if d is not None:
+                yield sse_event("page", {"page": i + 1, "note_id": str(d.note_id),
+                                    "repair_id": str(d.repair_id) if d.repair_id else None, "resumed": True})
+
+        created, failures, text_layer = len(done), [], 0
+        sources = [(_page_name(i), partial(pdf_pages.load_page, doc, i)) for i in range(pages) if _page_name(i) not in done]
+        async with aclosing(ocr_pages(sources, owner_id)) as finished:
+            async for page in finished:
+                number = int(page.name.rsplit("-", 1)[1])
+                try:
+                    if page.error:
+                        raise RuntimeError(page.error)
+                    out = await run_in_threadpool(
+                        _save_and_commit, db, owner_id, upload_sha, page, f"{stem} - page {number}"
+                    )
+                except Exception as e:
+                    print("PDF OCR/insert failure for page", number, "->", e)
+                    failures.append({"page": number, "error": str(e)})
+                    yield sse_event("page_error", failures[-1])
+                    continue
+                created += 1
+                text_layer += page.text_layer
+                yield sse_event("page", {"page": number, **out, "source": "text_layer" if page.text_layer else "ocr"})
+        yield sse_event("done", {"pages": pages, "created_notes": created, "text_layer_pages": text_layer, "failures": failures})
+    finally:
+        db.close()
+        await asyncio.to_thread(_close, doc, f)
+
+@router.post("/pdf")
+async def ocr_from_pdf(
+    file: UploadFile = File(...),
+    user = Depends(get_current_user),
+):
+    if not pdf_pages.available():
+        raise HTTPException(status_code=501, detail="PDF support is not installed (pypdfium2).")
+    fname = file.filename or "upload.pdf"
+    if not fname.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Please upload a .pdf file.")
+    owner_id = getattr(user, "id", None) or getattr(user, "user_id", None)
+    if not owner_id:
+        raise HTTPException(status_code=400, detail="Current user has no id")
+
+    f, upload_sha = await asyncio.to_thread(_own_copy, file.file)
+    try:
+        # pdfium reads pages from the file on demand, the PDF is never loaded as a whole
+        doc = await asyncio.to_thread(pdf_pages.open_pdf, f)
+    except ValueError:
+        f.close()
+        raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
+    pages = await asyncio.to_thread(pdf_pages.page_count, doc)
+    if not 0 < pages <= settings.PDF_MAX_PAGES:
+        await asyncio.to_thread(_close, doc, f)
+        raise HTTPException(status_code=400, detail=f"PDF must have between 1 and {settings.PDF_MAX_PAGES} pages.")
+
+    bind_user(owner_id)
+    return sse_response(_stream_pdf(doc, f, pages, upload_sha, owner_id, Path(fname).stem[:200]))
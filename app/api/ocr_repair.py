@@ -1,6 +1,7 @@
 from typing import Optional, List, Any, Dict
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
@@ -8,6 +9,8 @@ from app.core.db import get_db
 from app.models.note import Note
 from app.models.note_repair import NoteRepair
 from app.services.ocr_repair import suggest_repair_for_text
+from app.services.llm_scheduler import INTERACTIVE
+from app.services.llm_telemetry import bind_user
 from app.core.security import get_current_user
 router = APIRouter(prefix="/ocr/repair", tags=["ocr-repair"])
 
@@ -39,15 +42,22 @@ def get_repair(repair_id: UUID, db: Session = Depends(get_db), user = Depends(ge
         "suggestion_log": rep.suggestion_log,
     }
     
+def _add_repair(db: Session, rep: NoteRepair) -> None:
+    db.add(rep)
+    db.flush()
+    db.refresh(rep)
+    db.commit()
+
 @router.post("/suggest/{note_id}", response_model=RepairSuggestionOut)
-def suggest(note_id: UUID, db: Session = Depends(get_db)):
-    note = db.query(Note).filter(Note.note_id == note_id).first()
+async def suggest(note_id: UUID, db: Session = Depends(get_db)):
+    note = await run_in_threadpool(lambda: db.query(Note).filter(Note.note_id == note_id).first())
     if not note:
         raise HTTPException(status_code=404, detail="note not found")
     if not note.og_text:
         raise HTTPException(status_code=400, detail="note has no text")
 
-    result = suggest_repair_for_text(note.og_text)
+    bind_user(note.user_id)
+    result = await suggest_repair_for_text(note.og_text, priority=INTERACTIVE)
     rep = NoteRepair(
         note_id=note.note_id,
         original_text=note.og_text,
@@ -55,10 +65,7 @@ def suggest(note_id: UUID, db: Session = Depends(get_db)):
         suggestion_log=result.get("log", []),
         status="pending",
     )
-    db.add(rep)
-    db.flush()
-    db.refresh(rep)
-    db.commit()
+    await run_in_threadpool(_add_repair, db, rep)
 
     return {
         "repair_id": rep.repair_id,
@@ -1,17 +1,17 @@
-import io, zipfile, secrets, uuid
+import asyncio, zipfile, uuid
+from contextlib import aclosing
+from functools import partial
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from openai import OpenAI
-from app.services.chunking import chunk_and_store
+from app.services.llm_telemetry import bind_user
 from app.core.db import get_db
 from app.core.config import settings
 from app.core.security import get_current_user
-from app.services.ocr import preprocess, ocr_bytes
-from app.models.note import Note  
-from app.services.ocr_repair import has_ocr_gap, suggest_repair_for_text
-from app.models.note_repair import NoteRepair
+from app.services.ocr_ingest import done_pages, file_sha256, save_page
+from app.services.ocr_pipeline import ocr_pages
 
 router = APIRouter(prefix="/ocr", tags=["ocr"])
 
@@ -20,33 +20,40 @@ IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
 def _is_image(path: Path) -> bool:
     return path.suffix.lower() in IMAGE_EXTS
 
-def _safe_extract_zip(zf: zipfile.ZipFile, dest: Path) -> list[Path]:
-    extracted: list[Path] = []
-    root = dest.resolve()
+def _image_members(zf: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    members: list[zipfile.ZipInfo] = []
     for member in zf.infolist():
         if member.is_dir():
             continue
         member_path = Path(member.filename)
-        if member_path.is_absolute():
-            continue
         if any(part in ("__MACOSX",) for part in member_path.parts):
             continue
-        final_path = (root / member_path).resolve()
-        if not str(final_path).startswith(str(root)):
-            continue
-        final_path.parent.mkdir(parents=True, exist_ok=True)
-        with zf.open(member) as src, open(final_path, "wb") as dst:
-            dst.write(src.read())
-        extracted.append(final_path)
-    return extracted
-
-def _cleanup_tree(root: Path) -> None:
+        if _is_image(member_path):
+            members.append(member)
+    return sorted(members, key=lambda m: m.filename)
+
+def _read_member(zf: zipfile.ZipFile, member: zipfile.ZipInfo) -> bytes:
+    # the header size can lie (zip bombs), so the cap is enforced on what is actually inflated
+    cap = settings.OCR_MAX_IMAGE_BYTES
+    if member.file_size > cap:
+        raise ValueError(f"image is larger than {cap} bytes")
+    with zf.open(member) as src:
+        data = src.read(cap + 1)
+    if len(data) > cap:
+        raise ValueError(f"image is larger than {cap} bytes")
+    return data
+
+def _save(db, owner_id, upload_sha, page, name, commit: bool) -> tuple:
+    # one worker-thread call per page: a page that fails to save is returned as its
+    # error (its savepoint is already rolled back), a failing batch commit raises
     try:
-        for p in sorted(root.rglob("*"), reverse=True):
-            p.unlink() if p.is_file() else p.rmdir()
-        root.rmdir()
-    except Exception:
-        pass
+        out = save_page(db, owner_id, upload_sha, page, name)
+    except Exception as e:
+        return None, e
+    if commit:
+        db.commit()
+        db.expunge_all()
+    return out, None
 
 @router.post("/zip")
 async def ocr_from_zip(
@@ -54,100 +61,79 @@ async def ocr_from_zip(
     db: Session = Depends(get_db),
     user = Depends(get_current_user),
 ):
-    # 1) validate zip
+    # 1) validate zip; the upload is already spooled to a temp file by the multipart
+    # parser, so the archive is read from there member by member, never as a whole
     fname = (file.filename or "upload.zip").lower()
     if not fname.endswith(".zip"):
         raise HTTPException(status_code=400, detail="Please upload a .zip file.")
-    data = await file.read()
     try:
-        zf = zipfile.ZipFile(io.BytesIO(data))
+        zf = await asyncio.to_thread(zipfile.ZipFile, file.file)
     except zipfile.BadZipFile:
         raise HTTPException(status_code=400, detail="Invalid or corrupted zip file.")
 
-    # 2) extract safely
-    tmp_root = Path("tmp") / f"zip_{secrets.token_hex(8)}"
-    tmp_root.mkdir(parents=True, exist_ok=True)
-    extracted = _safe_extract_zip(zf, tmp_root)
-    if not extracted:
-        _cleanup_tree(tmp_root)
+    # 2) image members only
+    if not any(not m.is_dir() for m in zf.infolist()):
         raise HTTPException(status_code=400, detail="Zip contained no files.")
-
-    # 3) image files only
-    img_paths = [p for p in extracted if _is_image(p)]
-    if not img_paths:
-        _cleanup_tree(tmp_root)
+    members = _image_members(zf)
+    if not members:
         raise HTTPException(status_code=400, detail="Zip has no supported image files.")
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    created, failures = [], []
-
-
-    for path in sorted(img_paths):
-        try:
-            jpeg_bytes = preprocess(path)
-            text = ocr_bytes(client, jpeg_bytes)
-
-            # Support either .id or .user_id, prefer .id
-            owner_id = getattr(user, "id", None) or getattr(user, "user_id", None)
-            if not owner_id:
-                raise HTTPException(status_code=400, detail="Current user has no id")
-            note = Note(
-                user_id=owner_id,
-                og_text=text,
-                status="ocr_done",
-                filename=path.name,
-            )
-            db.add(note)
-            db.flush()          # get note.note_id
-            db.refresh(note)
-
-            #ocr repair
-            repair_id_to_return = None
-            
-            if has_ocr_gap(note.og_text or ""):
-                result = suggest_repair_for_text(
-                    note.og_text,
-                    subject=getattr(settings, "SUBJECT", None)
-                )
-
-                rep = NoteRepair(
-                    note_id=note.note_id,
-                    original_text=note.og_text,
-                    suggested_text=result.get("suggested_text"),
-                    suggestion_log=result.get("log", []),
-                    status='pending',
-                )
-
-                db.add(rep)
-                db.flush()
-                db.refresh(rep)
-                repair_id_to_return = str(rep.repair_id)
-
-            created.append({
-                "note_id": str(note.note_id),
-                "repair_id": repair_id_to_return
-            })
-
-
-            # embeddings and chunks
-            chunk_and_store(db, note, client, embed_model="text-embedding-3-small", max_chars=800, overlap=80)
-
-
-        except Exception as e:
-            print("OCR/insert failure for", path.name, "->", e)
-            failures.append({"file": path.name, "error": str(e)})
+    # Support either .id or .user_id, prefer .id
+    owner_id = getattr(user, "id", None) or getattr(user, "user_id", None)
+    if not owner_id:
+        raise HTTPException(status_code=400, detail="Current user has no id")
+    bind_user(owner_id)
+
+    # 3) a retried upload of the same zip skips the pages that were already committed
+    upload_sha = await asyncio.to_thread(file_sha256, file.file)
+    done = await run_in_threadpool(done_pages, db, owner_id, upload_sha)
+    created = [
+        {"note_id": str(d.note_id), "repair_id": str(d.repair_id) if d.repair_id else None,
+         "file": Path(m.filename).name, "ocr_cache": None, "resumed": True}
+        for m in members if (d := done.get(m.filename)) is not None
+    ]
+    todo = [m for m in members if m.filename not in done]
+    failures = []
+
+    # pages go through the staged OCR pipeline (app/services/ocr_pipeline.py) and come
+    # back in file order. Each page is written in its own savepoint and committed every
+    # OCR_COMMIT_EVERY pages, with the session emptied after each commit: no transaction
+    # or identity map spanning the whole upload, and a failure late in a big zip keeps
+    # everything before it.
+    commit_every = max(1, settings.OCR_COMMIT_EVERY)
+    uncommitted = 0
+    sources = [(m.filename, partial(_read_member, zf, m)) for m in todo]
+    try:
+        async with aclosing(ocr_pages(sources, owner_id)) as pages:
+            async for page in pages:
+                name = Path(page.name).name
+                if page.error:
+                    # no note for a failed page; a retry of the same zip picks it up again
+                    out, error = None, RuntimeError(page.error)
+                else:
+                    commit = uncommitted + 1 >= commit_every
+                    out, error = await run_in_threadpool(_save, db, owner_id, upload_sha, page, name, commit)
+                if error is not None:
+                    print("OCR/insert failure for", name, "->", error)
+                    failures.append({"file": name, "error": str(error)})
+                    continue
+                created.append(out)
+                uncommitted = 0 if commit else uncommitted + 1
+    finally:
+        zf.close()
 
     try:
-        db.commit()
+        await run_in_threadpool(db.commit)
     except Exception as e:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise
-    finally:
-        _cleanup_tree(tmp_root)
 
     return {
-        "processed": len(img_paths),
+        "processed": len(members),
         "created_notes": len(created),
         "created": created,
+        "cached_pages": sum(1 for c in created if c["ocr_cache"]),
+        "resumed_pages": len(members) - len(todo),
+        "upload_sha256": upload_sha,
         "failures": failures,
     }
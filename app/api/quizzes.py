@@ -1,16 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, AsyncIterator, Optional, Union
 import json
 import os
 from uuid import UUID
 
-from openai import OpenAI  # ✅ OpenAI SDK
 
 from app.core.config import settings
-from app.core.db import get_db
+from app.core.db import get_db, SessionLocal
 from app.core.security import get_current_user
+from app.api.sse import sse_event, sse_response
 from app.models.user import User
 from app.models.quiz import Quiz
 from app.models.quiz_item import QuizItem
@@ -19,6 +20,7 @@ from app.models.result_answer import ResultAnswer
 from app.models.attempt import Attempt
 from app.models.note import Note
 from app.schemas.quiz_gen import (
+    GenerateBase,
     GenerateWithNote,
     GenerateWithoutNote,
     QuizOut,
@@ -26,6 +28,11 @@ from app.schemas.quiz_gen import (
     GradePayload,
 )
 from app.schemas.quiz import QuizItems  # Pydantic schema for structured output
+from app.services import llm_gateway
+from app.services.llm_telemetry import bind_user
+from app.services import single_flight
+from app.services.json_stream import JsonArrayItemParser
+from app.services.note_context import build_note_context
 
 from pydantic import BaseModel
 from datetime import datetime, timezone
@@ -122,47 +129,46 @@ def _strictify_schema(schema: dict) -> dict:
         }
     return sc
 
-def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str) -> dict:
-    """
-    Call OpenAI Chat Completions with JSON Schema enforcement and return parsed dict.
-    """
-    model_name = (
+def _model_name() -> str:
+    return (
         getattr(settings, "OPENAI_MODEL", None)
         or os.getenv("OPENAI_MODEL")
         or "gpt-4o-mini"
     )
-    client = OpenAI(api_key=getattr(settings, "OPENAI_API_KEY", None) or os.getenv("OPENAI_API_KEY"))
 
+def _response_format(schema_model: BaseModel.__class__) -> dict:
     raw_schema = schema_model.model_json_schema()
     schema_name = raw_schema.get("title") or schema_model.__name__
-    schema = _strictify_schema(raw_schema)
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema_name,
+            "schema": _strictify_schema(raw_schema),
+            "strict": True,
+        },
+    }
+
+async def _oai_json_call(schema_model: BaseModel.__class__, user_prompt: str, use_cache: bool = True) -> dict:
+    """
+    Call OpenAI Chat Completions with JSON Schema enforcement and return parsed dict.
+    """
     try:
-        resp = client.chat.completions.create(
-            model=model_name,
+        resp = await llm_gateway.chat_completion(
+            model=_model_name(),
+            use_cache=use_cache,
+            feature="quiz",
             messages=[
                 {"role": "system", "content": _build_system()},
                 {"role": "user", "content": user_prompt},
             ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": schema_name,
-                    "schema": schema,
-                    "strict": True,
-                },
-            },
+            response_format=_response_format(schema_model),
             temperature=0.3,
             max_tokens=2048,
         )
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"OpenAI error: {e}")
 
-    text = None
-    try:
-        text = resp.choices[0].message.content
-    except Exception:
-        pass
-
+    text = llm_gateway.message_text(resp)
     if not text:
         raise HTTPException(status_code=502, detail="OpenAI returned an empty response")
 
@@ -328,28 +334,30 @@ def _coerce_item(it: dict) -> dict | None:
 
     return None
 
-def _oai_generate(subject: str, topic: str, grade_level: str, difficulty: str, n: int, item_types: List[str], note_text: str | None = None):
-    _assert_openai()
-
+def _build_user_prompt(subject: str, topic: str, grade_level: str, difficulty: str, n: int, item_types: List[str], note_text: str | None = None) -> str:
     if note_text:
-        user_prompt = _build_user_prompt_from_note(
+        return _build_user_prompt_from_note(
             note_text=note_text,
             grade_level=grade_level,
             difficulty=difficulty,
             n=n,
             item_types=item_types,
         )
-    else:
-        user_prompt = _build_user_prompt_general(
-            subject=subject,
-            topic=topic,
-            grade_level=grade_level,
-            difficulty=difficulty,
-            n=n,
-            item_types=item_types,
-        )
+    return _build_user_prompt_general(
+        subject=subject,
+        topic=topic,
+        grade_level=grade_level,
+        difficulty=difficulty,
+        n=n,
+        item_types=item_types,
+    )
+
+async def _oai_generate(subject: str, topic: str, grade_level: str, difficulty: str, n: int, item_types: List[str], note_text: str | None = None, use_cache: bool = True):
+    _assert_openai()
+
+    user_prompt = _build_user_prompt(subject, topic, grade_level, difficulty, n, item_types, note_text)
 
-    data = _oai_json_call(QuizItems, user_prompt)
+    data = await _oai_json_call(QuizItems, user_prompt, use_cache=use_cache)
 
     raw_items = data.get("items")
     if raw_items is None and isinstance(data, dict):
@@ -370,8 +378,7 @@ def _oai_generate(subject: str, topic: str, grade_level: str, difficulty: str, n
 
 # ---------- Create Quiz + persist items ----------
 
-def _persist_quiz_and_items(
-    db: Session,
+def _new_quiz(
     *,
     user_id: Union[str, UUID],
     note_id: Optional[UUID],
@@ -380,10 +387,9 @@ def _persist_quiz_and_items(
     difficulty: str,
     mode: str,
     types: List[str],
-    items: List[dict],
     source: str,
-) -> int:
-    q = Quiz(
+) -> Quiz:
+    return Quiz(
         user_id=str(user_id),
         note_id=note_id,
         title=f"{(subject or 'General').title()}" + (f" · {topic}" if topic else "") + f" · {mode.title()}",
@@ -393,21 +399,46 @@ def _persist_quiz_and_items(
         source=source,
         types=",".join(types) if types else None,
     )
+
+def _new_quiz_item(quiz_id: int, it: dict) -> QuizItem:
+    return QuizItem(
+        quiz_id=quiz_id,
+        type=it["type"],
+        question=it["question"],
+        choices=(json.dumps(it["choices"]) if it.get("choices") else None),
+        answer_index=it.get("answer_index"),
+        answer_text=it.get("answer_text"),
+        explanation=it["explanation"],
+    )
+
+def _persist_quiz_and_items(
+    db: Session,
+    *,
+    user_id: Union[str, UUID],
+    note_id: Optional[UUID],
+    subject: str,
+    topic: Optional[str],
+    difficulty: str,
+    mode: str,
+    types: List[str],
+    items: List[dict],
+    source: str,
+) -> int:
+    q = _new_quiz(
+        user_id=user_id,
+        note_id=note_id,
+        subject=subject,
+        topic=topic,
+        difficulty=difficulty,
+        mode=mode,
+        types=types,
+        source=source,
+    )
     db.add(q)
     db.flush()
 
     for it in items:
-        db.add(
-            QuizItem(
-                quiz_id=q.id,
-                type=it["type"],
-                question=it["question"],
-                choices=(json.dumps(it["choices"]) if it.get("choices") else None),
-                answer_index=it.get("answer_index"),
-                answer_text=it.get("answer_text"),
-                explanation=it["explanation"],
-            )
-        )
+        db.add(_new_quiz_item(q.id, it))
 
     db.commit()
     return q.id
@@ -427,73 +458,211 @@ def delete_quiz(
 
     db.delete(q); db.commit(); return
 
+def _get_owned_note(db: Session, note_id: UUID, user_id: str) -> Optional[Note]:
+    return (
+        db.query(Note)
+        .filter(Note.note_id == note_id, Note.user_id == user_id)
+        .first()
+    )
+
+# Generation handlers are async so the OpenAI round trip does not hold a threadpool
+# worker; the (short) DB work is pushed to the threadpool explicitly. Identical
+# concurrent requests (double clicks, retries) share one run via single_flight.
 @router.post("/generate-ai")
-def generate_ai(
+async def generate_ai(
     payload: GenerateWithoutNote,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ) -> Dict[str, Any]:
-    items = _oai_generate(
-        subject=payload.subject,
-        topic=payload.topic,
-        grade_level=payload.grade_level,
-        difficulty=payload.difficulty,
-        n=payload.num_items,
-        item_types=payload.types,
-        note_text=None,
-    )
-    quiz_id = _persist_quiz_and_items(
-        db,
-        user_id=user.id,
-        note_id=None,
-        subject=payload.subject,
-        topic=payload.topic,
-        difficulty=payload.difficulty,
-        mode=payload.mode,
-        types=payload.types,
-        items=items,
-        source="ai_general",
-    )
-    return {"quiz_id": quiz_id}
+    bind_user(user.id)
+
+    async def generate() -> Dict[str, Any]:
+        items = await _oai_generate(
+            subject=payload.subject,
+            topic=payload.topic,
+            grade_level=payload.grade_level,
+            difficulty=payload.difficulty,
+            n=payload.num_items,
+            item_types=payload.types,
+            note_text=None,
+            use_cache=not payload.no_cache,
+        )
+        quiz_id = await run_in_threadpool(
+            _persist_quiz_and_items,
+            db,
+            user_id=user.id,
+            note_id=None,
+            subject=payload.subject,
+            topic=payload.topic,
+            difficulty=payload.difficulty,
+            mode=payload.mode,
+            types=payload.types,
+            items=items,
+            source="ai_general",
+        )
+        return {"quiz_id": quiz_id}
+
+    key = single_flight.request_key(user.id, "quizzes.generate-ai", payload)
+    return await single_flight.run(key, generate, endpoint="quizzes.generate-ai")
 
 @router.post("/generate-ai-from-note")
-def generate_ai_from_note(
+async def generate_ai_from_note(
     payload: GenerateWithNote,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ) -> Dict[str, Any]:
-    note: Optional[Note] = (
-        db.query(Note)
-        .filter(Note.note_id == payload.note_id, Note.user_id == user.id)
-        .first()
+    bind_user(user.id)
+
+    async def generate() -> Dict[str, Any]:
+        note: Optional[Note] = await run_in_threadpool(_get_owned_note, db, payload.note_id, user.id)
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        ctx = await build_note_context(db, note, payload.subject, payload.topic, feature="quiz")
+        note_text = ctx.text
+
+        items = await _oai_generate(
+            subject=payload.subject,
+            topic=payload.topic,
+            grade_level=payload.grade_level,
+            difficulty=payload.difficulty,
+            n=payload.num_items,
+            item_types=payload.types,
+            note_text=note_text or None,
+            use_cache=not payload.no_cache,
+        )
+
+        quiz_id = await run_in_threadpool(
+            _persist_quiz_and_items,
+            db,
+            user_id=user.id,
+            note_id=payload.note_id,
+            subject=payload.subject,
+            topic=payload.topic,
+            difficulty=payload.difficulty,
+            mode=payload.mode,
+            types=payload.types,
+            items=items,
+            source="ai_note",
+        )
+        return {"quiz_id": quiz_id}
+
+    key = single_flight.request_key(user.id, "quizzes.generate-ai-from-note", payload)
+    return await single_flight.run(key, generate, endpoint="quizzes.generate-ai-from-note")
+
+# ---------- Streaming generation (SSE) ----------
+
+def _add_and_commit(db: Session, row) -> int:
+    db.add(row)
+    db.commit()
+    return row.id
+
+def _drop_quiz(db: Session, quiz_id: int) -> None:
+    db.query(Quiz).filter(Quiz.id == quiz_id).delete()
+    db.commit()
+
+async def _stream_quiz(
+    payload: GenerateBase,
+    *,
+    user_id: str,
+    note_id: Optional[UUID],
+    note_text: Optional[str],
+    source: str,
+) -> AsyncIterator[str]:
+    """
+    Stream the completion, cut finished objects out of the `items` array as they arrive,
+    normalize each with _coerce_item, persist it and emit it as an SSE `item` event.
+    Events: quiz -> item* -> done | error
+    """
+    user_prompt = _build_user_prompt(
+        payload.subject, payload.topic, payload.grade_level, payload.difficulty,
+        payload.num_items, payload.types, note_text,
     )
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
-    note_text = (note.og_text or "").strip()
-
-    items = _oai_generate(
-        subject=payload.subject,
-        topic=payload.topic,
-        grade_level=payload.grade_level,
-        difficulty=payload.difficulty,
-        n=payload.num_items,
-        item_types=payload.types,
-        note_text=note_text or None,
+    # own session: the request-scoped one is closed before the body is streamed
+    db = SessionLocal()
+    try:
+        quiz = _new_quiz(
+            user_id=user_id,
+            note_id=note_id,
+            subject=payload.subject,
+            topic=payload.topic,
+            difficulty=payload.difficulty,
+            mode=payload.mode,
+            types=payload.types,
+            source=source,
+        )
+        quiz_id = await run_in_threadpool(_add_and_commit, db, quiz)
+        yield sse_event("quiz", {"quiz_id": quiz_id})
+
+        parser = JsonArrayItemParser(keys=("items", "questions"))
+        count = 0
+        error = None
+        try:
+            async for delta in llm_gateway.stream_chat_completion(
+                model=_model_name(),
+                use_cache=not payload.no_cache,
+                feature="quiz",
+                messages=[
+                    {"role": "system", "content": _build_system()},
+                    {"role": "user", "content": user_prompt},
+                ],
+                response_format=_response_format(QuizItems),
+                temperature=0.3,
+                max_tokens=2048,
+            ):
+                for raw in parser.feed(delta):
+                    norm = _coerce_item(raw) if count < payload.num_items else None
+                    if not norm:
+                        continue
+                    item_id = await run_in_threadpool(_add_and_commit, db, _new_quiz_item(quiz_id, norm))
+                    out = QuizItemOut(
+                        id=item_id,
+                        question=norm["question"],
+                        type=norm["type"],
+                        choices=norm["choices"],
+                        explanation=norm["explanation"],
+                    )
+                    yield sse_event("item", {"index": count, "item": out.model_dump()})
+                    count += 1
+        except Exception as e:
+            error = f"OpenAI error: {e}"
+
+        if count == 0:
+            await run_in_threadpool(_drop_quiz, db, quiz_id)
+            yield sse_event("error", {"detail": error or "OpenAI returned items, but none were usable after normalization"})
+            return
+        if error:
+            yield sse_event("error", {"detail": error, "partial": True})
+        yield sse_event("done", {"quiz_id": quiz_id, "items": count})
+    finally:
+        db.close()
+
+@router.post("/generate-ai/stream")
+async def generate_ai_stream(
+    payload: GenerateWithoutNote,
+    user: User = Depends(get_current_user),
+):
+    _assert_openai()
+    bind_user(user.id)
+    return sse_response(
+        _stream_quiz(payload, user_id=user.id, note_id=None, note_text=None, source="ai_general")
     )
 
-    quiz_id = _persist_quiz_and_items(
-        db,
-        user_id=user.id,
-        note_id=payload.note_id,
-        subject=payload.subject,
-        topic=payload.topic,
-        difficulty=payload.difficulty,
-        mode=payload.mode,
-        types=payload.types,
-        items=items,
-        source="ai_note",
+@router.post("/generate-ai-from-note/stream")
+async def generate_ai_from_note_stream(
+    payload: GenerateWithNote,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    _assert_openai()
+    bind_user(user.id)
+    note: Optional[Note] = await run_in_threadpool(_get_owned_note, db, payload.note_id, user.id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    ctx = await build_note_context(db, note, payload.subject, payload.topic, feature="quiz")
+    note_text = ctx.text
+    return sse_response(
+        _stream_quiz(payload, user_id=user.id, note_id=payload.note_id, note_text=note_text or None, source="ai_note")
     )
-    return {"quiz_id": quiz_id}
 
 def _quiz_to_dict(q: Quiz) -> Dict[str, Any]:
     return {
@@ -1,6 +1,7 @@
 
 from typing import Optional, List
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
@@ -21,15 +22,15 @@ class SearchOutItem(BaseModel):
     distance: float
 
 @router.post("", response_model=List[SearchOutItem])
-def search_notes(
+async def search_notes(
     body: SearchIn,
     db: Session = Depends(get_db),
     user_id: Optional[str] = Query(None, description="Optional filter to this user's notes (UUID)"),
 ):
     if not body.query.strip():
         raise HTTPException(status_code=400, detail="query cannot be empty")
-    qemb = embed_query(body.query)
-    rows = semantic_search_best_chunk_per_note(
-        db, qemb=qemb, k=body.k, threshold=body.threshold, user_id=user_id
+    qemb = await embed_query(body.query)
+    rows = await run_in_threadpool(
+        semantic_search_best_chunk_per_note, db, qemb=qemb, k=body.k, threshold=body.threshold, user_id=user_id
     )
     return rows
@@ -0,0 +1,17 @@
+import json
+from typing import Any, AsyncIterator
+
+from fastapi.responses import StreamingResponse
+
+# Server-sent events for the streaming endpoints (quiz generation, analysis jobs, PDF OCR).
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def sse_response(gen: AsyncIterator[str]) -> StreamingResponse:
+    # no-cache + X-Accel-Buffering: proxies (nginx) pass events through as they are written
+    return StreamingResponse(
+        gen,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
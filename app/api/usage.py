@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.core.db import get_db
+from app.core.security import get_current_user
+from app.models.llm_usage import LlmUsage
+from app.models.user import User
+from app.services.llm_telemetry import pending_usage
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+@router.get("/mine")
+def my_llm_usage(
+    days: int = Query(30, ge=1, le=365),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    since = date.today() - timedelta(days=days - 1)
+    rows = (
+        db.query(
+            LlmUsage.feature,
+            LlmUsage.model,
+            func.sum(LlmUsage.calls),
+            func.sum(LlmUsage.errors),
+            func.sum(LlmUsage.cache_hits),
+            func.sum(LlmUsage.retries),
+            func.sum(LlmUsage.prompt_tokens),
+            func.sum(LlmUsage.completion_tokens),
+            func.sum(LlmUsage.cost_usd),
+            func.sum(LlmUsage.total_ms),
+            func.max(LlmUsage.max_ms),
+        )
+        .filter(LlmUsage.user_id == user.id, LlmUsage.day >= since)
+        .group_by(LlmUsage.feature, LlmUsage.model)
+        .all()
+    )
+    totals = {
+        (feature, model): {
+            "calls": calls or 0, "errors": errors or 0, "cache_hits": hits or 0, "retries": retries or 0,
+            "prompt_tokens": p_tok or 0, "completion_tokens": c_tok or 0, "cost_usd": float(cost or 0),
+            "total_ms": total_ms or 0, "max_ms": max_ms or 0,
+        }
+        for feature, model, calls, errors, hits, retries, p_tok, c_tok, cost, total_ms, max_ms in rows
+    }
+    # calls from the current flush interval are still in memory: add them instead of flushing
+    for key, vals in pending_usage(user.id, since).items():
+        row = totals.setdefault(key, dict.fromkeys(vals, 0))
+        for f, v in vals.items():
+            row[f] = max(row[f], v) if f == "max_ms" else row[f] + v
+
+    out = []
+    for (feature, model), t in sorted(totals.items(), key=lambda kv: kv[1]["total_ms"], reverse=True):
+        calls, total_ms = t["calls"], t["total_ms"]
+        out.append({
+            "feature": feature,
+            "model": model,
+            "calls": int(calls),
+            "errors": int(t["errors"]),
+            "cache_hits": int(t["cache_hits"]),
+            "retries": int(t["retries"]),
+            "prompt_tokens": int(t["prompt_tokens"]),
+            "completion_tokens": int(t["completion_tokens"]),
+            "cost_usd": round(float(t["cost_usd"]), 6),
+            "total_ms": int(total_ms),
+            "avg_ms": int(total_ms / calls) if calls else 0,
+            "max_ms": int(t["max_ms"]),
+        })
+    return {"since": since.isoformat(), "days": days, "by_feature": out}
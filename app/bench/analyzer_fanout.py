@@ -0,0 +1,136 @@
+"""
+Wall time and LLM call count of analyze_note_text against the local OpenAI stub:
+sequential vs fanned out, one call per block vs batched block summaries.
+
+    python -m app.bench.analyzer_fanout                      # 30 blocks, 300 ms per call
+    python -m app.bench.analyzer_fanout --blocks 50 --latency 500 --concurrency 1 4 8 16 --mode batched
+    python -m app.bench.analyzer_fanout --check-indices      # batched replies with shuffled / duplicated `index`
+
+Starts app/stub/openai_stub.py in-process on --port and points the LLM clients at it,
+so no API key or network is needed. Concurrency 1 works on one block/window at a time.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+
+def _sample_note(blocks: int) -> str:
+    paras = []
+    for i in range(blocks):
+        paras.append(
+            f"Term {i}: a short definition line for block {i}.\n"
+            f"Block {i} explains how enzymes lower activation energy and why the rate of "
+            f"reaction depends on substrate concentration, temperature and pH. "
+            f"It also notes that denatured proteins lose their shape and therefore their function."
+        )
+    return "\n\n".join(paras)
+
+
+def _start_stub(port: int) -> None:
+    import uvicorn
+    from app.stub.openai_stub import app as stub_app
+
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+def _llm_calls() -> float:
+    from app.services.llm_telemetry import LLM_CALLS
+    return sum(s.value for m in LLM_CALLS.collect() for s in m.samples if s.name == "llm_calls_total")
+
+
+def _shape(out: dict) -> list:
+    return [(b["type"], b["text"], "definition" in b) for b in out["blocks"]]
+
+
+async def _run(text: str, levels: list[int], modes: list[bool], repeat: int) -> None:
+    from app.services.analyzer import analyze_note_text
+    from app.services.llm_clients import aclose_clients
+
+    baseline = None
+    shape = None
+    for batched in modes:
+        reference = None
+        for c in levels:
+            best = float("inf")
+            calls_before = _llm_calls()
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                out = await analyze_note_text(text, subject="biology", concurrency=c, batched=batched)
+                best = min(best, time.perf_counter() - t0)
+            calls = (_llm_calls() - calls_before) / repeat
+            if reference is None:
+                reference = out
+            shape = shape or _shape(out)
+            same = "yes" if out == reference else "NO"
+            baseline = baseline or best
+            print(f"{'batched' if batched else 'per-block':>9}  concurrency={c:>3}  blocks={out['meta']['num_blocks']:>3}  "
+                  f"windows={out['meta']['num_windows']:>3}  llm_calls={calls:5.0f}  wall={best:7.2f}s  "
+                  f"speedup={baseline / best:5.1f}x  same_output={same}  same_shape={'yes' if _shape(out) == shape else 'NO'}")
+    await aclose_clients()
+
+
+async def _check_indices(text: str, concurrency: int) -> bool:
+    """
+    Batched summaries must follow `index`, not reply order: a shuffled reply gives the same
+    blocks as an in-order one, a reply with a duplicated index falls back to per-block calls.
+    """
+    from app.services.analyzer import analyze_note_text
+    from app.services.llm_clients import aclose_clients
+    from app.stub import openai_stub
+
+    async def blocks(batched: bool, index_mode: str) -> tuple[list, float]:
+        openai_stub.BATCH_INDEX = index_mode
+        calls_before = _llm_calls()
+        out = await analyze_note_text(text, subject="biology", concurrency=concurrency, batched=batched)
+        return out["blocks"], _llm_calls() - calls_before
+
+    in_order, in_order_calls = await blocks(True, "position")
+    per_block, per_block_calls = await blocks(False, "position")
+    shuffled, _ = await blocks(True, "shuffle")
+    duplicated, duplicated_calls = await blocks(True, "duplicate")
+    openai_stub.BATCH_INDEX = "position"
+    await aclose_clients()
+
+    checks = {
+        "shuffled indices map back by index": shuffled == in_order,
+        "duplicated index falls back to per-block": duplicated == per_block,
+        "fallback costs the per-block calls": duplicated_calls > per_block_calls > in_order_calls,
+    }
+    for name, ok in checks.items():
+        print(f"{'ok' if ok else 'FAIL':>4}  {name}")
+    return all(checks.values())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--blocks", type=int, default=30)
+    ap.add_argument("--latency", type=float, default=300, help="stub latency per call, ms")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--mode", choices=["per-block", "batched", "both"], default="both")
+    ap.add_argument("--port", type=int, default=8199)
+    ap.add_argument("--check-indices", action="store_true", help="check batched `index` handling, no timings")
+    args = ap.parse_args()
+
+    # must be set before app.core.config is imported
+    os.environ["STUB_LATENCY"] = f"fixed:{args.latency}"
+    os.environ["OPENAI_STUB"] = "true"
+    os.environ["OPENAI_STUB_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("REDIS_URL", "")
+
+    _start_stub(args.port)
+    if args.check_indices:
+        raise SystemExit(0 if asyncio.run(_check_indices(_sample_note(args.blocks), max(args.concurrency))) else 1)
+    modes = {"per-block": [False], "batched": [True], "both": [False, True]}[args.mode]
+    asyncio.run(_run(_sample_note(args.blocks), args.concurrency, modes, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Event-loop responsiveness during a large /ocr/zip upload: latency of concurrent
+GET / health checks while the zip is processed, with image preprocessing run
+inline on the event loop (the old behaviour) vs in the OCR process pool, plus
+per-stage throughput of the OCR ingestion pipeline.
+
+    python -m app.bench.ocr_event_loop                         # 8 A4 scans at 300 dpi
+    python -m app.bench.ocr_event_loop --images 24 --mode pool --interval 10
+    python -m app.bench.ocr_event_loop --images 40 --mode pool --batched --size 1240x1754
+
+Needs the app's Postgres (DATABASE_URL); notes are created for a "bench-ocr" user and
+deleted afterwards. The OpenAI stub (app/stub/openai_stub.py) is started in-process on
+--port, so no API key or network is needed.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import io
+import os
+import resource
+import statistics
+import threading
+import time
+import zipfile
+
+
+def _page(width: int, height: int, seed: int) -> bytes:
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width), 245, dtype=np.uint8)
+    img = (img - rng.integers(0, 20, img.shape, dtype=np.uint8)).astype(np.uint8)  # paper noise
+    y = 150
+    while y < height - 100:
+        cv2.putText(img, f"Line {y // 90}: enzymes lower the activation energy of reactions",
+                    (120, y), cv2.FONT_HERSHEY_SIMPLEX, 1.6, 30, 3)
+        y += 90
+    ok, png = cv2.imencode(".png", img)
+    return png.tobytes()
+
+
+def _zip(images: int, width: int, height: int) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for i in range(images):
+            zf.writestr(f"page_{i:03d}.png", _page(width, height, i))
+    return buf.getvalue()
+
+
+def _start_stub(port: int) -> None:
+    import uvicorn
+    from app.stub.openai_stub import app as stub_app
+
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+def _bench_user() -> tuple[str, str]:
+    from app.core.db import SessionLocal
+    from app.core.security import create_access_token
+    from app.models import User
+
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.username == "bench-ocr").first()
+        if user is None:
+            user = User(username="bench-ocr", first_name="bench", last_name="ocr",
+                        email="bench-ocr@example.invalid", password="!", role="user")
+            db.add(user)
+            db.commit()
+        return user.id, create_access_token(user.id)
+
+
+def _delete_notes(note_ids: list[str]) -> None:
+    from app.core.db import SessionLocal
+    from app.models import Note
+
+    if not note_ids:
+        return
+    with SessionLocal() as db:
+        db.query(Note).filter(Note.note_id.in_(note_ids)).delete(synchronize_session=False)
+        db.commit()
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+_STAGES = ("read", "prepare", "ocr", "repair", "embed")
+
+
+def _stage_totals() -> dict[str, tuple[float, float]]:
+    from prometheus_client import REGISTRY
+
+    def value(name: str, stage: str) -> float:
+        return REGISTRY.get_sample_value(name, {"stage": stage}) or 0.0
+    return {s: (value("ocr_pipeline_stage_seconds_count", s), value("ocr_pipeline_stage_seconds_sum", s))
+            for s in _STAGES}
+
+
+def _vision_requests() -> float:
+    from prometheus_client import REGISTRY
+    from app.services.ocr import MODEL
+
+    return sum(REGISTRY.get_sample_value("llm_calls_total", {"feature": "ocr", "model": MODEL, "outcome": o}) or 0.0
+               for o in ("ok", "error"))
+
+
+async def _run(mode: str, payload: bytes, token: str, interval_ms: float) -> list[str]:
+    import httpx
+    from app.main import app
+    from app.services import ocr, ocr_pipeline
+
+    original = ocr_pipeline.preprocess_with_hash_async
+    if mode == "inline":
+        async def inline(image):
+            return ocr.preprocess_with_hash(image)
+        ocr_pipeline.preprocess_with_hash_async = inline
+    else:
+        await asyncio.to_thread(ocr.warm_preprocess_pool)
+
+    latencies: list[float] = []
+    before, requests_before = _stage_totals(), _vision_requests()
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            async def upload():
+                t0 = time.perf_counter()
+                r = await client.post("/ocr/zip", headers={"Authorization": f"Bearer {token}"},
+                                      files={"file": ("scans.zip", payload, "application/zip")})
+                r.raise_for_status()
+                return r.json(), time.perf_counter() - t0
+
+            task = asyncio.create_task(upload())
+            while not task.done():
+                t0 = time.perf_counter()
+                await client.get("/")
+                latencies.append((time.perf_counter() - t0) * 1000)
+                await asyncio.sleep(interval_ms / 1000)
+            body, wall = await task
+    finally:
+        ocr_pipeline.preprocess_with_hash_async = original
+
+    print(f"{mode:>6}  images={body['processed']:>3}  upload_wall={wall:6.2f}s  health_checks={len(latencies):>4}  "
+          f"p50={statistics.median(latencies):7.1f}ms  p95={_pct(latencies, 95):7.1f}ms  max={max(latencies):7.1f}ms  "
+          f"failures={len(body['failures'])}  vision_requests={_vision_requests() - requests_before:.0f}  peak_rss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+    for stage, (count, busy) in _stage_totals().items():
+        count, busy = count - before[stage][0], busy - before[stage][1]
+        print(f"{'':>6}  {stage:>7}  pages={count:>4.0f}  busy={busy:6.2f}s  "
+              f"ms/page={busy / count * 1000 if count else 0:7.1f}  pages/s={count / wall:5.1f}")
+    return [c["note_id"] for c in body["created"]]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--images", type=int, default=8)
+    ap.add_argument("--size", default="2480x3508", help="page size in pixels, WxH")
+    ap.add_argument("--mode", choices=["inline", "pool", "both"], default="both")
+    ap.add_argument("--interval", type=float, default=20, help="pause between health checks, ms")
+    ap.add_argument("--latency", type=float, default=50, help="stub latency per LLM call, ms")
+    ap.add_argument("--port", type=int, default=8198)
+    ap.add_argument("--batched", action="store_true", help="several pages per vision request (OCR_BATCHED)")
+    args = ap.parse_args()
+
+    # must be set before app.core.config is imported
+    os.environ["STUB_LATENCY"] = f"fixed:{args.latency}"
+    os.environ["OPENAI_STUB"] = "true"
+    os.environ["OPENAI_STUB_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["OCR_CACHE_ENABLED"] = "false"  # it would serve every run after the first
+    os.environ["OCR_BATCHED"] = "true" if args.batched else "false"
+    os.environ.setdefault("REDIS_URL", "")
+
+    import app.main  # noqa: F401  (maps every model before the bench user is created)
+    from app.services.ocr import _pool_size, shutdown_preprocess_pool
+
+    _start_stub(args.port)
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    payload = _zip(args.images, width, height)
+    print(f"zip: {args.images} images {width}x{height}, {len(payload) / 1e6:.1f} MB, pool workers={_pool_size()}")
+    _, token = _bench_user()
+
+    for mode in {"inline": ["inline"], "pool": ["pool"], "both": ["inline", "pool"]}[args.mode]:
+        _delete_notes(asyncio.run(_run(mode, payload, token, args.interval)))
+    shutdown_preprocess_pool()
+
+
+if __name__ == "__main__":
+    main()
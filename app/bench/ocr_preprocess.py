@@ -0,0 +1,146 @@
+"""
+OCR image preprocessing cost per stage configuration, on a synthetic corpus of
+phone photos of handwritten pages (12 MP, uneven lighting, ruled paper, slight
+skew, sensor noise, camera JPEG).
+
+    python -m app.bench.ocr_preprocess                             # built-in presets, 6 pages
+    python -m app.bench.ocr_preprocess --pages 12 --config "max_side=2048,denoise=nlmeans"
+
+For every configuration prints ms per image, output bytes and resolution, and how
+much of the legacy pipeline's ink (full-resolution filters, thumbnail at the end) the
+output keeps (ink IoU after scaling both to the same size; deskew lowers it by design).
+"""
+from __future__ import annotations
+import argparse
+import statistics
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+from app.services.ocr_preprocess import PreprocessConfig, parse_config, run_pipeline
+
+PRESETS = {
+    "default": "",
+    "deskew": "deskew=true",
+    "median": "denoise=median",
+    "gaussian": "denoise=gaussian",
+    "nlmeans": "denoise=nlmeans",
+    "no-denoise": "denoise=none",
+    "otsu": "binarize=otsu",
+    "gray": "binarize=none",
+    "png": "format=png",
+    "webp-80": "format=webp,quality=80",
+    "jpeg-70": "quality=70",
+    "max-2048": "max_side=2048",
+    "max-1280": "max_side=1280",
+}
+
+_WORDS = ("enzyme", "substrate", "activation", "energy", "rate", "depends", "on", "the", "temperature",
+          "pH", "denatured", "protein", "shape", "active", "site", "binds", "glucose", "ATP", "cell",
+          "osmosis", "water", "membrane", "diffusion", "=", "->", "therefore", "because", "(?)")
+
+
+def synthetic_page(seed: int, width: int = 3024, height: int = 4032) -> bytes:
+    rng = np.random.default_rng(seed)
+    # paper with a lighting gradient, as if photographed under a desk lamp
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    light = 235 - 40 * ((xx / width - 0.3) ** 2 + (yy / height - 0.2) ** 2)
+    page = np.dstack([light * 0.97, light * 0.99, light]).astype(np.uint8)
+    for y in range(300, height - 200, 120):  # ruled lines
+        cv2.line(page, (0, y), (width, y), (215, 190, 170), 2)
+
+    ink = (int(rng.integers(90, 140)), int(rng.integers(30, 60)), int(rng.integers(20, 50)))
+    y = 280
+    while y < height - 250:
+        x = 180 + int(rng.integers(0, 60))
+        while x < width - 400:
+            word = str(rng.choice(_WORDS))
+            scale = float(rng.uniform(2.2, 2.8))
+            dy = int(rng.integers(-6, 7))
+            cv2.putText(page, word, (x, y + dy), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, scale, ink,
+                        int(rng.integers(3, 6)), cv2.LINE_AA)
+            (tw, _), _ = cv2.getTextSize(word, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, scale, 4)
+            x += tw + int(rng.integers(30, 70))
+        y += 120
+
+    angle = float(rng.uniform(-4, 4))
+    m = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    page = cv2.warpAffine(page, m, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    noise = rng.normal(0, 6, page.shape)
+    page = np.clip(page.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    ok, jpg = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return jpg.tobytes()
+
+
+def legacy_preprocess(data: bytes) -> bytes:
+    # the pipeline before it was made configurable: filters at full resolution, downscale last
+    from PIL import Image
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.bilateralFilter(gray, d=5, sigmaColor=30, sigmaSpace=30)
+    gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    bw = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    pil = Image.fromarray(bw)
+    pil.thumbnail((1600, 1600))
+    buf = BytesIO()
+    pil.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _ink(data: bytes, shape: tuple[int, int] | None = None) -> np.ndarray:
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if shape is not None and gray.shape != shape:
+        gray = cv2.resize(gray, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    return gray < 128
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def _measure(name: str, fn, corpus: list[bytes], reference: list[np.ndarray] | None, repeat: int) -> None:
+    times, sizes, ious = [], [], []
+    out = b""
+    for data, ref in zip(corpus, reference or [None] * len(corpus)):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn(data)
+            best = min(best, time.perf_counter() - t0)
+        times.append(best * 1000)
+        sizes.append(len(out))
+        if ref is not None:
+            ious.append(_iou(_ink(out, ref.shape), ref))
+    h, w = cv2.imdecode(np.frombuffer(out, dtype=np.uint8), cv2.IMREAD_GRAYSCALE).shape
+    iou = f"{statistics.mean(ious):5.3f}" if ious else "  ref"
+    print(f"{name:>11}  ms/image={statistics.mean(times):7.1f}  p_max={max(times):7.1f}  "
+          f"bytes={statistics.mean(sizes) / 1024:7.1f}KB  out={w}x{h}  ink_iou={iou}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, default=6)
+    ap.add_argument("--repeat", type=int, default=2)
+    ap.add_argument("--preset", nargs="+", choices=list(PRESETS), default=list(PRESETS))
+    ap.add_argument("--config", nargs="*", default=[], help="extra OCR_PREPROCESS-style specs")
+    args = ap.parse_args()
+
+    corpus = [synthetic_page(i) for i in range(args.pages)]
+    print(f"corpus: {args.pages} pages, 3024x4032, {statistics.mean(map(len, corpus)) / 1024:.0f}KB camera JPEG each")
+
+    legacy = [legacy_preprocess(d) for d in corpus]
+    reference = [_ink(out) for out in legacy]
+    _measure("legacy", legacy_preprocess, corpus, None, args.repeat)
+
+    configs: list[tuple[str, PreprocessConfig]] = [(name, parse_config(PRESETS[name])) for name in args.preset]
+    configs += [(f"custom{i}", parse_config(spec)) for i, spec in enumerate(args.config, 1)]
+    for name, cfg in configs:
+        _measure(name, lambda data, cfg=cfg: run_pipeline(data, cfg), corpus, reference, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Sentence-splitting throughput of the note parser: the old one nlp(paragraph) call per
+paragraph on the full pipeline vs one nlp.pipe pass with only the sentence component.
+
+    python -m app.bench.parser_throughput                        # built-in corpus of note sizes
+    python -m app.bench.parser_throughput --sizes 2000 20000 200000 --repeat 5 --n-process 1 4
+    python -m app.bench.parser_throughput --from-db 200          # sizes of the latest 200 notes
+
+The corpus is synthetic study-note text (headings, bullets, definitions, paragraphs)
+cut to each size; with --from-db the real og_text of stored notes is used instead.
+Reports sentences per second per size bucket and whether both paths split identically.
+"""
+from __future__ import annotations
+import argparse
+import time
+from typing import List
+
+from app.core.config import settings
+from app.services import parser
+from app.services.nlp_runtime import load_nlp
+
+# roughly the spread of note lengths seen in uploads: a photo of one page up to a long OCR'd chapter
+DEFAULT_SIZES = [1500, 5000, 15000, 40000, 120000]
+
+_PARAGRAPHS = [
+    "CELL RESPIRATION",
+    "Glycolysis: the splitting of glucose into two pyruvate molecules in the cytoplasm.",
+    "Cellular respiration releases energy from glucose. It happens in three stages, and most "
+    "ATP is made in the mitochondria. Dr. Smith noted that e.g. yeast can also ferment. "
+    "Oxygen is the final electron acceptor; without it the chain stops.",
+    "- Krebs cycle happens in the matrix\n- Electron transport chain uses the inner membrane\n- Net yield is about 30-32 ATP",
+    "Key points:",
+    "The rate of reaction depends on temperature, pH and substrate concentration. Above the "
+    "optimum, enzymes denature. Their active site changes shape! Is the process reversible? "
+    "Usually not, because bonds holding the tertiary structure are broken.",
+    "1. Define the term\n2. Give an example\n3. Explain the mechanism",
+    "Osmosis: diffusion of water across a partially permeable membrane, from a dilute to a more concentrated solution.",
+]
+
+
+def _synthetic_note(size: int) -> str:
+    out, n, i = [], 0, 0
+    while n < size:
+        p = _PARAGRAPHS[i % len(_PARAGRAPHS)]
+        out.append(p)
+        n += len(p) + 2
+        i += 1
+    return "\n\n".join(out)
+
+
+def _db_notes(limit: int) -> List[str]:
+    from app.core.db import SessionLocal
+    from app.models import Note
+    from app.models.attempt import Attempt  # noqa: F401  (Quiz.attempts needs it mapped)
+
+    with SessionLocal() as db:
+        rows = db.query(Note.og_text).order_by(Note.created_at.desc()).limit(limit).all()
+    return [r[0] for r in rows if r[0]]
+
+
+def _legacy_nlp():
+    # the pipeline as it was loaded before: every component on, sentencizer appended
+    import spacy
+
+    try:
+        nlp = spacy.load(settings.SPACY_MODEL)
+        if "senter" not in nlp.pipe_names and "sentencizer" not in nlp.pipe_names:
+            nlp.add_pipe("sentencizer")
+    except Exception:
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+    return nlp
+
+
+def _legacy_split(nlp, paras: List[str]) -> List[List[str]]:
+    return [parser._join_fragments([s.text.strip() for s in nlp(p).sents]) for p in paras]
+
+
+def _bucket(size: int) -> str:
+    for s in DEFAULT_SIZES:
+        if size <= s:
+            return f"<={s}"
+    return f">{DEFAULT_SIZES[-1]}"
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="note sizes in characters")
+    ap.add_argument("--from-db", type=int, default=0, metavar="N", help="use the latest N notes from the database")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--n-process", type=int, nargs="+", default=[1])
+    args = ap.parse_args()
+
+    if args.from_db:
+        groups: dict[str, List[str]] = {}
+        for text in _db_notes(args.from_db):
+            groups.setdefault(_bucket(len(text)), []).append(text)
+        corpus = sorted(groups.items(), key=lambda kv: len(kv[1][0]))
+    else:
+        corpus = [(str(s), [_synthetic_note(s)]) for s in args.sizes]
+
+    legacy, nlp = _legacy_nlp(), load_nlp()
+    print(f"legacy pipeline: {legacy.pipe_names}")
+    print(f"pipe pipeline:   {nlp.pipe_names}  batch_size={settings.SPACY_BATCH_SIZE}")
+
+    for label, notes in corpus:
+        paras = [p for text in notes for p in parser.split_paragraphs(parser.soft_unwrap_keep_paragraphs(text))]
+        reference = _legacy_split(legacy, paras)
+        sents = sum(len(s) for s in reference)
+        t_old = _time(lambda: _legacy_split(legacy, paras), args.repeat)
+        print(f"size={label:>9}  notes={len(notes):>3}  paragraphs={len(paras):>5}  sentences={sents:>6}  "
+              f"per-paragraph: {sents / t_old:9.0f} sent/s")
+        for n in args.n_process:
+            out: List[List[str]] = []
+
+            def run() -> None:
+                out[:] = parser.spacy_sentences_batch(paras, n_process=n)
+
+            t_new = _time(run, args.repeat)
+            print(f"{'':>55}nlp.pipe n_process={n}: {sents / t_new:9.0f} sent/s  "
+                  f"speedup={t_old / t_new:5.1f}x  same_output={'yes' if out == reference else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,28 @@ def parse_bool(val: str | None, default: bool = False) -> bool:
         return default
     return str(val).strip().lower() in {"1", "true", "t", "yes", "y", "on"}
 
+def parse_int_map(val: str | None) -> dict[str, int]:
+    # "gpt-4o-mini=128,gpt-4o=32" -> {"gpt-4o-mini": 128, "gpt-4o": 32}
+    out: dict[str, int] = {}
+    for part in (val or "").split(","):
+        k, sep, v = part.partition("=")
+        if sep and k.strip() and v.strip().isdigit():
+            out[k.strip()] = int(v.strip())
+    return out
+
+def parse_price_map(val: str | None) -> dict[str, tuple[float, float]]:
+    # "gpt-4o-mini=0.15/0.60,text-embedding-3-small=0.02/0" -> USD per 1M (input, output) tokens
+    out: dict[str, tuple[float, float]] = {}
+    for part in (val or "").split(","):
+        k, sep, v = part.partition("=")
+        inp, _, outp = v.partition("/")
+        try:
+            if sep and k.strip():
+                out[k.strip()] = (float(inp), float(outp or 0))
+        except ValueError:
+            continue
+    return out
+
 def parse_cors(origins_env: str | None, default_list: list[str]) -> list[str]:
     if not origins_env:
         return default_list
@@ -51,10 +73,116 @@ class Settings(BaseModel):
 
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    OPENAI_BASE_URL: str | None = os.getenv("OPENAI_BASE_URL") or None
+
+    # point every OpenAI client at the local stub (app/stub/openai_stub.py)
+    OPENAI_STUB: bool = parse_bool(os.getenv("OPENAI_STUB", "false"))
+    OPENAI_STUB_URL: str = os.getenv("OPENAI_STUB_URL", "http://127.0.0.1:8100/v1")
+
+    # shared HTTP pool used by every OpenAI client (see app/services/llm_clients.py)
+    OPENAI_POOL_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "100"))
+    OPENAI_POOL_MAX_KEEPALIVE: int = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "20"))
+    OPENAI_KEEPALIVE_EXPIRY: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+    OPENAI_CONNECT_TIMEOUT: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    OPENAI_READ_TIMEOUT: float = float(os.getenv("OPENAI_READ_TIMEOUT", "120"))
+    OPENAI_HTTP2: bool = parse_bool(os.getenv("OPENAI_HTTP2", "true"), default=True)
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+    # async LLM gateway: max in-flight requests per model (app/services/llm_gateway.py)
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+    LLM_MODEL_CONCURRENCY: dict[str, int] = parse_int_map(os.getenv("LLM_MODEL_CONCURRENCY"))
+
+    # outbound rate limits per model (app/services/llm_scheduler.py)
+    LLM_RPM: int = int(os.getenv("LLM_RPM", "500"))
+    LLM_TPM: int = int(os.getenv("LLM_TPM", "200000"))
+    LLM_MODEL_RPM: dict[str, int] = parse_int_map(os.getenv("LLM_MODEL_RPM"))
+    LLM_MODEL_TPM: dict[str, int] = parse_int_map(os.getenv("LLM_MODEL_TPM"))
+    LLM_RETRY_MAX: int = int(os.getenv("LLM_RETRY_MAX", "4"))
+    LLM_BACKOFF_BASE: float = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX: float = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+    # structured-output response cache (app/services/llm_cache.py)
+    LLM_CACHE_ENABLED: bool = parse_bool(os.getenv("LLM_CACHE_ENABLED", "true"), default=True)
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+    LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+    LLM_CACHE_REDIS: bool = parse_bool(os.getenv("LLM_CACHE_REDIS", "true"), default=True)
+
+    # max blocks / windows the note analyzer works on at once (app/services/analyzer.py)
+    ANALYSIS_CONCURRENCY: int = int(os.getenv("ANALYSIS_CONCURRENCY", "8"))
+    # finished background analysis jobs are kept this long (app/services/analysis_jobs.py)
+    ANALYSIS_JOB_TTL_SECONDS: int = int(os.getenv("ANALYSIS_JOB_TTL_SECONDS", "3600"))
+    # summarize many blocks per structured call, split by prompt-token budget
+    ANALYSIS_BATCHED: bool = parse_bool(os.getenv("ANALYSIS_BATCHED", "true"), default=True)
+    ANALYSIS_BATCH_TOKENS: int = int(os.getenv("ANALYSIS_BATCH_TOKENS", "3000"))
+    ANALYSIS_BATCH_MAX_BLOCKS: int = int(os.getenv("ANALYSIS_BATCH_MAX_BLOCKS", "16"))
+
+    # spaCy sentence splitting in the parser (app/services/parser.py): paragraphs per nlp.pipe
+    # batch, and worker processes for notes of at least SPACY_N_PROCESS_MIN_CHARS (1 = off)
+    SPACY_MODEL: str = os.getenv("SPACY_MODEL", "en_core_web_sm")
+    SPACY_BATCH_SIZE: int = int(os.getenv("SPACY_BATCH_SIZE", "64"))
+    SPACY_N_PROCESS: int = int(os.getenv("SPACY_N_PROCESS", "1"))
+    SPACY_N_PROCESS_MIN_CHARS: int = int(os.getenv("SPACY_N_PROCESS_MIN_CHARS", "200000"))
+    # OCR image preprocessing process pool (app/services/ocr.py); 0 = one worker per core
+    OCR_PREPROCESS_WORKERS: int = int(os.getenv("OCR_PREPROCESS_WORKERS", "0"))
+    # OCR image preprocessing stages, e.g. "max_side=1600,deskew=true,denoise=median,binarize=otsu,format=webp"
+    # (app/services/ocr_preprocess.py; empty = defaults)
+    OCR_PREPROCESS: str = os.getenv("OCR_PREPROCESS", "")
+    # OCR ingestion pipeline (app/services/ocr_pipeline.py): workers of the vision, repair and
+    # embedding stages, size of the queue in front of each stage, and pages in flight per upload
+    OCR_CONCURRENCY: int = int(os.getenv("OCR_CONCURRENCY", "8"))
+    OCR_REPAIR_CONCURRENCY: int = int(os.getenv("OCR_REPAIR_CONCURRENCY", "4"))
+    OCR_EMBED_CONCURRENCY: int = int(os.getenv("OCR_EMBED_CONCURRENCY", "4"))
+    OCR_PIPELINE_QUEUE_SIZE: int = int(os.getenv("OCR_PIPELINE_QUEUE_SIZE", "4"))
+    OCR_PIPELINE_WINDOW: int = int(os.getenv("OCR_PIPELINE_WINDOW", "32"))
+    # several pages per vision request, grouped up to OCR_BATCH_TOKENS estimated image tokens
+    # and OCR_BATCH_MAX_PAGES pages; a batch waits up to OCR_BATCH_WAIT_MS for more pages
+    OCR_BATCHED: bool = parse_bool(os.getenv("OCR_BATCHED", "false"), default=False)
+    OCR_BATCH_TOKENS: int = int(os.getenv("OCR_BATCH_TOKENS", "6000"))
+    OCR_BATCH_MAX_PAGES: int = int(os.getenv("OCR_BATCH_MAX_PAGES", "8"))
+    OCR_BATCH_WAIT_MS: int = int(os.getenv("OCR_BATCH_WAIT_MS", "300"))
+    # /ocr/pdf (app/services/pdf_pages.py): pages with at least PDF_TEXT_MIN_CHARS of embedded
+    # text skip OCR; others are rendered at PDF_RENDER_DPI (at most the preprocessing max_side
+    # and PDF_MAX_PAGE_PIXELS pixels)
+    PDF_TEXT_MIN_CHARS: int = int(os.getenv("PDF_TEXT_MIN_CHARS", "20"))
+    PDF_RENDER_DPI: int = int(os.getenv("PDF_RENDER_DPI", "200"))
+    PDF_MAX_PAGE_PIXELS: int = int(os.getenv("PDF_MAX_PAGE_PIXELS", "16000000"))
+    PDF_MAX_PAGES: int = int(os.getenv("PDF_MAX_PAGES", "500"))
+    # /ocr/zip commits its notes every OCR_COMMIT_EVERY pages instead of once at the end
+    OCR_COMMIT_EVERY: int = int(os.getenv("OCR_COMMIT_EVERY", "20"))
+    # largest single image accepted from an uploaded zip, uncompressed
+    OCR_MAX_IMAGE_BYTES: int = int(os.getenv("OCR_MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
+    # persistent OCR text cache per page image (app/services/ocr_cache.py): exact matches on
+    # the image bytes, plus near-duplicates among the uploader's pages: perceptual hash within
+    # OCR_CACHE_MAX_DISTANCE of 256 bits (at most 7: candidates are found by 32-bit hash band),
+    # checked on at most OCR_CACHE_SIMILAR_SCAN candidates
+    OCR_CACHE_ENABLED: bool = parse_bool(os.getenv("OCR_CACHE_ENABLED", "true"), default=True)
+    OCR_CACHE_NEAR_DUPLICATES: bool = parse_bool(os.getenv("OCR_CACHE_NEAR_DUPLICATES", "true"), default=True)
+    OCR_CACHE_MAX_DISTANCE: int = int(os.getenv("OCR_CACHE_MAX_DISTANCE", "6"))
+    OCR_CACHE_SIMILAR_SCAN: int = int(os.getenv("OCR_CACHE_SIMILAR_SCAN", "200"))
+    # preload spaCy / LLM clients / Redis in the background at startup (app/services/warmup.py)
+    WARMUP_ENABLED: bool = parse_bool(os.getenv("WARMUP_ENABLED", "true"), default=True)
+
+    # note-grounded generation: long notes are reduced to their best chunks (app/services/note_context.py)
+    NOTE_CONTEXT_THRESHOLD_TOKENS: int = int(os.getenv("NOTE_CONTEXT_THRESHOLD_TOKENS", "3000"))
+    NOTE_CONTEXT_BUDGET_TOKENS: int = int(os.getenv("NOTE_CONTEXT_BUDGET_TOKENS", "2000"))
+    NOTE_CONTEXT_MMR_LAMBDA: float = float(os.getenv("NOTE_CONTEXT_MMR_LAMBDA", "0.7"))
+
+    # coalescing of identical concurrent generation requests (app/services/single_flight.py)
+    SINGLE_FLIGHT_ENABLED: bool = parse_bool(os.getenv("SINGLE_FLIGHT_ENABLED", "true"), default=True)
+    SINGLE_FLIGHT_LOCK_TTL: float = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "120"))
+    SINGLE_FLIGHT_RESULT_TTL: int = int(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "15"))
+
+    # per-call LLM telemetry (app/services/llm_telemetry.py)
+    LLM_PRICES: dict[str, tuple[float, float]] = parse_price_map(os.getenv("LLM_PRICES"))
+    LLM_USAGE_FLUSH_SECONDS: float = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "30"))
 
 settings = Settings()
 settings.DATABASE_URL = normalize_pg_url(settings.DATABASE_URL)
 
+if settings.OPENAI_STUB:
+    settings.OPENAI_BASE_URL = settings.OPENAI_STUB_URL
+    settings.OPENAI_API_KEY = settings.OPENAI_API_KEY or "stub"
+
 # ❗ Enforce Postgres only
 if not settings.DATABASE_URL.startswith("postgresql"):
     raise RuntimeError(
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import asyncio
+import time
+import weakref
+from typing import Optional
+
+from app.core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# Redis is an optimisation everywhere it is used (LLM cache, locks, job state):
+# callers must treat None as "not available" and fall back to in-process state.
+
+_RETRY_AFTER_SEC = 30.0
+_down_until = 0.0
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Shared asyncio Redis client for the running loop, or None if unavailable."""
+    if aioredis is None or not settings.REDIS_URL:
+        return None
+    if time.monotonic() < _down_until:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=1.0,
+        )
+        _clients[loop] = client
+    return client
+
+
+def report_redis_error(exc: Optional[BaseException] = None) -> None:
+    # back off for a while instead of paying a connect timeout on every call
+    global _down_until
+    _down_until = time.monotonic() + _RETRY_AFTER_SEC
+    if exc is not None:
+        print("redis unavailable, falling back to in-process state ->", exc)
+
+
+async def close_redis() -> None:
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
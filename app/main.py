@@ -1,9 +1,13 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import make_asgi_app
 
 from app.core.db import engine, Base
 from app.api.auth import router as auth_router
-from app.models import Base, User, Note, Quiz, QuizItem, Result, ExamStart, ResultAnswer, Flashcard, FlashcardItem, Rooms, Messages, File, RoomInfo, Tutor, Professor, ConnectionRequest, NoteAnalysis, NoteRepair, NoteChunk
+from app.models import Base, User, Note, Quiz, QuizItem, Result, ExamStart, ResultAnswer, Flashcard, FlashcardItem, Rooms, Messages, File, RoomInfo, Tutor, Professor, ConnectionRequest, NoteAnalysis, NoteRepair, NoteChunk, LlmUsage, OcrCache, OcrUploadPage
 from app.api.quizzes import router as quizzes_router 
 from app.api.leaderboard import router as leaderboard_router
 from app.api.exam import router as exam_router
@@ -16,14 +20,38 @@ from app.api.chunk import router as chunk_router
 from app.api.note_analysis import router as note_analysis_router 
 from app.api.ocr_repair import router as ocr_repair_router
 from app.api.ocr_zip import router as ocr_zip_router
+from app.api.ocr_pdf import router as ocr_pdf_router
 from app.api.search import router as search_router
 from app.api.rooms import router as rooms_router
 from app.api.fileUpload import router as file_upload_router
 from app.api.groupchat import router as groupchat_router  
 from app.api.notes import router as notes_router
-Base.metadata.create_all(bind=engine)
+from app.api.usage import router as usage_router
+from app.services.llm_clients import close_clients, aclose_clients
+from app.core.redis_client import close_redis
+from app.services.llm_telemetry import flush_usage, usage_flusher
+from app.services.analysis_jobs import job_pruner
+from app.services import warmup
+from app.services.ocr import shutdown_preprocess_pool
 
-app = FastAPI(title="AI Tutor - Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(Base.metadata.create_all, bind=engine)
+    app.state.usage_flusher = asyncio.create_task(usage_flusher())
+    app.state.job_pruner = asyncio.create_task(job_pruner())
+    # spaCy / LLM clients / Redis are preloaded in the background; /ready reports when done
+    app.state.warmup = asyncio.create_task(warmup.run_warmup())
+    yield
+    app.state.warmup.cancel()
+    app.state.usage_flusher.cancel()
+    app.state.job_pruner.cancel()
+    await asyncio.to_thread(flush_usage)
+    close_clients()
+    await aclose_clients()
+    await close_redis()
+    shutdown_preprocess_pool()
+
+app = FastAPI(title="AI Tutor - Backend", version="1.0.0", lifespan=lifespan)
 
 # allow the Vite dev server
 origins = ["http://localhost:5173", "http://127.0.0.1:5173"]
@@ -39,6 +67,15 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    # 503 until the startup warm-up has finished, so a load balancer holds traffic back
+    body = warmup.status()
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+# Prometheus scrape endpoint (LLM connection reuse, latency, etc.)
+app.mount("/metrics", make_asgi_app())
+
 app.include_router(auth_router)
 app.include_router(quizzes_router)
 app.include_router(leaderboard_router)
@@ -52,8 +89,10 @@ app.include_router(chunk_router)
 app.include_router(note_analysis_router)
 app.include_router(ocr_repair_router)
 app.include_router(ocr_zip_router)
+app.include_router(ocr_pdf_router)
 app.include_router(search_router)
 app.include_router(rooms_router)
 app.include_router(file_upload_router)
 app.include_router(groupchat_router)
-app.include_router(notes_router)
\ No newline at end of file
+app.include_router(notes_router)
+app.include_router(usage_router)
\ No newline at end of file
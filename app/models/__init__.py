@@ -15,8 +15,11 @@ from .connection_request import ConnectionRequest
 from .note_analysis import NoteAnalysis
 from .note_repair import NoteRepair
 from .note_chunks import NoteChunk
+from .llm_usage import LlmUsage
+from .ocr_cache import OcrCache
+from .ocr_upload import OcrUploadPage
 
 __all__ = ["Base", "User", "Note", "Quiz", "QuizItem", "Result", "ExamStart", "ResultAnswer", 
         "Flashcard", "FlashcardItem", "Rooms", "Messages", "File", "RoomInfo", "Tutor", "Professor", "ConnectionRequest", 
-        "NoteAnalysis", "NoteRepair", "NoteChunk"
+        "NoteAnalysis", "NoteRepair", "NoteChunk", "LlmUsage", "OcrCache", "OcrUploadPage"
         ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Date, DateTime, ForeignKey, UniqueConstraint, func
+from app.models.base import Base
+
+# Daily per-user LLM usage, one row per (user, day, feature, model).
+# Filled from app/services/llm_telemetry.py; never written per request.
+class LlmUsage(Base):
+    __tablename__ = "llm_usage"
+    __table_args__ = (UniqueConstraint("user_id", "day", "feature", "model", name="uq_llm_usage_user_day_feature_model"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    day = Column(Date, nullable=False)
+    feature = Column(String(32), nullable=False)
+    model = Column(String(64), nullable=False)
+
+    calls = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    retries = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    total_ms = Column(BigInteger, nullable=False, default=0)
+    max_ms = Column(Integer, nullable=False, default=0)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
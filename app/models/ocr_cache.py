@@ -0,0 +1,30 @@
+from sqlalchemy import BigInteger, Column, Integer, String, Text, LargeBinary, DateTime, ForeignKey, UniqueConstraint, Index, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from app.models.base import Base
+
+# OCR text per page image, keyed on the exact image bytes (sha256) plus the OCR model
+# and prompt version. `phash` (256-bit dHash) lets re-photographed / re-exported copies
+# of a page match too: `phash_bands` holds its 32-bit bands (GIN-indexed) so near
+# duplicates are found by index instead of scanning; see app/services/ocr_cache.py.
+class OcrCache(Base):
+    __tablename__ = "ocr_cache"
+    __table_args__ = (
+        UniqueConstraint("content_sha256", "model", "prompt_version", name="uq_ocr_cache_sha_model_prompt"),
+        Index("ix_ocr_cache_user_model_prompt", "user_id", "model", "prompt_version"),
+        Index("ix_ocr_cache_phash_bands", "phash_bands", postgresql_using="gin"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    content_sha256 = Column(String(64), nullable=False)
+    phash = Column(LargeBinary(32), nullable=True)
+    phash_bands = Column(ARRAY(BigInteger), nullable=True)
+    model = Column(String(64), nullable=False)
+    prompt_version = Column(String(32), nullable=False)
+    # uploader: near-duplicate matches are only served within the same user's pages
+    user_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+
+    text = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now())
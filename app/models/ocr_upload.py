@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import UUID
+from app.models.base import Base
+
+# Manifest of /ocr/zip uploads: one row per page whose note was committed, keyed on the
+# uploader, the sha256 of the zip and the member path. Written in the same savepoint as
+# the note, so a retried upload of the same zip skips exactly the pages that landed.
+class OcrUploadPage(Base):
+    __tablename__ = "ocr_upload_pages"
+    __table_args__ = (
+        UniqueConstraint("user_id", "upload_sha256", "member_name", name="uq_ocr_upload_pages_user_upload_member"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    upload_sha256 = Column(String(64), nullable=False)
+    member_name = Column(String(1024), nullable=False)
+    # deleting the note forgets the page, so the next retry OCRs it again
+    note_id = Column(UUID(as_uuid=True), ForeignKey("notes.note_id", ondelete="CASCADE"), nullable=False, index=True)
+    repair_id = Column(UUID(as_uuid=True), ForeignKey("note_repairs.repair_id", ondelete="SET NULL"), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
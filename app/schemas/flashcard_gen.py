@@ -23,6 +23,7 @@ class GenerateBaseFC(BaseModel):
     topic: str = ""
     num_items: int = Field(10, ge=1, le=50)
     title: str = "Generated Flashcards"
+    no_cache: bool = False  # force a fresh generation instead of a cached identical one
 
 class GenerateWithoutNoteFC(GenerateBaseFC):
     pass
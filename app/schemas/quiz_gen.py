@@ -14,6 +14,7 @@ class GenerateBase(BaseModel):
     mode: Literal["practice", "exam"] = "practice"
     num_items: int = Field(10, ge=1, le=50)
     types: List[QuizType] = ["mcq"]  # which item types to include
+    no_cache: bool = False  # force a fresh generation instead of a cached identical one
 
 class GenerateWithoutNote(GenerateBase):
     pass
@@ -0,0 +1,167 @@
+from __future__ import annotations
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, report_redis_error
+
+# Background note-analysis jobs. The job runs as an asyncio task in the worker that
+# accepted it; its state lives in this process and is mirrored to Redis (best effort)
+# so a status poll or event stream that lands on another worker can still follow it.
+
+_KEY_PREFIX = "analysis:job:v1"
+_FINISHED = ("done", "error")
+
+
+class AnalysisJob:
+    def __init__(self, user_id: str, note_id: str):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.note_id = note_id
+        self.status = "queued"        # queued | running | done | error
+        self.stage = "queued"
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        self.analysis_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._mirror_pending = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "note_id": self.note_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "analysis_id": self.analysis_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def update(self, stage: str, **fields: Any) -> None:
+        """Progress callback for analyze_note_text (and the job's own stages)."""
+        self.stage = stage
+        if fields:
+            self.progress[stage] = fields
+        self._touch()
+
+    def finish(self, status: str, *, analysis_id: Optional[str] = None, error: Optional[str] = None) -> None:
+        self.status = status
+        self.stage = status
+        self.analysis_id = analysis_id
+        self.error = error
+        self._touch()
+
+    def _touch(self) -> None:
+        self.updated_at = time.time()
+        # wake every waiter, then start a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+        _schedule_mirror(self)
+
+    async def wait_changed(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+_jobs: Dict[str, AnalysisJob] = {}
+_mirror_tasks: Set[asyncio.Task] = set()  # the loop only keeps weak references to tasks
+
+
+def _prune() -> None:
+    cutoff = time.time() - settings.ANALYSIS_JOB_TTL_SECONDS
+    for job_id, job in list(_jobs.items()):
+        if job.status in _FINISHED and job.updated_at < cutoff:
+            del _jobs[job_id]
+
+
+def start_job(user_id: str, note_id: str, work: Callable[[AnalysisJob], Awaitable[str]]) -> AnalysisJob:
+    """Register a job and run `work(job)` in the background; work returns the analysis id."""
+    _prune()
+    job = AnalysisJob(str(user_id), str(note_id))
+    _jobs[job.job_id] = job
+
+    async def _run() -> None:
+        job.status = "running"
+        job._touch()
+        try:
+            analysis_id = await work(job)
+        except Exception as e:
+            print("analysis job failed", job.job_id, "->", e)
+            job.finish("error", error=getattr(e, "detail", None) or str(e) or type(e).__name__)
+        else:
+            job.finish("done", analysis_id=analysis_id)
+
+    job.task = asyncio.get_running_loop().create_task(_run())
+    _schedule_mirror(job)
+    return job
+
+
+async def job_pruner() -> None:
+    """Background task: drop expired finished jobs even when no new job comes in (started from app.main)."""
+    while True:
+        await asyncio.sleep(max(1.0, settings.ANALYSIS_JOB_TTL_SECONDS / 4))
+        _prune()
+
+
+def local_job(job_id: str) -> Optional[AnalysisJob]:
+    _prune()
+    return _jobs.get(job_id)
+
+
+async def get_snapshot(job_id: str) -> Optional[Dict[str, Any]]:
+    _prune()
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job.snapshot()
+    r = get_redis()
+    if r is None:
+        return None
+    try:
+        raw = await r.get(f"{_KEY_PREFIX}:{job_id}")
+    except Exception as e:
+        report_redis_error(e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def is_finished(snapshot: Dict[str, Any]) -> bool:
+    return snapshot.get("status") in _FINISHED
+
+
+# ---------- Redis mirror ----------
+
+def _schedule_mirror(job: AnalysisJob) -> None:
+    # coalesce bursts of progress updates into one write at a time
+    if job._mirror_pending or get_redis() is None:
+        return
+    job._mirror_pending = True
+    task = asyncio.get_running_loop().create_task(_mirror(job))
+    _mirror_tasks.add(task)
+    task.add_done_callback(_mirror_tasks.discard)
+
+
+async def _mirror(job: AnalysisJob) -> None:
+    try:
+        await asyncio.sleep(0)  # let the rest of this update burst land first
+        job._mirror_pending = False
+        r = get_redis()
+        if r is None:
+            return
+        await r.set(
+            f"{_KEY_PREFIX}:{job.job_id}",
+            json.dumps(job.snapshot(), default=str),
+            ex=settings.ANALYSIS_JOB_TTL_SECONDS,
+        )
+    except Exception as e:
+        report_redis_error(e)
@@ -1,7 +1,10 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import asyncio
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
 from app.core.config import settings
+from app.services import llm_gateway
+from app.services.llm_scheduler import ANALYSIS
 from .parser import to_blocks_with_sentences, sliding_windows
 
 DEFAULT_SUBJECT = getattr(settings, "SUBJECT", None)
@@ -12,11 +15,12 @@ MAX_TOK_SUMMARY = getattr(settings, "MAX_TOKENS_SUMMARY", 300)
 MAX_TOK_DEF     = getattr(settings, "MAX_TOKENS_DEFINITION", 120)
 MAX_TOK_FLAGS   = getattr(settings, "MAX_TOKENS_ACCURACY", 320)
 
-_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-def detect_subject(text: str) -> str:
+async def detect_subject(text: str) -> str:
 
-    r = _client.chat.completions.create(
+    r = await llm_gateway.chat_completion(
         model="gpt-4o-mini",
+        priority=ANALYSIS,
+        feature="analyzer",
         messages=[
             {"role": "system", "content": "You classify academic notes."},
             {"role": "user", "content": "What is the main academic subject of the following note?\n\n" + text[:1500] + "\n\nReturn a one- or two-word subject (e.g., physics, biology, algebra)."}
@@ -26,30 +30,43 @@ def detect_subject(text: str) -> str:
     )
     return r.choices[0].message.content.strip().lower()
 
-def summarize_whole(text: str, subject: str) -> str:
+async def summarize_whole(text: str, subject: str) -> str:
     sys = f"You are an expert {subject} tutor. Summarize the student's note concisely."
-    r = _client.chat.completions.create(
+    r = await llm_gateway.chat_completion(
         model=MODEL_SUMMARY,
+        priority=ANALYSIS,
+        feature="analyzer",
         messages=[{"role":"system","content":sys},{"role":"user","content":text[:6000]}],
         temperature=0.2, max_tokens=MAX_TOK_SUMMARY
     )
     return (r.choices[0].message.content or "").strip()
 
-def summarize_block(block_text: str, subject: str) -> str:
+async def summarize_block(block_text: str, subject: str) -> str:
     sys = f"You are an expert {subject} tutor. Summarize this block in 1–2 sentences."
-    r = _client.chat.completions.create(
+    r = await llm_gateway.chat_completion(
         model=MODEL_SUMMARY,
+        priority=ANALYSIS,
+        feature="analyzer",
         messages=[{"role":"system","content":sys},{"role":"user","content":block_text[:4000]}],
         temperature=0.2, max_tokens=120
     )
     return (r.choices[0].message.content or "").strip()
 
-def maybe_definition(block_text: str, subject: str) -> Optional[str]:
+def _definition_term(block_text: str) -> Optional[str]:
+    # a block gets a definition when it opens with a short "Term:" line or a short heading
     first = block_text.strip().split("\n", 1)[0]
     if (":" in first and len(first.split(":")[0].split()) <= 8) or len(first.split()) <= 8:
-        prompt = f"Define the {subject} term '{first.strip(':').strip()}' in one precise sentence. Use the block if helpful.\n\nBlock:\n{block_text}"
-        r = _client.chat.completions.create(
+        return first.strip(':').strip()
+    return None
+
+async def maybe_definition(block_text: str, subject: str) -> Optional[str]:
+    term = _definition_term(block_text)
+    if term is not None:
+        prompt = f"Define the {subject} term '{term}' in one precise sentence. Use the block if helpful.\n\nBlock:\n{block_text}"
+        r = await llm_gateway.chat_completion(
             model=MODEL_DEF,
+            priority=ANALYSIS,
+            feature="analyzer",
             messages=[{"role":"system","content":"You write concise academic definitions."},
                       {"role":"user","content":prompt[:4000]}],
             temperature=0.2, max_tokens=MAX_TOK_DEF
@@ -57,11 +74,13 @@ def maybe_definition(block_text: str, subject: str) -> Optional[str]:
         return (r.choices[0].message.content or "").strip()
     return None
 
-def window_flags(window_text: str, subject: str) -> List[Dict[str, Any]]:
+async def window_flags(window_text: str, subject: str) -> List[Dict[str, Any]]:
     sys = "You review notes for factual issues, missing steps, or clarity problems. Return a strict JSON array."
     user = f"Subject: {subject}\n\nReview the following excerpt and return a JSON array of flags. Keys: quote, issue, why, suggested_fix, location.\n\nExcerpt:\n{window_text}"
-    r = _client.chat.completions.create(
+    r = await llm_gateway.chat_completion(
         model=MODEL_FLAGS,
+        priority=ANALYSIS,
+        feature="analyzer",
         messages=[{"role":"system","content":sys},{"role":"user","content":user[:6000]}],
         temperature=0.2, max_tokens=MAX_TOK_FLAGS
     )
@@ -78,47 +97,297 @@ def window_flags(window_text: str, subject: str) -> List[Dict[str, Any]]:
                 return []
         return []
 
-def analyze_note_text(full_text: str, subject: Optional[str] = None) -> Dict[str, Any]:
+# ---------- batched block summaries ----------
+# One structured call covers many short blocks, so per-request overhead is paid
+# O(blocks / batch) times instead of O(blocks).
+
+BATCH_BLOCK_CHARS = 4000   # same per-block cap as summarize_block
+BATCH_SUMMARY_TOKENS = 80  # completion budget per block summary
+
+_BATCH_SCHEMA = {
+    "name": "block_summaries",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["blocks"],
+        "properties": {
+            "blocks": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["index", "summary", "definition"],
+                    "properties": {
+                        "index": {"type": "integer"},
+                        "summary": {"type": "string"},
+                        "definition": {"type": ["string", "null"]},
+                    },
+                },
+            },
+        },
+    },
+}
+
+def _block_batches(blocks: List[Dict[str, Any]], budget_tokens: int, max_blocks: int) -> List[List[int]]:
+    """Split block indices into consecutive batches of at most budget_tokens prompt tokens."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    used = 0
+    for i, b in enumerate(blocks):
+        cost = len(b["text"][:BATCH_BLOCK_CHARS]) // 4 + 20
+        if cur and (used + cost > budget_tokens or len(cur) >= max_blocks):
+            batches.append(cur)
+            cur, used = [], 0
+        cur.append(i)
+        used += cost
+    if cur:
+        batches.append(cur)
+    return batches
+
+async def summarize_blocks_batch(block_texts: List[str], subject: str) -> Optional[List[Dict[str, Optional[str]]]]:
+    """
+    Summaries (and definitions, where maybe_definition would produce one) for several
+    blocks in one call. Returns one {"summary", "definition"} per block, in order, or
+    None if the reply can't be mapped back onto the blocks.
+    """
+    terms = [_definition_term(t) for t in block_texts]
+    parts = []
+    for i, (text, term) in enumerate(zip(block_texts, terms)):
+        want = f"DEFINE: {term}" if term is not None else "DEFINE: -"
+        parts.append(f"### BLOCK {i}\n{want}\n{text[:BATCH_BLOCK_CHARS]}")
+    user = (
+        f"Return exactly {len(block_texts)} entries in `blocks`, one per block below, in order, with `index` set to the block number.\n"
+        "- summary: the block in 1–2 sentences.\n"
+        "- definition: if the block has a DEFINE term, define that term in one precise sentence "
+        "(use the block if helpful); otherwise null.\n\n"
+        + "\n\n".join(parts)
+    )
+    max_tokens = sum(BATCH_SUMMARY_TOKENS + (MAX_TOK_DEF if t is not None else 0) for t in terms) + 50
+    r = await llm_gateway.chat_completion(
+        model=MODEL_SUMMARY,
+        priority=ANALYSIS,
+        feature="analyzer",
+        messages=[
+            {"role": "system", "content": f"You are an expert {subject} tutor. You summarize note blocks and write concise academic definitions."},
+            {"role": "user", "content": user},
+        ],
+        temperature=0.2, max_tokens=min(max_tokens, 8000),
+        response_format={"type": "json_schema", "json_schema": _BATCH_SCHEMA},
+    )
+    import json
+    try:
+        entries = json.loads(r.choices[0].message.content or "{}").get("blocks") or []
+    except Exception:
+        return None
+    if len(entries) != len(block_texts):
+        return None
+    # entries are only mapped back by `index`, and only if it is a permutation of the block
+    # numbers: a reply in the wrong order would silently put a summary on the wrong block
+    if sorted(e.get("index") for e in entries if isinstance(e.get("index"), int)) != list(range(len(entries))):
+        return None
+    entries = sorted(entries, key=lambda e: e["index"])
+    out = []
+    for e, term in zip(entries, terms):
+        summary = (e.get("summary") or "").strip()
+        if not summary:
+            return None
+        definition = (e.get("definition") or "").strip() if term is not None else ""
+        out.append({"summary": summary, "definition": definition or None})
+    return out
+
+async def _enrich_batch(batch: List[Dict[str, Any]], subject: str, sem: asyncio.Semaphore) -> List[Dict[str, Any]]:
+    async with sem:
+        try:
+            results = await summarize_blocks_batch([b["text"] for b in batch], subject)
+        except Exception:
+            results = None
+    if results is None:
+        # reply didn't line up with the blocks: do this batch one block at a time
+        return list(await asyncio.gather(*(_enrich_block(b, subject, sem) for b in batch)))
+    enriched = []
+    for b, res in zip(batch, results):
+        item = {"type": b["type"], "text": b["text"], "sentences": b["sentences"], "summary": res["summary"]}
+        if res["definition"]:
+            item["definition"] = res["definition"]
+        enriched.append(item)
+    return enriched
+
+async def _enrich_blocks(
+    blocks: List[Dict[str, Any]], subject: str, sem: asyncio.Semaphore, batched: bool,
+    on_done: Callable[[int], None],
+) -> List[Dict[str, Any]]:
+    if not batched:
+        return list(await asyncio.gather(*(_tick(_enrich_block(b, subject, sem), 1, on_done) for b in blocks)))
+    batches = _block_batches(blocks, settings.ANALYSIS_BATCH_TOKENS, settings.ANALYSIS_BATCH_MAX_BLOCKS)
+    results = await asyncio.gather(*(
+        _tick(_enrich_batch([blocks[i] for i in idx], subject, sem), len(idx), on_done) for idx in batches
+    ))
+    return [item for batch in results for item in batch]
+
+async def _enrich_block(b: Dict[str, Any], subject: str, sem: asyncio.Semaphore) -> Dict[str, Any]:
+    item = {"type": b["type"], "text": b["text"], "sentences": b["sentences"]}
+    async with sem:
+        summary, d = await asyncio.gather(
+            summarize_block(b["text"], subject),
+            maybe_definition(b["text"], subject),
+        )
+    item["summary"] = summary
+    if d:
+        item["definition"] = d
+    return item
+
+async def _bounded(coro, sem: asyncio.Semaphore):
+    async with sem:
+        return await coro
+
+async def _tick(coro, n: int, on_done: Callable[[int], None]):
+    result = await coro
+    on_done(n)
+    return result
+
+# progress(stage, **fields) is called as the analysis moves along; stages are
+# subject, parse, summary, blocks (done/total) and windows (done/total).
+ProgressFn = Callable[..., None]
+
+def _no_progress(stage: str, **fields: Any) -> None:
+    pass
+
+def _content_hash(*parts: str) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update((p or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:32]
 
+def _reusable(previous: Optional[Dict[str, Any]], subject: str):
+    """(block hash -> block item, window hash -> flags, text hash, summary) from a previous analysis."""
+    meta = (previous or {}).get("meta") or {}
+    if not previous or previous.get("subject") != subject or not meta.get("block_hashes"):
+        return {}, {}, None, None
+    prev_blocks = previous.get("blocks") or []
+    prev_flags = previous.get("flags") or []
+    by_block = {h: b for h, b in zip(meta["block_hashes"], prev_blocks)}
+    by_window = {
+        h: [prev_flags[i] for i in idx if 0 <= i < len(prev_flags)]
+        for h, idx in (meta.get("window_flags") or {}).items()
+    }
+    return by_block, by_window, meta.get("text_hash"), previous.get("summary")
+
+async def analyze_note_text(
+    full_text: str,
+    subject: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    batched: Optional[bool] = None,
+    previous: Optional[Dict[str, Any]] = None,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """
+    `previous` is the last stored analysis of the same note (subject/summary/blocks/flags/meta).
+    Blocks and flag windows whose content hash is unchanged are taken from it; only new or
+    edited ones go to the LLM.
+    """
+    progress = progress or _no_progress
+    if not subject and previous and previous.get("subject"):
+        subject = previous["subject"]  # small edits don't change the subject
     if not subject:
+        progress("subject")
         try:
-            subject = detect_subject(full_text)
+            subject = await detect_subject(full_text)
         except Exception:
             subject = DEFAULT_SUBJECT or "general"
 
-    blocks = to_blocks_with_sentences(full_text or "")
-    # Whole-note summary
-    whole_summary = summarize_whole("\n\n".join(b["text"] for b in blocks), subject)
+    # spaCy parsing is CPU-bound; keep it off the event loop
+    progress("parse", subject=subject)
+    blocks = await asyncio.to_thread(to_blocks_with_sentences, full_text or "")
+    # windows for flags (one-block overlap)
+    windows = sliding_windows([b["text"] for b in blocks], max_chars=2800, overlap_blocks=1)
+
+    block_hashes = [_content_hash(subject, b["type"], b["text"]) for b in blocks]
+    window_hashes = [_content_hash(subject, w) for w in windows]
+    joined = "\n\n".join(b["text"] for b in blocks)
+    text_hash = _content_hash(subject, joined)
+    prev_blocks, prev_windows, prev_text_hash, prev_summary = _reusable(previous, subject)
 
-    # Per-block enrich
+    todo_blocks = [i for i, h in enumerate(block_hashes) if h not in prev_blocks]
+    todo_windows = [i for i, h in enumerate(window_hashes) if h not in prev_windows]
+    reuse_summary = prev_text_hash == text_hash and prev_summary is not None
+
+    # Whole-note summary, per-block enrich and window flags are independent calls:
+    # fan them out, at most ANALYSIS_CONCURRENCY blocks/windows at a time. gather()
+    # keeps results in input order, so output is the same as the sequential version.
+    sem = asyncio.Semaphore(max(1, concurrency or settings.ANALYSIS_CONCURRENCY))
+    batched = settings.ANALYSIS_BATCHED if batched is None else batched
+
+    async def _summary() -> str:
+        if reuse_summary:
+            return prev_summary
+        summary = await _bounded(summarize_whole(joined, subject), sem)
+        progress("summary", done=True)
+        return summary
+
+    done = {"blocks": len(blocks) - len(todo_blocks), "windows": len(windows) - len(todo_windows)}
+    total = {"blocks": len(blocks), "windows": len(windows)}
+
+    def _advance(stage: str) -> Callable[[int], None]:
+        def on_done(n: int) -> None:
+            done[stage] += n
+            progress(stage, done=done[stage], total=total[stage])
+        return on_done
+
+    progress("summary", done=reuse_summary)
+    progress("blocks", done=done["blocks"], total=total["blocks"])
+    progress("windows", done=done["windows"], total=total["windows"])
+
+    whole_summary, new_blocks, new_flag_lists = await asyncio.gather(
+        _summary(),
+        _enrich_blocks([blocks[i] for i in todo_blocks], subject, sem, batched, _advance("blocks")),
+        asyncio.gather(*(_tick(_bounded(window_flags(windows[i], subject), sem), 1, _advance("windows")) for i in todo_windows)),
+    )
+
+    fresh_blocks = dict(zip(todo_blocks, new_blocks))
     enriched: List[Dict[str, Any]] = []
-    for b in blocks:
-        item = {"type": b["type"], "text": b["text"], "sentences": b["sentences"]}
-        item["summary"] = summarize_block(b["text"], subject)
-        d = maybe_definition(b["text"], subject)
-        if d:
-            item["definition"] = d
+    for i, (b, h) in enumerate(zip(blocks, block_hashes)):
+        if i in fresh_blocks:
+            enriched.append(fresh_blocks[i])
+            continue
+        old = prev_blocks[h]
+        item = {"type": b["type"], "text": b["text"], "sentences": b["sentences"], "summary": old.get("summary")}
+        if old.get("definition"):
+            item["definition"] = old["definition"]
         enriched.append(item)
 
-    # windows for flags (one-block overlap)
-    windows = sliding_windows([b["text"] for b in blocks], max_chars=2800, overlap_blocks=1)
-    all_flags = []
-    for w in windows:
-        all_flags.extend(window_flags(w, subject))
+    fresh_flags = dict(zip(todo_windows, new_flag_lists))
+    flag_lists = [fresh_flags[i] if i in fresh_flags else prev_windows[h] for i, h in enumerate(window_hashes)]
 
-    # De-dup flags by (quote, issue, suggested_fix)
+    # De-dup flags by (quote, issue, suggested_fix); remember which flags each window produced
     merged: List[Dict[str, Any]] = []
-    seen = set()
-    for f in all_flags:
-        key = (f.get("quote",""), f.get("issue",""), f.get("suggested_fix",""))
-        if key not in seen:
-            merged.append(f)
-            seen.add(key)
+    seen: Dict[tuple, int] = {}
+    window_flags_idx: Dict[str, List[int]] = {}
+    for h, flags in zip(window_hashes, flag_lists):
+        idx = window_flags_idx.setdefault(h, [])
+        for f in flags:
+            key = (f.get("quote",""), f.get("issue",""), f.get("suggested_fix",""))
+            if key not in seen:
+                seen[key] = len(merged)
+                merged.append(f)
+            idx.append(seen[key])
 
     return {
         "subject": subject,
         "summary": whole_summary,
         "blocks": enriched,
         "flags": merged,
-        "meta": {"num_blocks": len(blocks), "num_windows": len(windows)}
+        "meta": {
+            "num_blocks": len(blocks),
+            "num_windows": len(windows),
+            "reused_blocks": len(blocks) - len(todo_blocks),
+            "recomputed_blocks": len(todo_blocks),
+            "reused_windows": len(windows) - len(todo_windows),
+            "recomputed_windows": len(todo_windows),
+            "summary_reused": reuse_summary,
+            "text_hash": text_hash,
+            "block_hashes": block_hashes,
+            "window_flags": window_flags_idx,
+        }
     }
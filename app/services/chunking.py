@@ -1,7 +1,10 @@
 import re
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
-from openai import OpenAI
+
+from app.core.config import settings
+from app.services import llm_gateway
+from app.services.llm_scheduler import BACKFILL
 from app.models.note import Note
 from app.models.note_chunks import NoteChunk
 
@@ -100,33 +103,43 @@ def split_into_chunks(text: str, max_chars: int = 800, overlap: int = 80) -> Lis
             out.append(c)
     return out
 
-def embed_texts(client: Optional[OpenAI], texts: List[str], model: str) -> List[Optional[list]]:
-    """Return embeddings for each text (or None if client is None)."""
-    if not client:
+async def embed_texts(texts: List[str], model: str, priority: int = BACKFILL) -> List[Optional[list]]:
+    """Return embeddings for each text (or None if no OpenAI key is configured)."""
+    if not settings.OPENAI_API_KEY or not texts:
         return [None for _ in texts]
     # Batch to reduce round-trips; OpenAI supports list input.
-    resp = client.embeddings.create(model=model, input=texts)
+    resp = await llm_gateway.embeddings(model=model, input=texts, priority=priority, feature="chunking")
     return [d.embedding for d in resp.data]
 
-def chunk_and_store(
+def store_chunks(db: Session, note: Note, chunks: List[str], embeddings: List[Optional[list]]) -> int:
+    """Replace the note's NoteChunk rows with `chunks` (flush only, caller commits)."""
+    # wipe existing
+    db.query(NoteChunk).filter(NoteChunk.note_id == note.note_id).delete()
+    for idx, (text, emb) in enumerate(zip(chunks, embeddings)):
+        db.add(NoteChunk(note_id=note.note_id, chunk_index=idx, text=text, embedding=emb))
+    db.flush()
+    return len(chunks)
+
+async def embed_chunks(
+    text: str,
+    embed_model: str = "text-embedding-3-small",
+    max_chars: int = 800,
+    overlap: int = 80,
+    priority: int = BACKFILL,
+) -> Tuple[List[str], List[Optional[list]]]:
+    chunks = split_into_chunks(text or "", max_chars=max_chars, overlap=overlap)
+    return chunks, await embed_texts(chunks, embed_model, priority=priority)
+
+async def chunk_and_store(
     db: Session,
     note: Note,
-    client: Optional[OpenAI],
     embed_model: str = "text-embedding-3-small",
     max_chars: int = 800,
     overlap: int = 80,
+    priority: int = BACKFILL,
 ) -> int:
-    """Split note.og_text into chunks, embed (if client), and upsert NoteChunk rows.
+    """Split note.og_text into chunks, embed, and upsert NoteChunk rows.
        Returns number of chunks written.
     """
-    chunks = split_into_chunks(note.og_text or "", max_chars=max_chars, overlap=overlap)
-    # wipe existing
-    db.query(NoteChunk).filter(NoteChunk.note_id == note.note_id).delete()
-    if not chunks:
-        db.flush()
-        return 0
-    embeddings = embed_texts(client, chunks, embed_model)
-    for idx, (text, emb) in enumerate(zip(chunks, embeddings)):
-        db.add(NoteChunk(note_id=note.note_id, chunk_index=idx, text=text, embedding=emb))
-    db.flush()
-    return len(chunks)
+    chunks, embeddings = await embed_chunks(note.og_text or "", embed_model, max_chars, overlap, priority)
+    return store_chunks(db, note, chunks, embeddings)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, Iterable, List
+
+
+class JsonArrayItemParser:
+    """
+    Incrementally pulls complete objects out of a top-level array in a JSON document
+    that arrives in pieces, e.g. {"items": [ {...}, {...}, ... ]} from a streamed completion.
+
+        parser = JsonArrayItemParser(keys=("items",))
+        for delta in stream:
+            for obj in parser.feed(delta):
+                ...
+
+    Only objects that are direct children of the array under one of `keys` on the root
+    object are returned; nested arrays/objects inside an item are part of that item.
+    """
+
+    def __init__(self, keys: Iterable[str] = ("items",)):
+        self.keys = set(keys)
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._str_buf: List[str] = []
+        self._last_root_string: str | None = None
+        self._root_key: str | None = None  # key whose value is currently being read on the root object
+        self._array_depth: int | None = None  # depth of the target array once entered
+        self._item_buf: List[str] | None = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for ch in chunk:
+            if self._item_buf is not None:
+                self._item_buf.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_root_string = "".join(self._str_buf)
+                elif self._depth == 1:
+                    self._str_buf.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._str_buf = []
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._array_depth is None and self._root_key in self.keys:
+                    self._array_depth = 2
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_buf = ["{"]
+            elif ch == ":" and self._depth == 1:
+                self._root_key = self._last_root_string
+            elif ch == "," and self._depth == 1:
+                self._root_key = None
+            elif ch in "}]":
+                self._depth -= 1
+                if self._array_depth is not None and self._item_buf is not None and self._depth == self._array_depth:
+                    raw = "".join(self._item_buf)
+                    self._item_buf = None
+                    try:
+                        obj = json.loads(raw)
+                    except Exception:
+                        obj = None
+                    if isinstance(obj, dict):
+                        out.append(obj)
+                elif ch == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+        return out
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, report_redis_error
+
+# Content-addressed cache for structured (json_schema) completions.
+# Tier 1 is a bounded in-process LRU, tier 2 is Redis (shared by all workers).
+
+LLM_CACHE = Counter(
+    "llm_cache_requests_total",
+    "Structured LLM response cache lookups",
+    ["tier", "result"],  # tier: memory | redis, result: hit | miss
+)
+
+_KEY_PREFIX = "llm:v1"
+
+
+def _digest(obj: Any) -> str:
+    raw = json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_key(model: str, messages: Any, schema: Any, temperature: Any, max_tokens: Any = None) -> str:
+    prompt_hash = _digest({"messages": messages, "max_tokens": max_tokens})
+    schema_hash = _digest(schema)
+    return f"{_KEY_PREFIX}:{model}:{prompt_hash}:{schema_hash}:{temperature}"
+
+
+class _LRU:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            expires, value = hit
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_memory = _LRU(settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL_SECONDS)
+
+
+def _redis():
+    return get_redis() if settings.LLM_CACHE_REDIS else None
+
+
+async def get(key: str) -> Optional[str]:
+    value = _memory.get(key)
+    LLM_CACHE.labels("memory", "hit" if value is not None else "miss").inc()
+    if value is not None:
+        return value
+
+    r = _redis()
+    if r is None:
+        return None
+    try:
+        raw = await r.get(key)
+    except Exception as e:
+        report_redis_error(e)
+        return None
+    LLM_CACHE.labels("redis", "hit" if raw is not None else "miss").inc()
+    if raw is None:
+        return None
+    value = raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else str(raw)
+    _memory.put(key, value)
+    return value
+
+
+async def put(key: str, value: str) -> None:
+    _memory.put(key, value)
+    r = _redis()
+    if r is None:
+        return
+    try:
+        await r.set(key, value, ex=settings.LLM_CACHE_TTL_SECONDS)
+    except Exception as e:
+        report_redis_error(e)
+
+
+def clear_memory() -> None:
+    _memory.clear()
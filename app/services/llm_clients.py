@@ -0,0 +1,155 @@
+from __future__ import annotations
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from prometheus_client import Counter
+
+from app.core.config import settings
+
+# One OpenAI client per (api_key, base_url) for the whole process, so every call
+# site shares the same keep-alive pool instead of paying a TLS handshake per request.
+
+OPENAI_CONNECTIONS = Counter(
+    "openai_http_requests_total",
+    "OpenAI HTTP requests by whether they opened a new connection or reused a pooled one",
+    ["connection"],  # new | reused
+)
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+# async clients hold loop-bound connections, so keep one set per event loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    return settings.OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.OPENAI_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.OPENAI_READ_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+class _ConnTrace:
+    """httpcore trace hook; remembers whether this request had to open a TCP connection."""
+
+    def __init__(self):
+        self.connected = False
+
+    def __call__(self, event_name: str, info: dict) -> None:
+        if event_name.startswith("connection.connect_tcp."):
+            self.connected = True
+
+
+class _AsyncConnTrace(_ConnTrace):
+    async def __call__(self, event_name: str, info: dict) -> None:
+        super().__call__(event_name, info)
+
+
+def _on_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _ConnTrace()
+
+
+def _on_response(response: httpx.Response) -> None:
+    tr = response.request.extensions.get("trace")
+    if isinstance(tr, _ConnTrace):
+        OPENAI_CONNECTIONS.labels("new" if tr.connected else "reused").inc()
+
+
+async def _aon_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _AsyncConnTrace()
+
+
+async def _aon_response(response: httpx.Response) -> None:
+    _on_response(response)
+
+
+def _build_client(api_key: str) -> OpenAI:
+    http_client = DefaultHttpxClient(
+        limits=_limits(),
+        timeout=_timeout(),
+        http2=_http2_available(),
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=settings.OPENAI_BASE_URL,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+def _build_async_client(api_key: str) -> AsyncOpenAI:
+    http_client = DefaultAsyncHttpxClient(
+        limits=_limits(),
+        timeout=_timeout(),
+        http2=_http2_available(),
+        event_hooks={"request": [_aon_request], "response": [_aon_response]},
+    )
+    # retries are done by llm_gateway so they go back through the rate-limit scheduler
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=settings.OPENAI_BASE_URL,
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    """Return the shared, pooled OpenAI client (built on first use)."""
+    key = api_key or settings.OPENAI_API_KEY
+    cache_key = (key, settings.OPENAI_BASE_URL)
+    client = _clients.get(cache_key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            client = _build_client(key)
+            _clients[cache_key] = client
+    return client
+
+
+def get_async_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Return the shared AsyncOpenAI client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    key = api_key or settings.OPENAI_API_KEY
+    cache_key = (key, settings.OPENAI_BASE_URL)
+    per_loop = _async_clients.setdefault(loop, {})
+    client = per_loop.get(cache_key)
+    if client is None:
+        client = _build_async_client(key)
+        per_loop[cache_key] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    per_loop = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in per_loop.values():
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+
+def close_clients() -> None:
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
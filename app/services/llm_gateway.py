@@ -0,0 +1,242 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion
+
+from app.core.config import settings
+from app.services import llm_cache
+from app.services.llm_telemetry import LlmCall, track
+from app.services.llm_clients import get_async_openai_client
+from app.services.llm_scheduler import (
+    INTERACTIVE,
+    LLM_RETRIES,
+    backoff_delay,
+    get_scheduler,
+    retry_after_seconds,
+)
+
+# Every async LLM / embedding request goes through here. The per-model scheduler
+# (llm_scheduler) decides when a request may go out: priority class first, then the
+# RPM/TPM buckets and the in-flight cap. Waiting requests only cost a suspended
+# coroutine, not a threadpool thread. 429s / 5xx / connection errors are retried
+# here, honouring Retry-After with jitter. Every call is tagged with a `feature` and
+# recorded by llm_telemetry (latency, TTFT, tokens, cost, retries, cache status).
+
+IMAGE_TOKENS = 765          # one high-detail ~1024px image
+DEFAULT_COMPLETION_TOKENS = 512
+
+_RETRYABLE = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> int:
+    chars, images = 0, 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    images += 1
+                else:
+                    chars += len(part.get("text") or "")
+    return chars // 4 + images * IMAGE_TOKENS + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def _usage_tokens(resp: Any) -> Optional[int]:
+    usage = getattr(resp, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _retry_reason(exc: BaseException) -> Optional[str]:
+    if isinstance(exc, RateLimitError):
+        # an exhausted quota is not going to clear up by waiting
+        return None if getattr(exc, "code", None) == "insufficient_quota" else "rate_limited"
+    if isinstance(exc, InternalServerError):
+        return "server_error"
+    if isinstance(exc, APIConnectionError):
+        return "connection"
+    return None
+
+
+def _on_retryable(model: str, exc: BaseException, attempt: int) -> float:
+    """Return how long to wait before retrying, or re-raise if we should give up."""
+    reason = _retry_reason(exc)
+    retry_after = retry_after_seconds(exc)
+    if isinstance(exc, RateLimitError):
+        get_scheduler(model).pause(retry_after if retry_after is not None else backoff_delay(attempt))
+    if reason is None or attempt >= settings.LLM_RETRY_MAX:
+        raise exc
+    LLM_RETRIES.labels(model, reason).inc()
+    return backoff_delay(attempt, retry_after)
+
+
+async def _scheduled(
+    model: str, priority: int, est_tokens: int, send: Callable[[], Awaitable[Any]], call: LlmCall,
+) -> Any:
+    sched = get_scheduler(model)
+    attempt = 0
+    while True:
+        await sched.acquire(priority, est_tokens)
+        actual = None
+        try:
+            resp = await send()
+            actual = _usage_tokens(resp)
+            call.usage(getattr(resp, "usage", None))
+            return resp
+        except _RETRYABLE as e:
+            delay = _on_retryable(model, e, attempt)
+        finally:
+            sched.release(actual, est_tokens)
+        attempt += 1
+        call.retries = attempt
+        await asyncio.sleep(delay)
+
+
+def _structured_schema(kwargs: Dict[str, Any]) -> Optional[dict]:
+    rf = kwargs.get("response_format")
+    if isinstance(rf, dict) and rf.get("type") == "json_schema" and not kwargs.get("stream"):
+        return rf.get("json_schema")
+    return None
+
+
+async def chat_completion(
+    *,
+    model: str,
+    messages: List[Dict[str, Any]],
+    use_cache: bool = True,
+    priority: int = INTERACTIVE,
+    feature: str = "other",
+    **kwargs: Any,
+):
+    """
+    chat.completions.create on the shared AsyncOpenAI client, scheduled per model.
+    Structured (json_schema) calls are served from llm_cache unless use_cache=False.
+    """
+    with track(feature, model) as call:
+        key = None
+        schema = _structured_schema(kwargs)
+        if use_cache and schema is not None and settings.LLM_CACHE_ENABLED:
+            key = llm_cache.cache_key(model, messages, schema, kwargs.get("temperature"), kwargs.get("max_tokens"))
+            cached = await llm_cache.get(key)
+            call.cache = "hit" if cached is not None else "miss"
+            if cached is not None:
+                return ChatCompletion.model_validate_json(cached)
+
+        resp = await _scheduled(
+            model,
+            priority,
+            estimate_tokens(messages, kwargs.get("max_tokens")),
+            lambda: get_async_openai_client().chat.completions.create(model=model, messages=messages, **kwargs),
+            call,
+        )
+
+        # only cache complete answers; a truncated (finish_reason="length") reply should be retried
+        if key is not None and message_text(resp) and resp.choices[0].finish_reason == "stop":
+            await llm_cache.put(key, resp.model_dump_json())
+        return resp
+
+
+async def stream_chat_completion(
+    *,
+    model: str,
+    messages: List[Dict[str, Any]],
+    use_cache: bool = True,
+    priority: int = INTERACTIVE,
+    feature: str = "other",
+    **kwargs: Any,
+) -> AsyncIterator[str]:
+    """
+    Streamed chat completion; yields content deltas as they arrive. Shares the structured
+    response cache with chat_completion: a hit is replayed as one delta, and a completed
+    stream is stored as a regular ChatCompletion. Only failures before the first delta
+    are retried.
+    """
+    with track(feature, model) as call:
+        key = None
+        schema = _structured_schema(kwargs)
+        if use_cache and schema is not None and settings.LLM_CACHE_ENABLED:
+            key = llm_cache.cache_key(model, messages, schema, kwargs.get("temperature"), kwargs.get("max_tokens"))
+            cached = await llm_cache.get(key)
+            call.cache = "hit" if cached is not None else "miss"
+            if cached is not None:
+                call.first_token()
+                yield message_text(ChatCompletion.model_validate_json(cached)) or ""
+                return
+
+        sched = get_scheduler(model)
+        est_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+        parts: List[str] = []
+        finish_reason = None
+        resp_id, resp_model = "", model
+        attempt = 0
+        while True:
+            await sched.acquire(priority, est_tokens)
+            actual = None
+            try:
+                stream = await get_async_openai_client().chat.completions.create(
+                    model=model, messages=messages, stream=True,
+                    stream_options={"include_usage": True}, **kwargs,
+                )
+                async for chunk in stream:
+                    resp_id, resp_model = chunk.id or resp_id, chunk.model or resp_model
+                    if chunk.usage is not None:
+                        actual = chunk.usage.total_tokens
+                        call.usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        call.first_token()
+                        parts.append(delta)
+                        yield delta
+                break
+            except _RETRYABLE as e:
+                if parts:
+                    raise
+                delay = _on_retryable(model, e, attempt)
+            finally:
+                sched.release(actual, est_tokens)
+            attempt += 1
+            call.retries = attempt
+            await asyncio.sleep(delay)
+
+        if key is not None and parts and finish_reason == "stop":
+            completion = ChatCompletion.model_validate({
+                "id": resp_id or "stream",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": resp_model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "".join(parts)},
+                }],
+            })
+            await llm_cache.put(key, completion.model_dump_json())
+
+
+async def embeddings(*, model: str, input: Any, priority: int = INTERACTIVE, feature: str = "other", **kwargs: Any):
+    texts = [input] if isinstance(input, str) else list(input)
+    est_tokens = sum(len(str(t)) for t in texts) // 4 + 1
+    with track(feature, model) as call:
+        return await _scheduled(
+            model,
+            priority,
+            est_tokens,
+            lambda: get_async_openai_client().embeddings.create(model=model, input=input, **kwargs),
+            call,
+        )
+
+
+def message_text(resp) -> Optional[str]:
+    try:
+        return resp.choices[0].message.content
+    except Exception:
+        return None
@@ -0,0 +1,197 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.core.config import settings
+
+# Central outbound scheduler for OpenAI traffic. Per model it enforces
+#   - a requests-per-minute and a tokens-per-minute token bucket,
+#   - a cap on in-flight requests,
+# and hands out slots strictly by priority class (then FIFO), so interactive
+# generation is never stuck behind an embeddings backfill.
+
+INTERACTIVE = 0   # quiz / flashcard generation, search
+OCR = 1           # vision OCR + OCR repair during ingestion
+ANALYSIS = 2      # note analyzer
+BACKFILL = 3      # bulk embedding jobs
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", OCR: "ocr", ANALYSIS: "analysis", BACKFILL: "backfill"}
+
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "LLM requests waiting for a scheduler slot", ["model", "priority"])
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds", "Time spent waiting for a scheduler slot", ["model", "priority"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+LLM_INFLIGHT = Gauge("llm_inflight_requests", "LLM requests currently awaiting OpenAI", ["model"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM request retries", ["model", "reason"])
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, float(per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # a single request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelScheduler:
+    def __init__(self, model: str, rpm: int, tpm: int, max_inflight: int):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.paused_until = 0.0
+        self._heap: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _depth(self, priority: int):
+        return LLM_QUEUE_DEPTH.labels(self.model, PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _ready_in(self, est_tokens: float) -> float:
+        now = time.monotonic()
+        if self.inflight >= self.max_inflight:
+            return float("inf")  # woken by release()
+        return max(
+            self.paused_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(est_tokens, now),
+        )
+
+    def _grant(self, est_tokens: float) -> None:
+        self.requests.take(1)
+        self.tokens.take(est_tokens)
+        self.inflight += 1
+        LLM_INFLIGHT.labels(self.model).inc()
+
+    async def acquire(self, priority: int, est_tokens: float) -> None:
+        if not self._heap and self._ready_in(est_tokens) <= 0:
+            self._grant(est_tokens)
+            LLM_QUEUE_WAIT.labels(self.model, PRIORITY_NAMES.get(priority, str(priority))).observe(0.0)
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), est_tokens, fut))
+        self._depth(priority).inc()
+        started = time.monotonic()
+        self._kick()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(0, est_tokens)  # granted just as we were cancelled
+            raise
+        finally:
+            LLM_QUEUE_WAIT.labels(self.model, PRIORITY_NAMES.get(priority, str(priority))).observe(time.monotonic() - started)
+
+    def release(self, actual_tokens: Optional[float], est_tokens: float) -> None:
+        self.inflight -= 1
+        LLM_INFLIGHT.labels(self.model).dec()
+        if actual_tokens is not None:
+            # settle the reservation against real usage
+            diff = est_tokens - actual_tokens
+            if diff > 0:
+                self.tokens.give_back(diff)
+            else:
+                self.tokens.take(-diff)
+        self._wake.set()
+
+    def pause(self, seconds: float) -> None:
+        """Honour a Retry-After for everything queued on this model."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _kick(self) -> None:
+        self._wake.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        while self._heap:
+            self._wake.clear()
+            priority, _, est_tokens, fut = self._heap[0]
+            if fut.done():  # cancelled waiter
+                heapq.heappop(self._heap)
+                self._depth(priority).dec()
+                continue
+            wait = self._ready_in(est_tokens)
+            if wait <= 0:
+                heapq.heappop(self._heap)
+                self._depth(priority).dec()
+                self._grant(est_tokens)
+                fut.set_result(None)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=None if wait == float("inf") else wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ModelScheduler]]" = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(model: str) -> ModelScheduler:
+    per_loop = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    sched = per_loop.get(model)
+    if sched is None:
+        sched = per_loop[model] = ModelScheduler(
+            model,
+            rpm=settings.LLM_MODEL_RPM.get(model, settings.LLM_RPM),
+            tpm=settings.LLM_MODEL_TPM.get(model, settings.LLM_TPM),
+            max_inflight=settings.LLM_MODEL_CONCURRENCY.get(model, settings.LLM_MAX_CONCURRENCY),
+        )
+    return sched
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    if ra:
+        try:
+            return float(ra)
+        except ValueError:
+            return None
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Retry-After (plus a little jitter) if the server sent one, else full-jitter exponential."""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, min(1.0, 0.1 * retry_after + 0.05))
+    cap = min(settings.LLM_BACKOFF_MAX, settings.LLM_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, cap)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.llm_usage import LlmUsage
+
+logger = logging.getLogger(__name__)
+
+# Per-call telemetry for every request that goes through llm_gateway.
+# Each call is tagged with a feature (quiz, flashcards, analyzer, ocr, ocr_repair,
+# chunking, search) and recorded twice:
+#   - Prometheus histograms / counters, labelled by feature + model,
+#   - a per-user daily aggregate (llm_usage table), accumulated in memory and
+#     upserted every LLM_USAGE_FLUSH_SECONDS so no request pays for a DB write.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds", "Wall time of an LLM call, including queueing and retries",
+    ["feature", "model", "cache"],  # cache: hit | miss | off
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TTFT_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed token arrived",
+    ["feature", "model"], buckets=LATENCY_BUCKETS,
+)
+LLM_CALLS = Counter("llm_calls_total", "LLM calls", ["feature", "model", "outcome"])  # ok | error | cancelled
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by OpenAI", ["feature", "model", "kind"])  # prompt | completion
+LLM_COST = Counter("llm_cost_usd_total", "Estimated LLM spend in USD", ["feature", "model"])
+LLM_CALL_RETRIES = Counter("llm_call_retries_total", "Retries spent on LLM calls", ["feature", "model"])
+
+# USD per 1M tokens (input, output); override or extend with LLM_PRICES.
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+_current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_user_id", default=None)
+
+
+def bind_user(user_id: Any) -> None:
+    """Attribute LLM calls made from the current request/task to this user."""
+    _current_user.set(str(user_id) if user_id is not None else None)
+
+
+def _price(model: str) -> Tuple[float, float]:
+    prices = {**DEFAULT_PRICES, **settings.LLM_PRICES}
+    if model in prices:
+        return prices[model]
+    # dated snapshots, e.g. gpt-4o-mini-2024-07-18 -> gpt-4o-mini
+    best = max((k for k in prices if model.startswith(k)), key=len, default=None)
+    return prices[best] if best else (0.0, 0.0)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    p_in, p_out = _price(model)
+    return (prompt_tokens * p_in + completion_tokens * p_out) / 1_000_000
+
+
+@dataclass
+class LlmCall:
+    feature: str
+    model: str
+    started: float
+    cache: str = "off"
+    first_token_at: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+
+@contextmanager
+def track(feature: str, model: str) -> Iterator[LlmCall]:
+    call = LlmCall(feature=feature, model=model, started=time.perf_counter())
+    outcome = "error"
+    try:
+        yield call
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        _record(call, outcome)
+
+
+def _record(call: LlmCall, outcome: str) -> None:
+    elapsed = time.perf_counter() - call.started
+    cost = estimate_cost(call.model, call.prompt_tokens, call.completion_tokens)
+
+    LLM_CALLS.labels(call.feature, call.model, outcome).inc()
+    LLM_CALL_SECONDS.labels(call.feature, call.model, call.cache).observe(elapsed)
+    if call.first_token_at is not None:
+        LLM_TTFT_SECONDS.labels(call.feature, call.model).observe(call.first_token_at - call.started)
+    if call.prompt_tokens:
+        LLM_TOKENS.labels(call.feature, call.model, "prompt").inc(call.prompt_tokens)
+    if call.completion_tokens:
+        LLM_TOKENS.labels(call.feature, call.model, "completion").inc(call.completion_tokens)
+    if cost:
+        LLM_COST.labels(call.feature, call.model).inc(cost)
+    if call.retries:
+        LLM_CALL_RETRIES.labels(call.feature, call.model).inc(call.retries)
+
+    user_id = _current_user.get()
+    if user_id is not None:
+        _accumulate(user_id, call, outcome, elapsed, cost)
+
+
+# ---------- per-user aggregate ----------
+
+_USAGE_FIELDS = ("calls", "errors", "cache_hits", "retries", "prompt_tokens", "completion_tokens", "cost_usd", "total_ms", "max_ms")
+
+_pending: Dict[Tuple[str, date, str, str], Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+
+def _accumulate(user_id: str, call: LlmCall, outcome: str, elapsed: float, cost: float) -> None:
+    ms = int(elapsed * 1000)
+    key = (user_id, date.today(), call.feature, call.model)
+    with _pending_lock:
+        row = _pending.get(key)
+        if row is None:
+            row = _pending[key] = dict.fromkeys(_USAGE_FIELDS, 0)
+        row["calls"] += 1
+        row["errors"] += outcome == "error"
+        row["cache_hits"] += call.cache == "hit"
+        row["retries"] += call.retries
+        row["prompt_tokens"] += call.prompt_tokens
+        row["completion_tokens"] += call.completion_tokens
+        row["cost_usd"] += cost
+        row["total_ms"] += ms
+        row["max_ms"] = max(row["max_ms"], ms)
+
+
+def _merge(target: Dict[str, Any], vals: Dict[str, Any]) -> None:
+    for f in _USAGE_FIELDS:
+        target[f] = max(target[f], vals[f]) if f == "max_ms" else target[f] + vals[f]
+
+
+def pending_usage(user_id: Any, since: date) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """This process's not yet flushed usage of one user since `since`, by (feature, model)."""
+    out: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    with _pending_lock:
+        for (u, d, f, m), vals in _pending.items():
+            if u == str(user_id) and d >= since:
+                _merge(out.setdefault((f, m), dict.fromkeys(_USAGE_FIELDS, 0)), vals)
+    return out
+
+
+def flush_usage() -> int:
+    """Upsert the accumulated per-user usage into llm_usage. Blocking; returns rows written."""
+    with _pending_lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    rows = [
+        {"user_id": u, "day": d, "feature": f, "model": m, **vals}
+        for (u, d, f, m), vals in batch.items()
+    ]
+    stmt = insert(LlmUsage).values(rows)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_llm_usage_user_day_feature_model",
+        set_={
+            **{f: getattr(LlmUsage, f) + getattr(ex, f) for f in _USAGE_FIELDS if f != "max_ms"},
+            "max_ms": func.greatest(LlmUsage.max_ms, ex.max_ms),
+            "updated_at": func.now(),
+        },
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # put the batch back: it goes out with the next flush instead of being lost
+        with _pending_lock:
+            for key, vals in batch.items():
+                _merge(_pending.setdefault(key, dict.fromkeys(_USAGE_FIELDS, 0)), vals)
+        logger.warning("llm usage flush failed, %d rows kept for the next one: %s", len(rows), e)
+        return 0
+    finally:
+        db.close()
+    return len(rows)
+
+
+async def usage_flusher() -> None:
+    """Background task: flush per-user usage periodically (started from app.main)."""
+    while True:
+        await asyncio.sleep(settings.LLM_USAGE_FLUSH_SECONDS)
+        await asyncio.to_thread(flush_usage)
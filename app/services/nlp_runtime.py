@@ -1,13 +1,32 @@
 from __future__ import annotations
 from functools import lru_cache
 
+from app.core.config import settings
+
+# The pipeline is only used to split paragraphs into sentences, so everything that
+# does not set sentence boundaries is turned off. Trained pipelines ship a disabled
+# "senter" that is much cheaper than the dependency parser: when there is one it is
+# enabled and the parser switched off, otherwise the parser keeps setting boundaries.
+# A rule-based sentencizer is only added when there is neither (e.g. a blank model).
+_SENTENCE_PIPES = ("senter", "parser", "sentencizer")
+
 def _try_load_spacy():
     try:
-        import spacy  
+        import spacy
     except Exception:
         return None, None
     return spacy, spacy
 
+def _keep_for_sentences(nlp) -> set[str]:
+    names = set(nlp.component_names)
+    keep = names & {"senter", "sentencizer"} if "senter" in names else names & set(_SENTENCE_PIPES)
+    if "tok2vec" in names:
+        # keep the shared embedding layer only if a sentence component listens to it
+        listeners = getattr(nlp.get_pipe("tok2vec"), "listening_components", [])
+        if keep & set(listeners):
+            keep.add("tok2vec")
+    return keep
+
 @lru_cache(maxsize=1)
 def load_nlp():
     #dont break if spacy fails
@@ -16,8 +35,14 @@ def load_nlp():
         return None  # caller should guard and degrade if needed
 
     try:
-        nlp = spacy.load("en_core_web_sm")
-        if "senter" not in nlp.pipe_names and "sentencizer" not in nlp.pipe_names:
+        nlp = spacy.load(settings.SPACY_MODEL)
+        keep = _keep_for_sentences(nlp)
+        for name in nlp.component_names:
+            if name in keep:
+                nlp.enable_pipe(name)
+            else:
+                nlp.disable_pipe(name)  # ner, lemmatizer, tagger, parser if senter, ...
+        if not any(name in nlp.pipe_names for name in _SENTENCE_PIPES):
             nlp.add_pipe("sentencizer")
         return nlp
     except Exception:
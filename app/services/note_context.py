@@ -0,0 +1,215 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.note import Note
+from app.models.note_chunks import NoteChunk
+from app.services.chunking import split_into_chunks
+from app.services.semantic_search import embed_query
+
+# Builds the NOTE_CONTENT for note-grounded generation. Short notes are sent whole;
+# long ones are reduced to a subset of their NoteChunk rows that fits a token budget,
+# chosen by maximal marginal relevance (MMR) over the stored embeddings: relevant to
+# the requested subject/topic (or to the note as a whole if there is none) without
+# repeating the same passage. Selected chunks keep their original reading order.
+
+NOTE_CONTEXT_TOKENS = Counter(
+    "note_context_tokens_total",
+    "NOTE_CONTENT tokens for note-grounded generation",
+    ["feature", "kind"],  # kind: full | sent
+)
+
+GAP_MARKER = "\n[...]\n"
+
+
+@dataclass
+class NoteContext:
+    text: str
+    strategy: str           # full | mmr | spread
+    full_tokens: int
+    context_tokens: int
+    chunks_total: int = 0
+    chunk_indices: List[int] = field(default_factory=list)
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.full_tokens - self.context_tokens)
+
+    def report(self) -> dict:
+        return {
+            "strategy": self.strategy,
+            "full_tokens": self.full_tokens,
+            "context_tokens": self.context_tokens,
+            "saved_tokens": self.saved_tokens,
+            "saved_pct": round(100.0 * self.saved_tokens / self.full_tokens, 1) if self.full_tokens else 0.0,
+            "chunks_total": self.chunks_total,
+            "chunks_used": len(self.chunk_indices),
+            "chunk_indices": self.chunk_indices,
+        }
+
+
+def estimate_text_tokens(text: str) -> int:
+    return (len(text or "") + 3) // 4
+
+
+def _query_for(subject: Optional[str], topic: Optional[str]) -> Optional[str]:
+    parts = [p.strip() for p in (subject, topic) if p and p.strip() and p.strip().lower() != "general"]
+    return " ".join(parts) or None
+
+
+def _mmr_order(vectors: np.ndarray, query: np.ndarray, lam: float) -> List[int]:
+    """Rank rows of `vectors` by maximal marginal relevance to `query` (all L2-normalized)."""
+    relevance = vectors @ query
+    order: List[int] = []
+    max_sim = np.full(len(vectors), -np.inf)
+    remaining = np.ones(len(vectors), dtype=bool)
+    for _ in range(len(vectors)):
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        score = np.where(remaining, lam * relevance - (1 - lam) * redundancy, -np.inf)
+        i = int(np.argmax(score))
+        order.append(i)
+        remaining[i] = False
+        max_sim = np.maximum(max_sim, vectors @ vectors[i])
+    return order
+
+
+def _spread_order(n: int) -> List[int]:
+    """No embeddings: coarse-to-fine positions so any prefix covers the whole note."""
+    order, seen = [], set()
+    step = n
+    while len(order) < n:
+        for i in range(0, n, max(1, step)):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        step //= 2
+        if step == 0:
+            order.extend(i for i in range(n) if i not in seen)
+            break
+    return order
+
+
+def _norm(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _spans(texts: Sequence[str], full_text: str) -> Optional[List[Tuple[int, int]]]:
+    """
+    Where each chunk sits in the whitespace-normalized note, or None if the chunks don't
+    tile it in order (the note was edited after it was chunked). Holds for any max_chars /
+    overlap: chunks are consecutive slices of the note, each adding text after the last.
+    """
+    norm = _norm(full_text)
+    spans: List[Tuple[int, int]] = []
+    covered = 0
+    for t in texts:
+        t = _norm(t)
+        start = norm.find(t, max(spans[-1][0] + 1 if spans else 0, covered - len(t) + 1))
+        if not t or start < 0 or start > covered + 1:
+            return None
+        spans.append((start, start + len(t)))
+        covered = start + len(t)
+    return spans if spans and spans[0][0] == 0 and covered == len(norm) else None
+
+
+def _pack(texts: Sequence[str], order: Sequence[int], budget: int) -> List[int]:
+    picked, used = [], 0
+    for i in order:
+        cost = estimate_text_tokens(texts[i])
+        if used + cost > budget:
+            continue
+        picked.append(i)
+        used += cost
+    return sorted(picked)
+
+
+def _load_chunks(db: Session, note_id) -> List[NoteChunk]:
+    return (
+        db.query(NoteChunk)
+        .filter(NoteChunk.note_id == note_id)
+        .order_by(NoteChunk.chunk_index.asc())
+        .all()
+    )
+
+
+async def build_note_context(
+    db: Session,
+    note: Note,
+    subject: Optional[str] = None,
+    topic: Optional[str] = None,
+    budget_tokens: Optional[int] = None,
+    feature: str = "other",
+) -> NoteContext:
+    full_text = (note.og_text or "").strip()
+    full_tokens = estimate_text_tokens(full_text)
+    budget = budget_tokens or settings.NOTE_CONTEXT_BUDGET_TOKENS
+
+    if full_tokens <= settings.NOTE_CONTEXT_THRESHOLD_TOKENS or full_tokens <= budget:
+        ctx = NoteContext(text=full_text, strategy="full", full_tokens=full_tokens, context_tokens=full_tokens)
+    else:
+        ctx = await _select_chunks(db, note, full_text, full_tokens, subject, topic, budget)
+
+    NOTE_CONTEXT_TOKENS.labels(feature, "full").inc(full_tokens)
+    NOTE_CONTEXT_TOKENS.labels(feature, "sent").inc(ctx.context_tokens)
+    return ctx
+
+
+async def _select_chunks(
+    db: Session, note: Note, full_text: str, full_tokens: int,
+    subject: Optional[str], topic: Optional[str], budget: int,
+) -> NoteContext:
+    rows = await run_in_threadpool(_load_chunks, db, note.note_id)
+    spans = _spans([r.text for r in rows], full_text) if rows else None
+    if spans is None:
+        # never chunked, or og_text was edited since: the stored chunks are stale
+        rows, texts = [], split_into_chunks(full_text)
+        spans = _spans(texts, full_text)
+    else:
+        texts = [r.text for r in rows]
+    embedded = [r for r in rows if isinstance(r.embedding, list) and r.embedding]
+
+    if rows and len(embedded) == len(rows):
+        vectors = np.asarray([r.embedding for r in rows], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+
+        query_text = _query_for(subject, topic)
+        if query_text and settings.OPENAI_API_KEY:
+            query = np.asarray(await embed_query(query_text, feature="retrieval"), dtype=np.float32)
+        else:
+            query = vectors.mean(axis=0)  # most representative of the note as a whole
+        query /= np.linalg.norm(query) + 1e-8
+
+        order = await run_in_threadpool(_mmr_order, vectors, query, settings.NOTE_CONTEXT_MMR_LAMBDA)
+        strategy = "mmr"
+    else:
+        # note was never chunked/embedded (or is stale): chunks of the current text, by position
+        order = _spread_order(len(texts))
+        strategy = "spread"
+
+    picked = _pack(texts, order, budget) or order[:1]
+    indices = [rows[i].chunk_index for i in picked] if rows else picked
+    text = ""
+    for n, i in enumerate(picked):
+        prev = picked[n - 1] if n else None
+        # neighbouring chunks of one paragraph repeat the chunker's overlap: send it once
+        cut = spans[prev][1] - spans[i][0] if spans and prev == i - 1 else 0
+        if cut > 0:
+            text += " " + _norm(texts[i])[cut:].lstrip()
+            continue
+        if n:
+            text += "\n" if prev == i - 1 else GAP_MARKER
+        text += texts[i]
+    return NoteContext(
+        text=text,
+        strategy=strategy,
+        full_tokens=full_tokens,
+        context_tokens=estimate_text_tokens(text),
+        chunks_total=len(texts),
+        chunk_indices=indices,
+    )
@@ -1,55 +1,104 @@
+import asyncio
 import base64
-from io import BytesIO
+import json
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple, Union
 
-import cv2
-from PIL import Image, ImageOps
-from openai import OpenAI
+from app.core.config import settings
+from app.services import llm_gateway
+from app.services.llm_scheduler import OCR
+from app.services.ocr_preprocess import PreprocessConfig, default_config, image_size, mime_type, run_pipeline, run_pipeline_with_hash
 
 MODEL = "gpt-4o-mini"
 TEMPERATURE = 0
+# bump when the OCR prompt (or anything else that changes the text for the same image)
+# changes, so cached results from app/services/ocr_cache.py are not reused
+PROMPT_VERSION = "v1"
 
-# preprocess image for ocr via grayscale, denoise, binarize, resize
-def preprocess(path: Path) -> bytes:
-    img = cv2.imread(str(path))
-    if img is None:
-        raise FileNotFoundError(path)
+# preprocess image for ocr: downscale, grayscale, [deskew], denoise, binarize, encode
+# (stages configured by OCR_PREPROCESS, see app/services/ocr_preprocess.py)
+def preprocess(image: Union[Path, bytes], config: Optional[PreprocessConfig] = None) -> bytes:
+    return run_pipeline(image, config or default_config())
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.bilateralFilter(gray, d=5, sigmaColor=30, sigmaSpace=30)
+def preprocess_with_hash(image: Union[Path, bytes], config: Optional[PreprocessConfig] = None) -> Tuple[bytes, bytes]:
+    return run_pipeline_with_hash(image, config or default_config())
 
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    gray = clahe.apply(gray)
+# preprocess() is CPU-bound OpenCV work, so it runs in a process pool sized to the cores:
+# the event loop stays free and the images of one upload are processed in parallel.
+# Workers are spawned (not forked) so they never inherit the server's threads/sockets.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
 
-    bw = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-    cv2.THRESH_BINARY, 31, 10
-    )
+def _pool_size() -> int:
+    return settings.OCR_PREPROCESS_WORKERS or os.cpu_count() or 1
+
+def get_preprocess_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=_pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def _discard_pool(pool: Optional[ProcessPoolExecutor]) -> None:
+    global _pool
+    with _pool_lock:
+        if pool is None or _pool is pool:
+            pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_preprocess_pool() -> None:
+    _discard_pool(None)
+
+def _worker_ping() -> int:
+    return os.getpid()
 
-    pil = Image.fromarray(bw)
-    pil = ImageOps.exif_transpose(pil)
-    pil.thumbnail((1600, 1600))
+def warm_preprocess_pool() -> int:
+    """Start the pool's worker processes (and their imports) ahead of the first upload."""
+    pool = get_preprocess_pool()
+    return len({f.result() for f in [pool.submit(_worker_ping) for _ in range(_pool_size())]})
 
-    buf = BytesIO()
-    pil.save(buf, format="JPEG", quality=85)
-    return buf.getvalue()
+async def _in_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    pool = get_preprocess_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # a worker died (e.g. OOM on a huge image): the next call starts a fresh pool
+        _discard_pool(pool)
+        raise
 
-def _image_to_data_url(jpeg_bytes: bytes) -> str:
-    b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
-    return f"data:image/jpeg;base64,{b64}"
+async def preprocess_async(image: Union[Path, bytes]) -> bytes:
+    return await _in_pool(preprocess, image)
+
+async def preprocess_with_hash_async(image: Union[Path, bytes]) -> Tuple[bytes, bytes]:
+    return await _in_pool(preprocess_with_hash, image)
+
+def _image_to_data_url(image_bytes: bytes) -> str:
+    b64 = base64.b64encode(image_bytes).decode("utf-8")
+    return f"data:{mime_type(image_bytes)};base64,{b64}"
 
 # send image bytes to openai model
-def ocr_bytes(client: OpenAI, jpeg_bytes: bytes) -> str:
-    data_url = _image_to_data_url(jpeg_bytes)
+async def ocr_bytes(image_bytes: bytes) -> str:
+    data_url = _image_to_data_url(image_bytes)
     user_prompt = (
         "Extract ONLY the handwritten/printed text from this image.\n"
         "- Keep original line breaks.\n"
         "- If a word is unclear, write '(?)'.\n"
         "- Do not describe the image; return text only."
     )
-    resp = client.chat.completions.create(
+    resp = await llm_gateway.chat_completion(
         model=MODEL,
+        priority=OCR,
+        feature="ocr",
         temperature=TEMPERATURE,
         messages=[{
             "role": "user",
@@ -60,3 +109,73 @@ def ocr_bytes(client: OpenAI, jpeg_bytes: bytes) -> str:
         }],
     )
     return (resp.choices[0].message.content or "").strip()
+
+def vision_image_tokens(image_bytes: bytes) -> int:
+    """Prompt tokens of one high-detail image: fit in 2048x2048, shortest side to 768, 170 per 512px tile + 85."""
+    w, h = image_size(image_bytes)
+    scale = min(1.0, 2048 / max(w, h))
+    scale *= min(1.0, 768 / (min(w, h) * scale))
+    return 85 + 170 * math.ceil(w * scale / 512) * math.ceil(h * scale / 512)
+
+_PAGES_SCHEMA = {
+    "name": "ocr_pages",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["pages"],
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["index", "text"],
+                    "properties": {
+                        "index": {"type": "integer"},
+                        "text": {"type": "string"},
+                    },
+                },
+            },
+        },
+    },
+}
+
+# several page images in one vision request; None if the reply can't be mapped back onto
+# the pages (the caller then OCRs them one by one with ocr_bytes)
+async def ocr_bytes_batch(images: List[bytes]) -> Optional[List[str]]:
+    user_prompt = (
+        f"Return exactly {len(images)} entries in `pages`, one per image below, in order, "
+        "with `index` set to the page number.\n"
+        "For each page extract ONLY the handwritten/printed text.\n"
+        "- Keep original line breaks.\n"
+        "- If a word is unclear, write '(?)'.\n"
+        "- Do not describe the image; return text only. A page without text gets an empty string."
+    )
+    content: List[dict] = [{"type": "text", "text": user_prompt}]
+    for i, image in enumerate(images):
+        content.append({"type": "text", "text": f"### PAGE {i}"})
+        content.append({"type": "image_url", "image_url": {"url": _image_to_data_url(image)}})
+    resp = await llm_gateway.chat_completion(
+        model=MODEL,
+        priority=OCR,
+        feature="ocr",
+        temperature=TEMPERATURE,
+        messages=[{"role": "user", "content": content}],
+        response_format={"type": "json_schema", "json_schema": _PAGES_SCHEMA},
+        use_cache=False,   # page texts are cached per image in ocr_cache instead
+    )
+    if resp.choices[0].finish_reason != "stop":
+        return None
+    try:
+        entries = json.loads(resp.choices[0].message.content or "{}").get("pages") or []
+    except Exception:
+        return None
+    if len(entries) != len(images):
+        return None
+    # texts are only mapped back by `index`, and only if it is a permutation of the page
+    # numbers: a reply in the wrong order would silently put text on the wrong page
+    if sorted(e.get("index") for e in entries if isinstance(e.get("index"), int)) != list(range(len(entries))):
+        return None
+    entries = sorted(entries, key=lambda e: e["index"])
+    return [(e.get("text") or "").strip() for e in entries]
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+
+from prometheus_client import Counter
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.ocr_cache import OcrCache
+from app.services.ocr import MODEL, PROMPT_VERSION
+from app.services.ocr_preprocess import hamming
+
+logger = logging.getLogger(__name__)
+
+# Persistent OCR result cache (table ocr_cache). A page image is looked up
+#   1. by the sha256 of its bytes, before preprocessing: the same file uploaded again,
+#      by anyone, costs neither preprocessing nor a vision call;
+#   2. by perceptual hash (dHash of the decoded page) among the uploader's own pages: a
+#      re-exported or re-photographed copy of a page reuses its text. The bar is a few bits
+#      of 256 (OCR_CACHE_MAX_DISTANCE): a looser one lets different pages with the same
+#      layout (lined paper, one worksheet template) take each other's text. Candidates come
+#      from a GIN index on the hash split into 8 bands of 32 bits; two hashes at most 7 bits
+#      apart always share at least one band exactly.
+# Near-duplicates are only matched within one user: a similar-looking page from someone
+# else may still differ in the handwriting that matters, and their text is not ours to serve.
+# Entries are keyed on the OCR model and PROMPT_VERSION, so changing either re-OCRs.
+
+OCR_CACHE = Counter(
+    "ocr_cache_lookups_total",
+    "OCR page cache lookups",
+    ["result"],  # exact | similar | miss | error, per lookup; upload: same image twice in one upload
+)
+
+_FAILED = object()
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def phash_bands(phash: bytes) -> list[int]:
+    # band number in the high bits, so equal bits in different bands don't match
+    return [(i << 32) | int.from_bytes(phash[i * 4:i * 4 + 4], "big") for i in range(len(phash) // 4)]
+
+
+def _touch(db, entry_id: int) -> None:
+    db.query(OcrCache).filter(OcrCache.id == entry_id).update(
+        {OcrCache.hits: OcrCache.hits + 1, OcrCache.last_used_at: func.now()},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def lookup_exact(sha: str) -> Optional[str]:
+    with SessionLocal() as db:
+        row = (
+            db.query(OcrCache.id, OcrCache.text)
+            .filter(OcrCache.content_sha256 == sha, OcrCache.model == MODEL, OcrCache.prompt_version == PROMPT_VERSION)
+            .first()
+        )
+        if row is None:
+            return None
+        _touch(db, row.id)
+        return row.text
+
+
+def lookup_similar(user_id: str, phash: bytes) -> Optional[str]:
+    with SessionLocal() as db:
+        rows = (
+            db.query(OcrCache.id, OcrCache.phash)
+            .filter(
+                OcrCache.user_id == user_id,
+                OcrCache.model == MODEL,
+                OcrCache.prompt_version == PROMPT_VERSION,
+                OcrCache.phash_bands.overlap(phash_bands(phash)),
+            )
+            .order_by(OcrCache.last_used_at.desc())
+            .limit(settings.OCR_CACHE_SIMILAR_SCAN)
+            .all()
+        )
+        best = min(((hamming(phash, r.phash), r.id) for r in rows), default=None)
+        if best is None or best[0] > settings.OCR_CACHE_MAX_DISTANCE:
+            return None
+        _touch(db, best[1])
+        return db.query(OcrCache.text).filter(OcrCache.id == best[1]).scalar()
+
+
+def store(sha: str, phash: Optional[bytes], user_id: Optional[str], text: str) -> None:
+    stmt = insert(OcrCache).values(
+        content_sha256=sha, phash=phash, phash_bands=phash_bands(phash) if phash else None,
+        model=MODEL, prompt_version=PROMPT_VERSION,
+        user_id=user_id, text=text, hits=0,
+    ).on_conflict_do_nothing(constraint="uq_ocr_cache_sha_model_prompt")
+    with SessionLocal() as db:
+        db.execute(stmt)
+        db.commit()
+
+
+async def _safely(fn, *args):
+    # the cache is an optimisation: a failing lookup / insert only means the page is OCR'd
+    try:
+        return await asyncio.to_thread(fn, *args)
+    except Exception as e:
+        logger.warning("ocr cache %s failed: %s", fn.__name__, e)
+        return _FAILED
+
+
+async def _lookup(label: str, fn, *args) -> Optional[str]:
+    text = await _safely(fn, *args)
+    if text is _FAILED:
+        OCR_CACHE.labels("error").inc()
+        return None
+    OCR_CACHE.labels(label if text is not None else "miss").inc()
+    return text
+
+
+async def find_exact(sha: str) -> Optional[str]:
+    if not settings.OCR_CACHE_ENABLED:
+        return None
+    return await _lookup("exact", lookup_exact, sha)
+
+
+async def find_similar(user_id: Optional[str], phash: bytes) -> Optional[str]:
+    if not (settings.OCR_CACHE_ENABLED and settings.OCR_CACHE_NEAR_DUPLICATES and user_id):
+        return None
+    return await _lookup("similar", lookup_similar, user_id, phash)
+
+
+async def remember(sha: str, phash: Optional[bytes], user_id: Optional[str], text: str) -> None:
+    if not settings.OCR_CACHE_ENABLED:
+        return
+    # blank results are not cached: they are as likely a model hiccup as an empty page
+    if text.strip():
+        await _safely(store, sha, phash, user_id, text)
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import hashlib
+
+from sqlalchemy.orm import Session
+
+from app.models.note import Note
+from app.models.note_repair import NoteRepair
+from app.models.ocr_upload import OcrUploadPage
+from app.services.chunking import store_chunks
+from app.services.ocr_pipeline import PageJob
+
+# Writing the pages of an OCR upload (/ocr/zip, /ocr/pdf): one note per page, and the
+# ocr_upload_pages manifest that lets a retried upload of the same file skip the pages
+# that were already committed. `page.name` is the page's key in the manifest.
+
+def file_sha256(f) -> str:
+    h = hashlib.sha256()
+    f.seek(0)
+    for block in iter(lambda: f.read(1 << 20), b""):
+        h.update(block)
+    f.seek(0)
+    return h.hexdigest()
+
+def done_pages(db: Session, user_id, upload_sha: str) -> dict:
+    rows = (
+        db.query(OcrUploadPage.member_name, OcrUploadPage.note_id, OcrUploadPage.repair_id)
+        .filter(OcrUploadPage.user_id == user_id, OcrUploadPage.upload_sha256 == upload_sha)
+        .all()
+    )
+    return {r.member_name: r for r in rows}
+
+def save_page(db: Session, owner_id, upload_sha: str, page: PageJob, name: str) -> dict:
+    """Note `name`, repair, chunks and manifest row of one page, all-or-nothing in a savepoint."""
+    with db.begin_nested():
+        note = Note(
+            user_id=owner_id,
+            og_text=page.text,
+            status="ocr_done",
+            filename=name,
+        )
+        db.add(note)
+        db.flush()          # get note.note_id
+
+        #ocr repair
+        repair_id = None
+        result = page.repair
+        if result is not None:
+            rep = NoteRepair(
+                note_id=note.note_id,
+                original_text=note.og_text,
+                suggested_text=result.get("suggested_text"),
+                suggestion_log=result.get("log", []),
+                status='pending',
+            )
+            db.add(rep)
+            db.flush()
+            repair_id = rep.repair_id
+
+        # embeddings and chunks
+        store_chunks(db, note, *page.chunks)
+        db.add(OcrUploadPage(
+            user_id=owner_id,
+            upload_sha256=upload_sha,
+            member_name=page.name,
+            note_id=note.note_id,
+            repair_id=repair_id,
+        ))
+    return {
+        "note_id": str(note.note_id),
+        "repair_id": str(repair_id) if repair_id else None,
+        "file": name,
+        "ocr_cache": page.cache,   # exact | similar | upload | None (OCR'd now)
+    }
@@ -0,0 +1,352 @@
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.core.config import settings
+from app.services.chunking import embed_chunks
+from app.services.llm_scheduler import OCR
+from app.services.ocr import _pool_size, ocr_bytes, ocr_bytes_batch, preprocess_with_hash_async, vision_image_tokens
+from app.services.ocr_cache import OCR_CACHE, content_hash, find_exact, find_similar, remember
+from app.services.ocr_repair import has_ocr_gap, suggest_repair_for_text
+
+# OCR ingestion as a staged pipeline. Every page goes
+#   read -> prepare -> ocr -> repair -> embed -> (caller writes the note)
+# Each stage has its own workers and reads from a bounded asyncio queue, so pages
+# overlap across stages: while page 5 is in the vision call, page 6 is preprocessed
+# in the process pool and page 4 is embedded. A full queue blocks the stage before
+# it (backpressure), and at most OCR_PIPELINE_WINDOW pages are in flight at all,
+# including finished pages waiting to be handed out in order, which caps memory.
+#
+#   read     inflate the image bytes (thread); one worker, so pages pass in order
+#   prepare  exact cache lookup, preprocessing + perceptual hash (process pool),
+#            near-duplicate cache lookup                  workers: pool size
+#   ocr      vision call for cache misses                 workers: OCR_CONCURRENCY
+#            (OCR_BATCHED: calls, each for a group of pages; see _ocr_batched_stage)
+#   repair   gap check + repair suggestion                workers: OCR_REPAIR_CONCURRENCY
+#   embed    chunk + embed                                workers: OCR_EMBED_CONCURRENCY
+#
+# A page that fails in a stage keeps its error and skips the remaining stages.
+
+OCR_STAGE_PAGES = Counter(
+    "ocr_pipeline_pages_total", "Pages through each OCR pipeline stage",
+    ["stage", "outcome"],  # ok | error | skipped (failed earlier / identical page)
+)
+OCR_STAGE_SECONDS = Histogram(
+    "ocr_pipeline_stage_seconds", "Time a page spends in an OCR pipeline stage", ["stage"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+OCR_STAGE_QUEUE = Gauge("ocr_pipeline_queue_depth", "Pages waiting for an OCR pipeline stage", ["stage"])
+OCR_STAGE_BUSY = Gauge("ocr_pipeline_busy_workers", "OCR pipeline workers processing a page", ["stage"])
+OCR_BATCHES = Counter(
+    "ocr_vision_batches_total", "Multi-page OCR vision requests",
+    ["outcome"],  # ok | fallback (reply unusable, pages OCR'd one by one)
+)
+
+_DONE = object()
+
+
+@dataclass(eq=False)
+class PageJob:
+    index: int
+    name: str
+    load: Callable[[], Union[bytes, str]]
+    sha: Optional[str] = None
+    duplicate_of: Optional["PageJob"] = None   # identical image earlier in the same upload
+    image_bytes: Optional[bytes] = None
+    phash: Optional[bytes] = None
+    processed: Optional[bytes] = None
+    image_tokens: int = 0
+    text: Optional[str] = None
+    cache: Optional[str] = None                # exact | similar | upload
+    text_layer: bool = False                   # text came from the source, not OCR
+    repair: Optional[dict] = None
+    chunks: Optional[Tuple[List[str], List[Optional[list]]]] = None
+    error: Optional[str] = None
+
+
+class _Context:
+    def __init__(self, user_id: Optional[str]):
+        self.user_id = user_id
+        self.seen: dict = {}
+
+
+def _load_and_hash(page: PageJob) -> Tuple[Union[bytes, str], Optional[str]]:
+    data = page.load()
+    return data, content_hash(data) if isinstance(data, bytes) else None
+
+
+async def _read(page: PageJob, ctx: _Context) -> None:
+    data, page.sha = await asyncio.to_thread(_load_and_hash, page)
+    if isinstance(data, str):
+        # text the source already has (a PDF text layer): no preprocessing or vision call
+        page.text, page.text_layer = data, True
+        return
+    page.image_bytes = data
+    # pages leave this single-worker stage in order, so the first copy of an image
+    # always has the lower index and is handed out before its duplicates
+    first = ctx.seen.setdefault(page.sha, page)
+    if first is not page:
+        page.duplicate_of, page.cache, page.image_bytes = first, "upload", None
+
+
+async def _prepare(page: PageJob, ctx: _Context) -> None:
+    if page.text_layer:
+        return
+    page.text = await find_exact(page.sha)
+    if page.text is not None:
+        page.cache = "exact"
+    else:
+        page.phash, page.processed = await preprocess_with_hash_async(page.image_bytes)
+        page.text = await find_similar(ctx.user_id, page.phash)
+        if page.text is not None:
+            page.cache = "similar"
+        elif settings.OCR_BATCHED:
+            page.image_tokens = vision_image_tokens(page.processed)
+    page.image_bytes = None
+
+
+async def _ocr(page: PageJob, ctx: _Context) -> None:
+    if page.text is None:
+        page.text = await ocr_bytes(page.processed)
+        await remember(page.sha, page.phash, ctx.user_id, page.text)
+    page.processed = None
+
+
+async def _repair(page: PageJob, ctx: _Context) -> None:
+    if has_ocr_gap(page.text or ""):
+        page.repair = await suggest_repair_for_text(page.text, subject=getattr(settings, "SUBJECT", None))
+
+
+async def _embed(page: PageJob, ctx: _Context) -> None:
+    page.chunks = await embed_chunks(
+        page.text, embed_model="text-embedding-3-small", max_chars=800, overlap=80, priority=OCR
+    )
+
+
+def _stages() -> List[Tuple[str, Callable[[PageJob, _Context], Awaitable[None]], int]]:
+    return [
+        ("read", _read, 1),
+        ("prepare", _prepare, _pool_size()),
+        ("ocr", _ocr, settings.OCR_CONCURRENCY),
+        ("repair", _repair, settings.OCR_REPAIR_CONCURRENCY),
+        ("embed", _embed, settings.OCR_EMBED_CONCURRENCY),
+    ]
+
+
+async def _put(q: asyncio.Queue, stage: Optional[str], item: Any) -> None:
+    await q.put(item)
+    if stage is not None and item is not _DONE:
+        OCR_STAGE_QUEUE.labels(stage).inc()
+
+
+async def _get(q: asyncio.Queue, stage: str) -> Any:
+    item = await q.get()
+    if item is not _DONE:
+        OCR_STAGE_QUEUE.labels(stage).dec()
+    return item
+
+
+async def _worker(name: str, fn, ctx: _Context, inq: asyncio.Queue, outq: asyncio.Queue, next_stage: Optional[str]) -> None:
+    while True:
+        page = await _get(inq, name)
+        if page is _DONE:
+            await inq.put(_DONE)  # for the other workers of this stage
+            return
+        if page.error or page.duplicate_of is not None:
+            OCR_STAGE_PAGES.labels(name, "skipped").inc()
+        else:
+            OCR_STAGE_BUSY.labels(name).inc()
+            t0 = time.perf_counter()
+            try:
+                await fn(page, ctx)
+                OCR_STAGE_PAGES.labels(name, "ok").inc()
+            except Exception as e:
+                page.error = str(e) or type(e).__name__
+                page.image_bytes = page.processed = None
+                OCR_STAGE_PAGES.labels(name, "error").inc()
+            finally:
+                OCR_STAGE_BUSY.labels(name).dec()
+                OCR_STAGE_SECONDS.labels(name).observe(time.perf_counter() - t0)
+        await _put(outq, next_stage, page)
+
+
+async def _stage(name: str, fn, workers: int, ctx: _Context, inq: asyncio.Queue, outq: asyncio.Queue, next_stage: Optional[str]) -> None:
+    await asyncio.gather(*(_worker(name, fn, ctx, inq, outq, next_stage) for _ in range(max(1, workers))))
+    await outq.put(_DONE)
+
+
+def _active(page: PageJob) -> bool:
+    return not page.error and page.duplicate_of is None
+
+
+async def _next_batch(inq: asyncio.Queue, first: PageJob) -> Tuple[List[PageJob], Any]:
+    """
+    Pages for one vision request, starting with `first`: queued pages are added while they
+    fit OCR_BATCH_TOKENS / OCR_BATCH_MAX_PAGES, waiting up to OCR_BATCH_WAIT_MS for more.
+    Pages that need no vision call ride along. Returns (batch, the item that did not fit,
+    _DONE, or None).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.OCR_BATCH_WAIT_MS / 1000
+    batch = [first]
+    vision = [p for p in batch if _active(p) and p.text is None]
+    if not vision:
+        return batch, None   # cached / failed pages go straight on
+    while len(vision) < settings.OCR_BATCH_MAX_PAGES:
+        try:
+            item = inq.get_nowait()
+        except asyncio.QueueEmpty:
+            if loop.time() >= deadline:
+                break
+            await asyncio.sleep(0.02)
+            continue
+        if item is _DONE:
+            return batch, item
+        OCR_STAGE_QUEUE.labels("ocr").dec()
+        if _active(item) and item.text is None:
+            tokens = sum(p.image_tokens for p in vision) + item.image_tokens
+            if tokens > settings.OCR_BATCH_TOKENS:
+                return batch, item
+            vision.append(item)
+        batch.append(item)
+    return batch, None
+
+
+async def _ocr_one(page: PageJob, ctx: _Context) -> None:
+    try:
+        await _ocr(page, ctx)
+    except Exception as e:
+        page.error = str(e) or type(e).__name__
+        page.processed = None
+
+
+async def _run_batch(batch: List[PageJob], ctx: _Context, outq: asyncio.Queue, next_stage: Optional[str]) -> None:
+    vision = [p for p in batch if _active(p) and p.text is None]
+    OCR_STAGE_BUSY.labels("ocr").inc()
+    t0 = time.perf_counter()
+    try:
+        texts = None
+        if len(vision) > 1:
+            try:
+                texts = await ocr_bytes_batch([p.processed for p in vision])
+            except Exception as e:
+                print("batched OCR failed, falling back to single pages ->", e)
+            OCR_BATCHES.labels("ok" if texts is not None else "fallback").inc()
+        if texts is not None:
+            for p, text in zip(vision, texts):
+                p.text = text
+            await asyncio.gather(*(remember(p.sha, p.phash, ctx.user_id, p.text) for p in vision))
+        else:
+            await asyncio.gather(*(_ocr_one(p, ctx) for p in vision))
+    finally:
+        OCR_STAGE_BUSY.labels("ocr").dec()
+        elapsed = time.perf_counter() - t0
+    for p in batch:
+        p.processed = None
+        if p in vision:
+            OCR_STAGE_PAGES.labels("ocr", "error" if p.error else "ok").inc()
+            OCR_STAGE_SECONDS.labels("ocr").observe(elapsed)
+        elif _active(p):
+            OCR_STAGE_PAGES.labels("ocr", "ok").inc()
+        else:
+            OCR_STAGE_PAGES.labels("ocr", "skipped").inc()
+        await _put(outq, next_stage, p)
+
+
+async def _ocr_batched_stage(name: str, fn, workers: int, ctx: _Context, inq: asyncio.Queue, outq: asyncio.Queue, next_stage: Optional[str]) -> None:
+    # one collector groups pages, up to `workers` batches are OCR'd at once. Batches are
+    # only formed when a call slot is free, so while every slot is busy pages pile up in
+    # the queue and the next batch is as full as the budget allows.
+    slots = asyncio.Semaphore(max(1, workers))
+    running: set = set()
+
+    async def run(batch: List[PageJob]) -> None:
+        try:
+            await _run_batch(batch, ctx, outq, next_stage)
+        finally:
+            slots.release()
+
+    try:
+        item = await _get(inq, name)
+        while item is not _DONE:
+            await slots.acquire()
+            batch, item = await _next_batch(inq, item)
+            task = asyncio.ensure_future(run(batch))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            if item is None:
+                item = await _get(inq, name)
+        await asyncio.gather(*running)
+    finally:
+        for task in running:
+            task.cancel()
+    await outq.put(_DONE)
+
+
+async def _feed(jobs: List[PageJob], q: asyncio.Queue, stage: str, window: asyncio.Semaphore) -> None:
+    for page in jobs:
+        await window.acquire()
+        await _put(q, stage, page)
+    await q.put(_DONE)
+
+
+def _copy_duplicate(page: PageJob) -> None:
+    first = page.duplicate_of
+    if first.error:
+        page.error = f"identical to {first.name}, which failed: {first.error}"
+    else:
+        page.text, page.repair, page.chunks = first.text, first.repair, first.chunks
+        OCR_CACHE.labels("upload").inc()
+    page.duplicate_of = None
+
+
+async def ocr_pages(sources: Iterable[Tuple[str, Callable[[], Union[bytes, str]]]], user_id: Optional[str]) -> AsyncIterator[PageJob]:
+    """
+    Run (name, load) page sources through the pipeline and yield the finished pages in
+    source order; `load` runs in a worker thread and returns the raw image bytes, or the
+    page's text when the source has it already (then only repair + embed run).
+    Use with contextlib.aclosing so the stages are cancelled if the caller stops early.
+    """
+    jobs = [PageJob(i, name, load) for i, (name, load) in enumerate(sources)]
+    ctx = _Context(user_id)
+    stages = _stages()
+    size = max(1, settings.OCR_PIPELINE_QUEUE_SIZE)
+    queues = [asyncio.Queue(maxsize=size) for _ in stages]
+    # the final queue is bounded by the window: everything in it holds a window slot
+    queues.append(asyncio.Queue())
+    window = asyncio.Semaphore(max(1, settings.OCR_PIPELINE_WINDOW))
+
+    tasks = [asyncio.ensure_future(_feed(jobs, queues[0], stages[0][0], window))]
+    for i, (name, fn, workers) in enumerate(stages):
+        next_stage = stages[i + 1][0] if i + 1 < len(stages) else None
+        runner = _ocr_batched_stage if name == "ocr" and settings.OCR_BATCHED else _stage
+        tasks.append(asyncio.ensure_future(runner(name, fn, workers, ctx, queues[i], queues[i + 1], next_stage)))
+
+    finished: dict = {}
+    next_index = 0
+    try:
+        while next_index < len(jobs):
+            page = await queues[-1].get()
+            if page is _DONE:
+                break
+            finished[page.index] = page
+            while next_index in finished:
+                page = finished.pop(next_index)
+                next_index += 1
+                if page.duplicate_of is not None:
+                    _copy_duplicate(page)
+                window.release()
+                yield page
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # pages left in the queues when the caller stops early never reach _get()
+        for (name, _, _), q in zip(stages, queues):
+            while not q.empty():
+                if q.get_nowait() is not _DONE:
+                    OCR_STAGE_QUEUE.labels(name).dec()
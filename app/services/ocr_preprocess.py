@@ -0,0 +1,201 @@
+from __future__ import annotations
+from dataclasses import dataclass, fields, replace
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.core.config import settings
+
+# Image preprocessing for OCR as a small stage pipeline:
+#   decode (grayscale; JPEG at reduced size) -> downscale -> [deskew] -> denoise
+#   -> [CLAHE] -> binarize -> encode
+# Downscaling comes first so every later filter works on the pixels that are actually
+# sent to the vision model instead of the full camera resolution. Stages are chosen by
+# OCR_PREPROCESS, e.g. "max_side=1600,deskew=true,denoise=median,binarize=otsu,format=webp,quality=80".
+
+DENOISE = ("bilateral", "median", "gaussian", "nlmeans", "none")
+BINARIZE = ("adaptive", "otsu", "none")
+FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    max_side: int = 1600         # longest output side in pixels (0 = keep)
+    deskew: bool = False
+    denoise: str = "bilateral"
+    clahe: bool = True
+    binarize: str = "adaptive"
+    format: str = "jpeg"
+    quality: int = 85            # jpeg / webp quality
+
+
+def parse_config(spec: str | None, base: PreprocessConfig = PreprocessConfig()) -> PreprocessConfig:
+    values = {}
+    types = {f.name: f.type for f in fields(PreprocessConfig)}
+    for part in (spec or "").split(","):
+        k, sep, v = part.partition("=")
+        k, v = k.strip(), v.strip().lower()
+        if not sep or not k:
+            continue
+        if k not in types:
+            raise ValueError(f"unknown preprocessing option '{k}'")
+        if types[k] == "int":
+            values[k] = int(v)
+        elif types[k] == "bool":
+            values[k] = v in {"1", "true", "t", "yes", "y", "on"}
+        else:
+            values[k] = v
+    cfg = replace(base, **values)
+    if cfg.denoise not in DENOISE:
+        raise ValueError(f"denoise must be one of {DENOISE}")
+    if cfg.binarize not in BINARIZE:
+        raise ValueError(f"binarize must be one of {BINARIZE}")
+    if cfg.format not in FORMATS:
+        raise ValueError(f"format must be one of {tuple(FORMATS)}")
+    return cfg
+
+
+@lru_cache(maxsize=1)
+def default_config() -> PreprocessConfig:
+    return parse_config(settings.OCR_PREPROCESS)
+
+
+# ---------- stages ----------
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+
+def _decode_flag(data: bytes, max_side: int) -> int:
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale for a fraction of the cost; use the
+    # smallest one that still leaves at least max_side pixels for downscale() to work with
+    if not max_side or data[:2] != b"\xff\xd8":
+        return cv2.IMREAD_GRAYSCALE
+    try:
+        size = max(Image.open(BytesIO(data)).size)  # header only
+    except Exception:
+        return cv2.IMREAD_GRAYSCALE
+    for factor, flag in _REDUCED:
+        if size // factor >= max_side:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode(image: Union[Path, bytes], max_side: int = 0) -> np.ndarray:
+    """Decode straight to grayscale (every later stage works on one channel)."""
+    if isinstance(image, (bytes, bytearray)):
+        # encoded image straight from an upload / zip member, no temp file; like
+        # IMREAD_GRAYSCALE the reduced modes also apply the EXIF orientation of phone photos
+        flag = _decode_flag(image, max_side)
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flag)
+        if img is None:
+            raise ValueError("unsupported or corrupted image")
+    else:
+        img = cv2.imread(str(image), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise FileNotFoundError(image)
+    return img
+
+
+def downscale(img: np.ndarray, max_side: int) -> np.ndarray:
+    h, w = img.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return img
+    scale = max_side / max(h, w)
+    return cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def deskew(gray: np.ndarray, max_angle: float = 15.0) -> np.ndarray:
+    # angle of the minimum-area rectangle around the ink; small rotations only, so a
+    # page that is mostly empty or intentionally rotated is left alone
+    ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    coords = cv2.findNonZero(ink)
+    if coords is None or len(coords) < 100:
+        return gray
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 0.3 or abs(angle) > max_angle:
+        return gray
+    h, w = gray.shape
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(gray, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def denoise(gray: np.ndarray, method: str) -> np.ndarray:
+    if method == "bilateral":
+        return cv2.bilateralFilter(gray, d=5, sigmaColor=30, sigmaSpace=30)
+    if method == "median":
+        return cv2.medianBlur(gray, 3)
+    if method == "gaussian":
+        return cv2.GaussianBlur(gray, (3, 3), 0)
+    if method == "nlmeans":
+        return cv2.fastNlMeansDenoising(gray, None, h=10, templateWindowSize=7, searchWindowSize=21)
+    return gray
+
+
+def binarize(gray: np.ndarray, method: str) -> np.ndarray:
+    if method == "adaptive":
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    if method == "otsu":
+        return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return gray
+
+
+def encode(img: np.ndarray, fmt: str, quality: int) -> bytes:
+    params = []
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    ok, buf = cv2.imencode(FORMATS[fmt], img, params)
+    if not ok:
+        raise ValueError(f"could not encode image as {fmt}")
+    return buf.tobytes()
+
+
+def dhash(gray: np.ndarray, size: int = 16) -> bytes:
+    """256-bit difference hash: survives re-encoding, resizing and small exposure changes."""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+
+
+def hamming(a: bytes, b: bytes) -> int:
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).bit_count()
+
+
+def run_pipeline(image: Union[Path, bytes], cfg: PreprocessConfig) -> bytes:
+    return _process(decode(image, cfg.max_side), cfg)
+
+
+def run_pipeline_with_hash(image: Union[Path, bytes], cfg: PreprocessConfig) -> Tuple[bytes, bytes]:
+    """(dhash of the page, preprocessed image) from a single decode."""
+    gray = decode(image, cfg.max_side)
+    return dhash(gray), _process(gray, cfg)
+
+
+def _process(gray: np.ndarray, cfg: PreprocessConfig) -> bytes:
+    gray = downscale(gray, cfg.max_side)
+    if cfg.deskew:
+        gray = deskew(gray)
+    gray = denoise(gray, cfg.denoise)
+    if cfg.clahe:
+        gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    return encode(binarize(gray, cfg.binarize), cfg.format, cfg.quality)
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """(width, height) from the image header, without decoding the pixels."""
+    return Image.open(BytesIO(data)).size
+
+
+def mime_type(data: bytes) -> str:
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
@@ -1,7 +1,8 @@
 import json, re
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
 from app.core.config import settings
+from app.services import llm_gateway
+from app.services.llm_scheduler import OCR
 
 MODEL_OCR_REPAIR = "gpt-4o-mini"
 MAX_TOKENS_OCR_REPAIR = getattr(settings, "MAX_TOKENS_OCR_REPAIR", 260)
@@ -66,7 +67,7 @@ Return STRICT JSON:
 """
 
 
-def suggest_repair_for_text(text: str, subject: Optional[str] = None) -> Dict[str, Any]:
+async def suggest_repair_for_text(text: str, subject: Optional[str] = None, priority: int = OCR) -> Dict[str, Any]:
     sents = sentences(text)
     if not any(has_ocr_gap(s) for s in sents):
         return {
@@ -74,7 +75,6 @@ def suggest_repair_for_text(text: str, subject: Optional[str] = None) -> Dict[st
             "log": [{"info": "no_gaps_detected"}],  
         }
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
     repaired_sents: List[str] = []
     log: List[Dict[str, Any]] = []
 
@@ -90,8 +90,10 @@ def suggest_repair_for_text(text: str, subject: Optional[str] = None) -> Dict[st
         }
         prompt = _user_prompt(ctx, subject or SUBJECT)
 
-        resp = client.chat.completions.create(
+        resp = await llm_gateway.chat_completion(
             model=MODEL_OCR_REPAIR,
+            priority=priority,
+            feature="ocr_repair",
             messages=[{"role":"system","content":SYSTEM},{"role":"user","content":prompt}],
             temperature=0,
             max_tokens=MAX_TOKENS_OCR_REPAIR,
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from app.core.config import settings
 from .nlp_runtime import load_nlp
 
 BULLET_RE = re.compile(r"^\s*(?:[-*•·]\s+|\d+[.)]\s+)", re.M)                 # bullets / numbered
@@ -29,14 +30,11 @@ def split_paragraphs(text: str) -> List[str]:
         return []
     return [p.strip() for p in re.split(r"\n\s*\n+", text) if p.strip()]
 
-def spacy_sentences(paragraph: str) -> List[str]:
+def _naive_sentences(paragraph: str) -> List[str]:
+    # fallback: naive split on punctuation + space
+    return re.split(r"(?<=[\.\!\?\:;])\s+", paragraph.strip())
 
-    nlp = load_nlp()
-    if not nlp:
-        # fallback: naive split on punctuation + space
-        return re.split(r"(?<=[\.\!\?\:;])\s+", paragraph.strip())
-    doc = nlp(paragraph) 
-    sents = [s.text.strip() for s in doc.sents]
+def _join_fragments(sents: List[str]) -> List[str]:
     # Join micro-fragments (very short) to next sentence 
     out: List[str] = []
     buf = ""
@@ -52,6 +50,26 @@ def spacy_sentences(paragraph: str) -> List[str]:
         out.append(buf)
     return [s for s in out if s]
 
+def spacy_sentences_batch(paragraphs: List[str], n_process: Optional[int] = None) -> List[List[str]]:
+    """
+    Sentence-split many paragraphs in one nlp.pipe pass instead of one nlp() call each.
+    Very large notes can be spread over SPACY_N_PROCESS worker processes.
+    """
+    if not paragraphs:
+        return []
+    nlp = load_nlp()
+    if not nlp:
+        return [_naive_sentences(p) for p in paragraphs]
+    if n_process is None:
+        n_process = 1
+        if sum(len(p) for p in paragraphs) >= settings.SPACY_N_PROCESS_MIN_CHARS:
+            n_process = max(1, settings.SPACY_N_PROCESS)
+    docs = nlp.pipe(paragraphs, batch_size=settings.SPACY_BATCH_SIZE, n_process=n_process)
+    return [_join_fragments([s.text.strip() for s in doc.sents]) for doc in docs]
+
+def spacy_sentences(paragraph: str) -> List[str]:
+    return spacy_sentences_batch([paragraph], n_process=1)[0]
+
 # block classification
 def _looks_like_heading(block: str) -> bool:
     single_line = block.strip().replace("—", "-")
@@ -90,9 +108,8 @@ def to_blocks_with_sentences(text: str) -> List[Dict[str, Any]]:
     cleaned = soft_unwrap_keep_paragraphs(text)
     paras = split_paragraphs(cleaned)
     blocks: List[Dict[str, Any]] = []
-    for p in paras:
+    for p, sents in zip(paras, spacy_sentences_batch(paras)):
         btype = classify_block(p)
-        sents = spacy_sentences(p)
         blocks.append({"type": btype, "text": p, "sentences": sents})
     return blocks
 
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import math
+import threading
+from io import BytesIO
+from typing import Any, BinaryIO, Union
+
+from app.core.config import settings
+from app.services.ocr_preprocess import default_config
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# PDF pages as sources for the OCR pipeline (app/api/ocr_pdf.py). load_page() opens one
+# page, returns its text layer if it has one, and otherwise renders just that page to a
+# grayscale image, so a PDF is never rasterized as a whole. pdfium is not thread-safe,
+# so every call into it holds _lock.
+
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    return pdfium is not None
+
+
+def open_pdf(f: BinaryIO) -> Any:
+    """Open a PDF from a seekable file object (read lazily, not loaded into memory)."""
+    with _lock:
+        try:
+            return pdfium.PdfDocument(f)
+        except pdfium.PdfiumError as e:
+            raise ValueError(f"invalid or unreadable PDF: {e}") from e
+
+
+def page_count(doc: Any) -> int:
+    with _lock:
+        return len(doc)
+
+
+def close_pdf(doc: Any) -> None:
+    with _lock:
+        doc.close()
+
+
+def _render_scale(width_pt: float, height_pt: float) -> float:
+    scale = settings.PDF_RENDER_DPI / 72
+    max_side = default_config().max_side
+    if max_side:
+        # preprocessing would throw the extra pixels away again
+        scale = min(scale, max_side / max(width_pt, height_pt))
+    # memory budget of one rendered page, one byte per pixel
+    pixels = width_pt * height_pt * scale * scale
+    if pixels > settings.PDF_MAX_PAGE_PIXELS:
+        scale *= math.sqrt(settings.PDF_MAX_PAGE_PIXELS / pixels)
+    return scale
+
+
+def load_page(doc: Any, index: int) -> Union[bytes, str]:
+    """The page's text layer if it has at least PDF_TEXT_MIN_CHARS, else the page as a grayscale BMP."""
+    with _lock:
+        page = doc[index]
+        try:
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range().replace("\r\n", "\n").strip()
+            finally:
+                textpage.close()
+            if len(text) >= settings.PDF_TEXT_MIN_CHARS:
+                return text
+            width, height = page.get_size()
+            image = page.render(scale=_render_scale(width, height), grayscale=True).to_pil()
+        finally:
+            page.close()
+    # uncompressed: cheap to write here and to decode again in preprocessing
+    buf = BytesIO()
+    image.save(buf, format="BMP")
+    return buf.getvalue()
@@ -1,17 +1,16 @@
 from typing import List, Optional, Dict, Any
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-from openai import OpenAI
 
-from app.core.config import settings
+from app.services import llm_gateway
+from app.services.llm_scheduler import INTERACTIVE
 
 DEFAULT_MODEL = "text-embedding-3-small"
 
-def embed_query(query: str, model: Optional[str] = None) -> list[float]:
+async def embed_query(query: str, model: Optional[str] = None, feature: str = "search") -> list[float]:
     """Return embedding vector for a search query using OpenAI."""
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
     model = model or DEFAULT_MODEL
-    resp = client.embeddings.create(model=model, input=query)
+    resp = await llm_gateway.embeddings(model=model, input=query, priority=INTERACTIVE, feature=feature)
     return resp.data[0].embedding
 
 def semantic_search_best_chunk_per_note(
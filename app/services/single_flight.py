@@ -0,0 +1,140 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import secrets
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict
+
+from prometheus_client import Counter
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, report_redis_error
+
+# Single-flight for expensive generation requests (double clicks, client retries).
+# Identical concurrent requests - same user, endpoint and normalized payload - share
+# one upstream call:
+#   - inside a worker, followers await the leader's task;
+#   - across workers, a Redis SET NX lock elects the leader and followers poll for
+#     the result it publishes under its lock token (kept SINGLE_FLIGHT_RESULT_TTL).
+# Only requests that arrive while the leader is running share its result: a finished
+# result is never replayed, so a deliberate regenerate gets a new one, and the behaviour
+# is the same with or without Redis (without it, coalescing is per worker).
+
+SINGLE_FLIGHT = Counter(
+    "single_flight_requests_total",
+    "Generation requests by single-flight role",
+    ["endpoint", "role"],  # leader | local_follower | remote_follower
+)
+
+_KEY_PREFIX = "sf:v2"
+_POLL_SECONDS = 0.1
+
+# delete the lock only if we still own it
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_normalize(v) for v in value]
+        # order of e.g. item types does not change the request
+        return sorted(items) if all(isinstance(v, str) for v in items) else items
+    return value
+
+
+def request_key(user_id: Any, endpoint: str, payload: Any) -> str:
+    data = payload.model_dump(mode="json") if hasattr(payload, "model_dump") else payload
+    raw = json.dumps(_normalize(data), sort_keys=True, separators=(",", ":"), default=str)
+    return f"{user_id}:{endpoint}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+async def run(key: str, fn: Callable[[], Awaitable[Any]], endpoint: str = "") -> Any:
+    """Run fn() once for all concurrent callers with the same key; everyone gets its result."""
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return await fn()
+
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    task = inflight.get(key)
+    if task is not None:
+        SINGLE_FLIGHT.labels(endpoint, "local_follower").inc()
+        await asyncio.wait({task})
+        if task.cancelled():
+            # the leader's client went away; start over (one of us becomes the new leader)
+            return await run(key, fn, endpoint)
+        return task.result()
+
+    task = asyncio.get_running_loop().create_task(_run_distributed(key, fn, endpoint))
+    inflight[key] = task
+    try:
+        return await task
+    finally:
+        if inflight.get(key) is task:
+            del inflight[key]
+
+
+async def _run_distributed(key: str, fn: Callable[[], Awaitable[Any]], endpoint: str) -> Any:
+    r = get_redis()
+    if r is None:
+        SINGLE_FLIGHT.labels(endpoint, "leader").inc()
+        return await fn()
+
+    lock_key, result_key = f"{_KEY_PREFIX}:lock:{key}", f"{_KEY_PREFIX}:result:{key}"
+    token = secrets.token_hex(8)
+    while True:
+        try:
+            acquired = await r.set(lock_key, token, nx=True, px=int(settings.SINGLE_FLIGHT_LOCK_TTL * 1000))
+            if not acquired:
+                leader = await r.get(lock_key)
+                if leader is None:
+                    continue  # the leader just finished: try to take over
+                wait_key = f"{result_key}:{leader.decode()}"
+        except Exception as e:
+            report_redis_error(e)
+            SINGLE_FLIGHT.labels(endpoint, "leader").inc()
+            return await fn()
+
+        if acquired:
+            SINGLE_FLIGHT.labels(endpoint, "leader").inc()
+            try:
+                result = await fn()
+                try:
+                    await r.set(f"{result_key}:{token}", json.dumps(result, default=str), ex=settings.SINGLE_FLIGHT_RESULT_TTL)
+                except Exception as e:
+                    report_redis_error(e)
+                return result
+            finally:
+                try:
+                    await r.eval(_RELEASE, 1, lock_key, token)
+                except Exception as e:
+                    report_redis_error(e)
+
+        # another worker is generating: wait for its result, or for the lock to vanish
+        # (leader failed / timed out), then try again
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TTL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_SECONDS)
+            try:
+                # the leader publishes before it releases the lock, so check the lock first
+                released = not await r.exists(lock_key)
+                raw = await r.get(wait_key)
+                if raw is not None:
+                    SINGLE_FLIGHT.labels(endpoint, "remote_follower").inc()
+                    return json.loads(raw)
+                if released:
+                    break
+            except Exception as e:
+                report_redis_error(e)
+                SINGLE_FLIGHT.labels(endpoint, "leader").inc()
+                return await fn()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, report_redis_error
+from app.services.llm_clients import get_async_openai_client, get_openai_client
+from app.services.nlp_runtime import load_nlp
+from app.services.ocr import warm_preprocess_pool
+from app.services.parser import spacy_sentences_batch
+
+# Startup warm-up: build the expensive, lazily-created resources (spaCy pipeline,
+# OCR preprocessing processes, pooled LLM clients, Redis connection) right after the
+# app starts instead of on the first request that needs them. Runs in the background
+# so the process starts serving immediately; GET /ready reports when every step has
+# finished.
+
+_steps: Dict[str, Dict[str, Any]] = {}
+_ready = False
+
+
+def _warm_spacy() -> str:
+    nlp = load_nlp()
+    if nlp is None:
+        return "spacy not installed, using the naive sentence splitter"
+    spacy_sentences_batch(["Warm-up sentence one. And a second one."], n_process=1)
+    return ",".join(nlp.pipe_names)
+
+
+def _warm_ocr_pool() -> str:
+    return f"{warm_preprocess_pool()} worker(s)"
+
+
+def _warm_sync_llm_client() -> str:
+    if not settings.OPENAI_API_KEY:
+        return "skipped, no OPENAI_API_KEY"
+    get_openai_client()
+    return settings.OPENAI_BASE_URL or "default"
+
+
+async def _warm_async_llm_client() -> str:
+    # per event loop, so it has to be created on the serving loop
+    if not settings.OPENAI_API_KEY:
+        return "skipped, no OPENAI_API_KEY"
+    get_async_openai_client()
+    return settings.OPENAI_BASE_URL or "default"
+
+
+async def _warm_redis() -> str:
+    r = get_redis()
+    if r is None:
+        return "disabled"
+    try:
+        await r.ping()
+    except Exception as e:
+        report_redis_error(e)
+        return "unavailable"
+    return "connected"
+
+
+# (name, fn, runs in a worker thread)
+_STEPS: List[Tuple[str, Callable[[], Any], bool]] = [
+    ("spacy", _warm_spacy, True),
+    ("ocr_pool", _warm_ocr_pool, True),
+    ("llm_client", _warm_sync_llm_client, True),
+    ("llm_async_client", _warm_async_llm_client, False),
+    ("redis", _warm_redis, False),
+]
+
+
+async def _run_step(name: str, fn: Callable[[], Any], threaded: bool) -> None:
+    _steps[name] = {"status": "running"}
+    t0 = time.perf_counter()
+    try:
+        detail = await asyncio.to_thread(fn) if threaded else await fn()
+        _steps[name] = {"status": "ok", "detail": detail}
+    except Exception as e:
+        # a failed warm-up only means the resource is built lazily on first use instead
+        print("warm-up step failed", name, "->", e)
+        _steps[name] = {"status": "failed", "error": str(e) or type(e).__name__}
+    _steps[name]["seconds"] = round(time.perf_counter() - t0, 3)
+
+
+async def run_warmup() -> None:
+    global _ready
+    if not settings.WARMUP_ENABLED:
+        _ready = True
+        return
+    for name, _, _ in _STEPS:
+        _steps[name] = {"status": "pending"}
+    try:
+        await asyncio.gather(*(_run_step(name, fn, threaded) for name, fn, threaded in _STEPS))
+    finally:
+        _ready = True
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def status() -> Dict[str, Any]:
+    return {"ready": is_ready(), "steps": dict(_steps)}
@@ -0,0 +1,357 @@
+"""
+Local stand-in for the OpenAI API, for offline load and latency testing.
+
+    uvicorn app.stub.openai_stub:app --port 8100
+    OPENAI_STUB=true uvicorn app.main:app --port 8000     # point the app at it
+
+Speaks the chat-completions (plain, json_schema, image inputs, streaming) and
+embeddings wire formats. Output is deterministic: the same request always gets the
+same body, and json_schema requests get an instance that validates against the schema.
+
+Environment knobs (all optional):
+    STUB_SEED                 seed for latency / error sampling (default 0)
+    STUB_LATENCY              latency spec for every endpoint, e.g.
+                                fixed:200 | uniform:100,400 | normal:300,50 | lognormal:300,0.5
+                              (milliseconds; lognormal is median,sigma)
+    STUB_LATENCY_EMBEDDINGS   override for /v1/embeddings
+    STUB_LATENCY_VISION       override for chat requests that contain images
+    STUB_STREAM_CHUNK_MS      delay between streamed chunks (default 15)
+    STUB_ERROR_RATE           fraction of requests answered with HTTP 500
+    STUB_RATE_LIMIT_RATE      fraction of requests answered with HTTP 429
+    STUB_RETRY_AFTER          Retry-After seconds sent with 429s (default 1)
+    STUB_EMBED_DIM            embedding size when the request has no `dimensions` (default 1536)
+    STUB_BATCH_INDEX          `index` of the entries of batched replies (`pages`, `blocks`):
+                                position (default, 0..n-1 in order) | shuffle (same indices,
+                                entries out of order) | duplicate (one index repeated)
+"""
+from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="OpenAI stub", version="1.0.0")
+
+_rng = random.Random(int(os.getenv("STUB_SEED", "0")))
+
+WORDS = (
+    "cell energy membrane protein force mass velocity vector matrix equation "
+    "photosynthesis chloroplast osmosis gradient reaction enzyme substrate theory "
+    "function derivative integral limit atom bond electron molecule pressure volume"
+).split()
+
+
+# ---------- latency / fault injection ----------
+
+def _parse_latency(spec: Optional[str]):
+    spec = (spec or "fixed:0").strip().lower()
+    kind, _, args = spec.partition(":")
+    nums = [float(x) for x in args.split(",") if x.strip()] or [0.0]
+    if kind == "uniform":
+        lo, hi = nums[0], nums[1] if len(nums) > 1 else nums[0]
+        return lambda: _rng.uniform(lo, hi)
+    if kind == "normal":
+        mu, sd = nums[0], nums[1] if len(nums) > 1 else 0.0
+        return lambda: max(0.0, _rng.gauss(mu, sd))
+    if kind == "lognormal":
+        median, sigma = nums[0], nums[1] if len(nums) > 1 else 0.5
+        return lambda: _rng.lognormvariate(math.log(max(median, 1e-6)), sigma)
+    return lambda: nums[0]
+
+
+_LATENCY = {
+    "chat": _parse_latency(os.getenv("STUB_LATENCY")),
+    "vision": _parse_latency(os.getenv("STUB_LATENCY_VISION") or os.getenv("STUB_LATENCY")),
+    "embeddings": _parse_latency(os.getenv("STUB_LATENCY_EMBEDDINGS") or os.getenv("STUB_LATENCY")),
+}
+STREAM_CHUNK_MS = float(os.getenv("STUB_STREAM_CHUNK_MS", "15"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+RATE_LIMIT_RATE = float(os.getenv("STUB_RATE_LIMIT_RATE", "0"))
+RETRY_AFTER = os.getenv("STUB_RETRY_AFTER", "1")
+EMBED_DIM = int(os.getenv("STUB_EMBED_DIM", "1536"))
+BATCH_INDEX = os.getenv("STUB_BATCH_INDEX", "position").strip().lower()
+
+
+def _error(status: int, message: str, err_type: str, headers: Optional[dict] = None) -> JSONResponse:
+    body = {"error": {"message": message, "type": err_type, "param": None, "code": None}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+async def _inject(kind: str) -> Optional[JSONResponse]:
+    await asyncio.sleep(_LATENCY[kind]() / 1000.0)
+    roll = _rng.random()
+    if roll < RATE_LIMIT_RATE:
+        return _error(429, "Rate limit reached (stub)", "rate_limit_exceeded", {"retry-after": RETRY_AFTER})
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        return _error(500, "Injected server error (stub)", "server_error")
+    return None
+
+
+# ---------- deterministic content ----------
+
+def _seed_of(*parts: Any) -> int:
+    raw = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(raw).digest()[:8], "big")
+
+
+def _words(r: random.Random, n: int) -> str:
+    return " ".join(r.choice(WORDS) for _ in range(n))
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _resolve(node: dict, root: dict) -> dict:
+    ref = node.get("$ref")
+    if isinstance(ref, str) and ref.startswith("#/"):
+        target: Any = root
+        for part in ref[2:].split("/"):
+            target = target.get(part, {})
+        return _resolve(target, root)
+    return node
+
+
+def _instance(
+    node: dict, root: dict, r: random.Random, name: str = "", top_n: Optional[int] = None, pos: Optional[int] = None,
+) -> Any:
+    """Build a value that validates against a (strict) JSON schema node; `pos` is the position of an array item."""
+    node = _resolve(node, root)
+    if "const" in node:
+        return node["const"]
+    if "enum" in node:
+        return r.choice(node["enum"])
+    for key in ("anyOf", "oneOf"):
+        options = [o for o in node.get(key) or [] if _resolve(o, root).get("type") != "null"]
+        if options:
+            return _instance(r.choice(options), root, r, name)
+    if "allOf" in node and node["allOf"]:
+        return _instance(node["allOf"][0], root, r, name)
+
+    t = node.get("type")
+    if isinstance(t, list):
+        non_null = [x for x in t if x != "null"]
+        t = non_null[0] if non_null else "null"
+
+    if t == "object":
+        props = node.get("properties") or {}
+        return {k: _instance(v, root, r, k, pos=pos) for k, v in props.items()}
+    if t == "array":
+        lo = int(node.get("minItems", 0))
+        hi = int(node.get("maxItems", max(lo, 50)))
+        if top_n is not None:
+            n = top_n
+        elif name in ("choices", "options"):
+            n = 4
+        else:
+            n = 3
+        n = max(lo, min(hi, n))
+        return [_instance(node.get("items") or {"type": "string"}, root, r, name, pos=i) for i in range(n)]
+    if t == "integer":
+        if "index" in name:
+            # an item's `index` is its position, like a model that follows the instructions
+            return pos if pos is not None else r.randint(0, 3)
+        return r.randint(0, 100)
+    if t == "number":
+        return round(r.random(), 3)
+    if t == "boolean":
+        return r.random() < 0.5
+    if t == "null":
+        return None
+    if name in ("question", "front"):
+        return _words(r, 6).capitalize() + "?"
+    return _words(r, 8).capitalize() + "."
+
+
+def _requested_count(text: str) -> Optional[int]:
+    m = re.search(r"\b(?:Create|exactly|Generate)\s+(?:exactly\s+)?(\d{1,3})\b", text, flags=re.I)
+    return max(1, min(50, int(m.group(1)))) if m else None
+
+
+def _flatten(messages: List[dict]) -> tuple[str, str, int]:
+    """(system text, user text, number of images)"""
+    system, user, images = [], [], 0
+    for m in messages:
+        content = m.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for p in parts:
+            if p.get("type") == "image_url":
+                images += 1
+            elif p.get("type") == "text":
+                (system if m.get("role") == "system" else user).append(p.get("text") or "")
+    return "\n".join(system), "\n".join(user), images
+
+
+def _schema_content(body: dict, user_text: str, r: random.Random) -> str:
+    js = (body.get("response_format") or {}).get("json_schema") or {}
+    schema = js.get("schema") or {"type": "object", "properties": {}}
+    n = _requested_count(user_text)
+    props = schema.get("properties") or {}
+    # the root array (quiz `items`, flashcard `items`, batched `pages`/`blocks`) gets the requested length
+    out = {}
+    for k, v in props.items():
+        resolved = _resolve(v, schema)
+        is_array = resolved.get("type") == "array" or "array" in (resolved.get("type") or [])
+        out[k] = _instance(v, schema, r, k, top_n=n if is_array else None)
+        if is_array and len(out[k]) > 1 and all(isinstance(e, dict) and "index" in e for e in out[k]):
+            _scramble(out[k])
+    return json.dumps(out)
+
+
+def _scramble(entries: List[dict]) -> None:
+    # STUB_BATCH_INDEX: reply the way a sloppy model might, to exercise the callers' checks
+    if BATCH_INDEX == "shuffle":
+        entries.reverse()
+    elif BATCH_INDEX == "duplicate":
+        entries[-1]["index"] = entries[0]["index"]
+
+
+def _text_content(system: str, user: str, images: int, max_tokens: Optional[int], r: random.Random) -> str:
+    if images:
+        pages = []
+        for i in range(images):
+            lines = [_words(r, r.randint(4, 9)) for _ in range(r.randint(4, 8))]
+            if r.random() < 0.25:
+                lines[r.randrange(len(lines))] += " (?)"
+            pages.append("\n".join(lines))
+        return "\n\n".join(pages)
+    if "JSON array" in system or "JSON array" in user:
+        if r.random() < 0.5:
+            return "[]"
+        return json.dumps([{
+            "quote": _words(r, 4), "issue": "clarity", "why": _words(r, 6),
+            "suggested_fix": _words(r, 5), "location": "paragraph 1",
+        }])
+    if '"repaired"' in user:
+        m = re.search(r"Current sentence:\s*(.*)", user)
+        curr = (m.group(1) if m else "").strip()
+        fill = r.choice(WORDS)
+        return json.dumps({
+            "repaired": curr.replace("(?)", fill).replace("...", fill),
+            "fills": [{"placeholder": "(?)", "replacement": fill, "confidence": 0.5}],
+        })
+    if max_tokens is not None and max_tokens <= 16:
+        return r.choice(["biology", "physics", "chemistry", "algebra", "history"])
+    n = max(5, min(60, (max_tokens or 120) // 4))
+    return _words(r, n).capitalize() + "."
+
+
+def _completion(body: dict, content: str, prompt_tokens: int) -> dict:
+    return {
+        "id": "chatcmpl-stub-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:12],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "stub",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+            "logprobs": None,
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _tokens(content),
+            "total_tokens": prompt_tokens + _tokens(content),
+        },
+    }
+
+
+async def _stream(body: dict, content: str, prompt_tokens: int):
+    cid = "chatcmpl-stub-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    base = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model") or "stub"}
+    step = 16
+    for i in range(0, len(content), step):
+        chunk = dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}])
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(STREAM_CHUNK_MS / 1000.0)
+    final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield f"data: {json.dumps(final)}\n\n"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": _tokens(content),
+                 "total_tokens": prompt_tokens + _tokens(content)}
+        yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+    else:
+        yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+# ---------- endpoints ----------
+
+@app.get("/v1/models")
+def models():
+    return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "stub"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    system, user, images = _flatten(messages)
+
+    err = await _inject("vision" if images else "chat")
+    if err is not None:
+        return err
+
+    r = random.Random(_seed_of(body.get("model"), messages, body.get("response_format"), body.get("max_tokens")))
+    rf = body.get("response_format") or {}
+    if rf.get("type") == "json_schema":
+        content = _schema_content(body, user, r)
+    elif rf.get("type") == "json_object":
+        content = json.dumps({"result": _words(r, 6)})
+    else:
+        content = _text_content(system, user, images, body.get("max_tokens"), r)
+
+    prompt_tokens = _tokens(system + user) + 85 * images
+    if body.get("stream"):
+        return StreamingResponse(_stream(body, content, prompt_tokens), media_type="text/event-stream")
+    return _completion(body, content, prompt_tokens)
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    r = random.Random(_seed_of("emb", text))
+    vec = [r.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    err = await _inject("embeddings")
+    if err is not None:
+        return err
+
+    inputs = body.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dim = int(body.get("dimensions") or EMBED_DIM)
+    data: List[Dict[str, Any]] = []
+    for i, text in enumerate(inputs or []):
+        vec = _embedding(str(text), dim)
+        if body.get("encoding_format") == "base64":
+            emb: Any = base64.b64encode(struct.pack(f"<{dim}f", *vec)).decode("ascii")
+        else:
+            emb = vec
+        data.append({"object": "embedding", "index": i, "embedding": emb})
+    tokens = sum(_tokens(str(t)) for t in inputs or [])
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model") or "text-embedding-3-small",
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("STUB_HOST", "127.0.0.1"), port=int(os.getenv("STUB_PORT", "8100")))